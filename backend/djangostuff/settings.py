@@ -2,6 +2,9 @@ from pathlib import Path
 from dotenv import load_dotenv
 load_dotenv()
 import os
+from importlib.util import find_spec
+
+from django.core.exceptions import ImproperlyConfigured
 
 BASE_DIR = Path(__file__).resolve().parent.parent
 
@@ -36,14 +39,36 @@ CSRF_TRUSTED_ORIGINS = [
 # REST Framework settings
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': [
-        'rest_framework.authentication.TokenAuthentication',
+        'users.authentication.CachedTokenAuthentication',
         'rest_framework.authentication.SessionAuthentication',
     ],
     'DEFAULT_PERMISSION_CLASSES': [
         'rest_framework.permissions.AllowAny',
     ],
+    # orjson for application/json when installed (same bytes as JSONRenderer),
+    # MessagePack for Accept: application/msgpack when msgpack is installed
+    'DEFAULT_RENDERER_CLASSES': [
+        'myapp.renderers.ORJSONRenderer',
+        'rest_framework.renderers.JSONRenderer',
+        *(['myapp.renderers.MessagePackRenderer'] if find_spec('msgpack') else []),
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ],
+    'DEFAULT_PARSER_CLASSES': [
+        'rest_framework.parsers.JSONParser',
+        *(['myapp.parsers.MessagePackParser'] if find_spec('msgpack') else []),
+        'rest_framework.parsers.FormParser',
+        'rest_framework.parsers.MultiPartParser',
+    ],
     'DEFAULT_PAGINATION_CLASS': 'rest_framework.pagination.PageNumberPagination',
-    'PAGE_SIZE': 100
+    'PAGE_SIZE': 100,
+    # For users.throttling on login and register
+    'DEFAULT_THROTTLE_RATES': {
+        'auth_ip': os.environ.get('AUTH_IP_RATE', '20/min'),
+        'auth_email': os.environ.get('AUTH_EMAIL_RATE', '5/min'),
+    },
+    # Proxies in front of the app, so throttles key on the client's IP from
+    # X-Forwarded-For rather than on the header as a whole
+    'NUM_PROXIES': int(os.environ['NUM_PROXIES']) if os.environ.get('NUM_PROXIES') else None,
 }
 
 # Application definition
@@ -62,8 +87,10 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'myapp.middleware.RequestMetricsMiddleware',  # First, so it times everything below
     'django.middleware.security.SecurityMiddleware',
-    'whitenoise.middleware.WhiteNoiseMiddleware',  # For static files
+    'myapp.middleware.WhiteNoiseMiddleware',  # For static files, async-capable
+    'myapp.middleware.CompressionMiddleware',  # Below WhiteNoise, which compresses its own files
     'django.contrib.sessions.middleware.SessionMiddleware',
     'corsheaders.middleware.CorsMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -93,6 +120,10 @@ TEMPLATES = [
 WSGI_APPLICATION = 'djangostuff.wsgi.application'
 
 # Database
+# Connections are kept for DB_CONN_MAX_AGE seconds and checked before reuse.
+# Under ASGI, where every request runs its queries in a new thread, set
+# DB_CONN_MAX_AGE=0 and use DB_POOL instead.
+CONN_MAX_AGE = int(os.environ.get('DB_CONN_MAX_AGE', 60))
 if os.environ.get('DB_NAME'):
     DATABASES = {
         'default': {
@@ -102,15 +133,130 @@ if os.environ.get('DB_NAME'):
             'PASSWORD': os.environ.get('DB_PASSWORD'),
             'HOST': os.environ.get('DB_HOST'),
             'PORT': os.environ.get('DB_PORT', '5432'),
+            'CONN_MAX_AGE': CONN_MAX_AGE,
+            'CONN_HEALTH_CHECKS': True,
         }
     }
+    # psycopg 3's connection pool (pip install "psycopg[pool]"), in place of
+    # persistent connections
+    if os.environ.get('DB_POOL', 'False') == 'True':
+        if not find_spec('psycopg_pool'):
+            raise ImproperlyConfigured('DB_POOL needs psycopg 3 with its pool: pip install "psycopg[pool]"')
+        DATABASES['default']['CONN_MAX_AGE'] = 0
+        DATABASES['default']['OPTIONS'] = {'pool': {
+            'min_size': int(os.environ.get('DB_POOL_MIN_SIZE', 2)),
+            'max_size': int(os.environ.get('DB_POOL_MAX_SIZE', 10)),
+            'timeout': int(os.environ.get('DB_POOL_TIMEOUT', 10)),
+        }}
+    # A streaming replica of the same database
+    if os.environ.get('DB_REPLICA_HOST'):
+        DATABASES['replica'] = {
+            **DATABASES['default'],
+            'HOST': os.environ.get('DB_REPLICA_HOST'),
+            'PORT': os.environ.get('DB_REPLICA_PORT', DATABASES['default']['PORT']),
+        }
 else:
     DATABASES = {
         'default': {
             'ENGINE': 'django.db.backends.sqlite3',
             'NAME': BASE_DIR / 'db.sqlite3',
+            'CONN_MAX_AGE': CONN_MAX_AGE,
+            'CONN_HEALTH_CHECKS': True,
+            # Take the write lock at BEGIN: a transaction that reads first and
+            # writes later otherwise fails at once ("database is locked")
+            # when another thread, e.g. the purge, is writing
+            'OPTIONS': {'transaction_mode': 'IMMEDIATE'},
+        }
+    }
+    # A second SQLite file standing in for a replica locally, e.g. a copy of
+    # db.sqlite3 (which then lags by however old the copy is)
+    if os.environ.get('DB_REPLICA_PATH'):
+        DATABASES['replica'] = {**DATABASES['default'], 'NAME': os.environ.get('DB_REPLICA_PATH')}
+
+# Safe reads (timeline, lists, search, export) go to the 'replica' alias when
+# there is one, except for a user who wrote in the last REPLICA_PIN_SECONDS,
+# which should be more than the replica's lag. The pins live in the cache, so
+# with several workers set CACHE_DIR to share them. See myapp.routers.
+if 'replica' in DATABASES:
+    # Tests run against the default database under both aliases
+    DATABASES['replica']['TEST'] = {'MIRROR': 'default'}
+DATABASE_ROUTERS = ['myapp.routers.ReplicaRouter']
+REPLICA_PIN_SECONDS = int(os.environ.get('REPLICA_PIN_SECONDS', 10))
+
+# Cache
+# Local memory is per process; set CACHE_DIR to share a file-based cache
+# between workers
+if os.environ.get('CACHE_DIR'):
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+            'LOCATION': os.environ.get('CACHE_DIR'),
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            'LOCATION': 'tree',
+            'OPTIONS': {'MAX_ENTRIES': 1000},
         }
     }
+# Login/register throttle counters, always in process (see users.throttling)
+CACHES['throttle'] = {
+    'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    'LOCATION': 'throttle',
+    'OPTIONS': {'MAX_ENTRIES': 10000},
+}
+
+# Seconds an unused timeline snapshot stays cached
+TIMELINE_SNAPSHOT_TIMEOUT = int(os.environ.get('TIMELINE_SNAPSHOT_TIMEOUT', 60 * 60 * 24))
+
+# Seconds an unused per-user period index stays cached
+PERIOD_INDEX_TIMEOUT = int(os.environ.get('PERIOD_INDEX_TIMEOUT', 60 * 60 * 24))
+
+# Token -> user cache for CachedTokenAuthentication: entries per worker, seconds
+# a worker trusts its own entry, seconds an entry stays in the shared cache
+# (only used when CACHES['default'] is shared between workers, not locmem)
+AUTH_TOKEN_CACHE_SIZE = int(os.environ.get('AUTH_TOKEN_CACHE_SIZE', 1024))
+AUTH_TOKEN_CACHE_TTL = int(os.environ.get('AUTH_TOKEN_CACHE_TTL', 30))
+AUTH_TOKEN_CACHE_TIMEOUT = int(os.environ.get('AUTH_TOKEN_CACHE_TIMEOUT', 300))
+
+# Deleted chapters/events are hidden at once and removed by a background
+# purge, in transactions of PURGE_BATCH_SIZE rows (see myapp.deletion)
+PURGE_BATCH_SIZE = int(os.environ.get('PURGE_BATCH_SIZE', 500))
+PURGE_IN_BACKGROUND = os.environ.get('PURGE_IN_BACKGROUND', 'True') == 'True'
+
+# Days a deletion tombstone is kept for delta sync; clients that last synced
+# before the oldest one left get 410 and sync from scratch
+TOMBSTONE_RETENTION_DAYS = int(os.environ.get('TOMBSTONE_RETENTION_DAYS', 90))
+
+# Responses from COMPRESSION_MIN_SIZE bytes up are sent brotli (when the brotli
+# package is installed) or gzip compressed, as the client's Accept-Encoding allows
+COMPRESSION_MIN_SIZE = int(os.environ.get('COMPRESSION_MIN_SIZE', 1024))
+COMPRESSION_BROTLI_QUALITY = int(os.environ.get('COMPRESSION_BROTLI_QUALITY', 1))
+COMPRESSION_GZIP_LEVEL = int(os.environ.get('COMPRESSION_GZIP_LEVEL', 1))
+
+# Event bodies of EVENT_CONTENT_COMPRESS_MIN bytes or more are stored
+# compressed on SQLite, with 'zlib' or (when the zstandard package is
+# installed) 'zstd'; empty stores them as text (see myapp.content)
+EVENT_CONTENT_COMPRESSION = os.environ.get('EVENT_CONTENT_COMPRESSION', 'zlib')
+EVENT_CONTENT_COMPRESS_MIN = int(os.environ.get('EVENT_CONTENT_COMPRESS_MIN', 4096))
+
+# PBKDF2 as before, but hashed on a bounded pool (see users.hashing): at
+# most PASSWORD_HASH_WORKERS hashes at once per process, PASSWORD_HASH_QUEUE
+# more waiting up to PASSWORD_HASH_TIMEOUT seconds, 503 for the rest.
+# The stock PBKDF2PasswordHasher must not be listed too, it would take over
+# verifying the pbkdf2_sha256 hashes.
+PASSWORD_HASHERS = [
+    'users.hashing.BoundedPBKDF2PasswordHasher',
+    'django.contrib.auth.hashers.PBKDF2SHA1PasswordHasher',
+    'django.contrib.auth.hashers.Argon2PasswordHasher',
+    'django.contrib.auth.hashers.BCryptSHA256PasswordHasher',
+    'django.contrib.auth.hashers.ScryptPasswordHasher',
+]
+PASSWORD_HASH_WORKERS = int(os.environ.get('PASSWORD_HASH_WORKERS', max(1, (os.cpu_count() or 2) // 2)))
+PASSWORD_HASH_QUEUE = int(os.environ.get('PASSWORD_HASH_QUEUE', PASSWORD_HASH_WORKERS))
+PASSWORD_HASH_TIMEOUT = float(os.environ.get('PASSWORD_HASH_TIMEOUT', 5))
 
 # Password validation
 AUTH_PASSWORD_VALIDATORS = [
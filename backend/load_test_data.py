@@ -13,14 +13,15 @@ os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'djangostuff.settings')
 django.setup()
 
 from django.contrib.auth import get_user_model
+from myapp.importer import TimelineImporter
 from myapp.models import Chapter, Event
 
 User = get_user_model()
 
 # Get or create a test user
 user, created = User.objects.get_or_create(
-    username='testuser',
-    defaults={'email': 'test@example.com'}
+    email='test@example.com',
+    defaults={'username': 'testuser'}
 )
 if created:
     user.set_password('testpass123')
@@ -79,79 +80,11 @@ sample_data = {
     ]
 }
 
-# Create main timeline periods
-for period_data in sample_data['mainTimeline']:
-    chapter, created = Chapter.objects.get_or_create(
-        user=user,
-        title=period_data['title'],
-        defaults={
-            'type': 'main_period',
-            'start_date': period_data['startDate'],
-            'end_date': period_data['endDate'],
-            'color': '#000000',
-            'collapsed': False,
-        }
-    )
-    
-    # Create entries for this period
-    for entry_data in period_data.get('entries', []):
-        Event.objects.get_or_create(
-            user=user,
-            title=entry_data['title'],
-            defaults={
-                'chapter': chapter,
-                'date': entry_data['date'],
-                'preview': entry_data.get('preview', ''),
-                'content': entry_data.get('content', ''),
-                'description': entry_data.get('preview', ''),
-            }
-        )
-
-# Create branches
-for branch_data in sample_data['branches']:
-    branch, created = Chapter.objects.get_or_create(
-        user=user,
-        title=branch_data['name'],
-        defaults={
-            'type': 'branch',
-            'start_date': date(2016, 1, 1),  # Default dates
-            'end_date': date(2024, 12, 31),
-            'color': branch_data['color'],
-            'x_position': branch_data['x'],
-            'collapsed': False,
-        }
-    )
-    
-    # Create branch periods
-    for period_data in branch_data.get('periods', []):
-        branch_period, created = Chapter.objects.get_or_create(
-            user=user,
-            title=period_data['title'],
-            parent_branch=branch,
-            defaults={
-                'type': 'branch_period',
-                'start_date': period_data['startDate'],
-                'end_date': period_data['endDate'],
-                'color': branch.color,
-                'collapsed': False,
-            }
-        )
-        
-        # Create entries for branch period
-        for entry_data in period_data.get('entries', []):
-            Event.objects.get_or_create(
-                user=user,
-                title=entry_data['title'],
-                defaults={
-                    'chapter': branch_period,
-                    'date': entry_data['date'],
-                    'preview': entry_data.get('preview', ''),
-                    'content': entry_data.get('content', ''),
-                    'description': entry_data.get('preview', ''),
-                }
-            )
+# Import in one transaction with batched inserts. Entries carry client ids,
+# so running the script again does not duplicate anything.
+stats = TimelineImporter(user).load_nested(sample_data).run()
 
 print("Test data loaded successfully!")
-print(f"Created {Chapter.objects.filter(user=user).count()} chapters")
-print(f"Created {Event.objects.filter(user=user).count()} events")
+print(f"Created {stats['chapters_created']} chapters and {stats['events_created']} events")
+print(f"User now has {Chapter.objects.filter(user=user).count()} chapters and {Event.objects.filter(user=user).count()} events")
 
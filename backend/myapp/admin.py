@@ -1,7 +1,25 @@
+from django import forms
 from django.contrib import admin
 from .models import Chapter, Event
 
 
+class EventAdminForm(forms.ModelForm):
+    # Event.content is a property (the body is in EventContent), not a field
+    content = forms.CharField(widget=forms.Textarea, required=False)
+
+    class Meta:
+        model = Event
+        fields = "__all__"
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.initial.setdefault("content", self.instance.content)
+
+    def save(self, commit=True):
+        self.instance.content = self.cleaned_data["content"]
+        return super().save(commit)
+
+
 @admin.register(Chapter)
 class ChapterAdmin(admin.ModelAdmin):
     list_display = (
@@ -21,6 +39,7 @@ class ChapterAdmin(admin.ModelAdmin):
 
 @admin.register(Event)
 class EventAdmin(admin.ModelAdmin):
+    form = EventAdminForm
     list_display = (
         "id",
         "user",
@@ -29,6 +48,6 @@ class EventAdmin(admin.ModelAdmin):
         "order",
     )
     list_filter = ("date",)
-    search_fields = ("content",)
+    search_fields = ("body__text",)
     ordering = ("date", "order")
     raw_id_fields = ("user", "chapter")
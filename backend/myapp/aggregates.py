@@ -0,0 +1,164 @@
+# aggregates.py
+from collections import Counter
+
+from django.db import transaction
+from django.db.models import Case, Count, DateField, F, IntegerField, Max, Min, OuterRef, Q, Subquery, Sum, Value, When
+from django.db.models.functions import Coalesce, Greatest, Least
+
+from .models import ChangeSequence, Chapter, Event
+
+# Chapter.entry_count, word_count, first_entry_date and last_entry_date sum
+# up the live events that have the chapter as their chapter or branch. Writes
+# to events hand the rows they add and take away to update_aggregates(),
+# which moves each affected chapter's numbers by the difference: one UPDATE
+# per chapter, whatever it holds. Only taking away an entry on the first or
+# last date re-reads that end from the chapter's entries. Bulk loads call
+# refresh_aggregates() instead, which recounts a batch of chapters per query.
+#
+# A chapter whose numbers change gets a new change_seq, so delta sync sends
+# it again.
+
+# The event columns a chapter's aggregates depend on
+COUNTED = ('user_id', 'chapter_id', 'branch_id', 'date', 'word_count')
+
+REFRESH_BATCH_SIZE = 500
+
+
+def counted(event):
+    """What the event adds to its chapters' aggregates; None when it is not live"""
+    if event.deleted_at is not None:
+        return None
+    return {name: getattr(event, name) for name in COUNTED}
+
+
+def _containers(row):
+    return {row['chapter_id'], row['branch_id']} - {None}
+
+
+def _entries():
+    """Live events of the chapter the enclosing query is on"""
+    return Event.objects.filter(Q(chapter_id=OuterRef('pk')) | Q(branch_id=OuterRef('pk'))).order_by()
+
+
+def update_aggregates(removed=(), added=(), skip=()):
+    """
+    Apply the difference between `removed` and `added` (COUNTED rows, None
+    entries are ignored) to the chapters they are in, other than `skip`.
+    Call in the transaction that wrote the events, after the write.
+    """
+    changes = {}
+    for sign, rows in ((-1, removed), (1, added)):
+        for row in rows:
+            if row is None:
+                continue
+            for chapter_id in _containers(row) - set(skip):
+                change = changes.setdefault(chapter_id, {
+                    'user_id': row['user_id'], 'count': 0, 'words': 0, 'added': Counter(), 'removed': Counter(),
+                })
+                change['count'] += sign
+                change['words'] += sign * row['word_count']
+                change['added' if sign > 0 else 'removed'][row['date']] += 1
+
+    for change in changes.values():
+        # An entry saved with the same date leaves both ends as they were
+        common = change['added'] & change['removed']
+        change['added'] -= common
+        change['removed'] -= common
+    changes = {
+        chapter_id: change for chapter_id, change in changes.items()
+        if change['count'] or change['words'] or change['added'] or change['removed']
+    }
+    if not changes:
+        return
+
+    by_user = {}
+    for chapter_id, change in changes.items():
+        by_user.setdefault(change['user_id'], []).append(chapter_id)
+    with transaction.atomic():
+        for user_id, chapter_ids in by_user.items():
+            last = ChangeSequence.reserve(user_id, count=len(chapter_ids))
+            for seq, chapter_id in enumerate(chapter_ids, start=last - len(chapter_ids) + 1):
+                Chapter.all_objects.filter(pk=chapter_id).update(change_seq=seq, **_moved(changes[chapter_id]))
+
+
+def _moved(change):
+    fields = {
+        'entry_count': F('entry_count') + change['count'],
+        'word_count': F('word_count') + change['words'],
+    }
+    for name, grow, reread, pick in (
+        ('first_entry_date', Least, 'date', min),
+        ('last_entry_date', Greatest, '-date', max),
+    ):
+        value = F(name)
+        if change['added']:
+            date = Value(pick(change['added']), output_field=DateField())
+            # NULL for a chapter that was empty
+            value = Coalesce(grow(value, date), date)
+        if change['removed']:
+            value = Case(
+                When(**{f'{name}__in': list(change['removed'])}, then=Subquery(
+                    _entries().order_by(reread).values('date')[:1]
+                )),
+                default=value,
+                output_field=DateField(),
+            )
+        if change['added'] or change['removed']:
+            fields[name] = value
+    return fields
+
+
+def _recounted(queryset):
+    """The chapters annotated with their aggregates recounted from the events"""
+    # Grouping by user makes one group of the chapter's entries
+    entries = _entries().values('user_id')
+    return queryset.annotate(
+        true_entry_count=Coalesce(Subquery(entries.annotate(value=Count('id')).values('value')), 0),
+        true_word_count=Coalesce(
+            Subquery(entries.annotate(value=Sum('word_count')).values('value')), 0, output_field=IntegerField()
+        ),
+        true_first_entry_date=Subquery(entries.annotate(value=Min('date')).values('value')),
+        true_last_entry_date=Subquery(entries.annotate(value=Max('date')).values('value')),
+    )
+
+
+AGGREGATES = ('entry_count', 'word_count', 'first_entry_date', 'last_entry_date')
+
+
+def check_aggregates(queryset=None, fix=False, batch_size=REFRESH_BATCH_SIZE):
+    """
+    Recount the aggregates of the chapters in `queryset` (default all), a
+    batch of chapters per query. Returns {chapter id: {name: (stored, right)}}
+    for the chapters that were wrong; with fix=True they are rewritten, a
+    transaction per batch.
+    """
+    queryset = Chapter.all_objects.all() if queryset is None else queryset
+    queryset = _recounted(queryset.only('id', 'user_id', *AGGREGATES)).order_by('pk')
+    stale = {}
+    last_id = 0
+    while True:
+        with transaction.atomic():
+            batch = list(queryset.filter(pk__gt=last_id)[:batch_size])
+            if not batch:
+                return stale
+            wrong = []
+            for chapter in batch:
+                diff = {
+                    name: (getattr(chapter, name), getattr(chapter, f'true_{name}'))
+                    for name in AGGREGATES
+                    if getattr(chapter, name) != getattr(chapter, f'true_{name}')
+                }
+                if diff:
+                    stale[chapter.pk] = diff
+                    wrong.append(chapter)
+                    for name, (_, right) in diff.items():
+                        setattr(chapter, name, right)
+            if fix and wrong:
+                ChangeSequence.stamp(wrong)
+                Chapter.all_objects.bulk_update(wrong, [*AGGREGATES, 'change_seq'])
+        last_id = batch[-1].pk
+
+
+def refresh_aggregates(queryset):
+    """Recount the chapters' aggregates after a bulk load, see check_aggregates()"""
+    return len(check_aggregates(queryset, fix=True))
@@ -0,0 +1,295 @@
+# benchmark.py
+import json
+import math
+import platform
+import statistics
+import time
+import tracemalloc
+
+import django
+from django.core.cache import cache
+from django.db import DatabaseError, connection
+from django.db.models import Sum
+from django.db.models.functions import Length
+from django.test import Client, RequestFactory
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.authentication import TokenAuthentication
+from rest_framework.authtoken.models import Token
+from rest_framework.renderers import JSONRenderer
+from users.authentication import CachedTokenAuthentication, local_tokens
+
+from .middleware import ENCODERS
+from .models import Event, EventContent
+from .renderers import MessagePackRenderer, ORJSONRenderer, msgpack
+from .timeline import TimelineBuilder, event_fields_for
+
+
+def percentile(values, pct):
+    """Nearest-rank percentile"""
+    ordered = sorted(values)
+    rank = max(1, math.ceil(pct / 100 * len(ordered)))
+    return ordered[rank - 1]
+
+
+def _body_size(response):
+    if response.streaming:
+        return sum(len(chunk) for chunk in response.streaming_content)
+    return len(response.content)
+
+
+class Scenario:
+    """One request to benchmark. `body` may be a callable building fresh data per call."""
+
+    def __init__(self, name, method, path, body=None, headers=None, setup=None):
+        self.name = name
+        self.method = method
+        self.path = path
+        self.body = body
+        self.headers = headers or {}
+        # Runs before every call and is not timed, e.g. clearing a cache
+        self.setup = setup
+
+    def request(self, client):
+        body = self.body() if callable(self.body) else self.body
+        kwargs = dict(self.headers)
+        if body is not None:
+            kwargs['data'] = json.dumps(body)
+            kwargs['content_type'] = 'application/json'
+        return getattr(client, self.method.lower())(self.path, **kwargs)
+
+
+def default_scenarios(user):
+    events = list(Event.objects.filter(user=user).order_by('id').values_list('id', 'chapter_id')[:200])
+    first_id, first_chapter = events[0]
+    counter = iter(range(10**9))
+
+    def new_event():
+        return {
+            'title': f'Benchmark {next(counter)}',
+            'date': '2020-01-01',
+            'content': 'benchmark ' * 50,
+            'chapter': first_chapter,
+        }
+
+    def reorder():
+        step = next(counter)
+        return {'update': [{'id': pk, 'order': step + i} for i, (pk, _) in enumerate(events[:100])]}
+
+    return [
+        Scenario('timeline_data (cold)', 'GET', '/api/chapters/timeline_data/', setup=cache.clear),
+        Scenario('timeline_data (cached)', 'GET', '/api/chapters/timeline_data/'),
+        Scenario('timeline_data summary (cold)', 'GET', '/api/chapters/timeline_data/?view=summary', setup=cache.clear),
+        Scenario(
+            'timeline_data (cached, msgpack)', 'GET', '/api/chapters/timeline_data/',
+            headers={'HTTP_ACCEPT': 'application/msgpack'},
+        ),
+        Scenario(
+            'timeline_data (cached, gzip)', 'GET', '/api/chapters/timeline_data/',
+            headers={'HTTP_ACCEPT_ENCODING': 'gzip'},
+        ),
+        Scenario(
+            'timeline_data (cached, br)', 'GET', '/api/chapters/timeline_data/',
+            headers={'HTTP_ACCEPT_ENCODING': 'br'},
+        ),
+        Scenario('chapters list', 'GET', '/api/chapters/'),
+        Scenario('events list', 'GET', '/api/events/'),
+        Scenario('events list summary', 'GET', '/api/events/?view=summary'),
+        Scenario('event detail', 'GET', f'/api/events/{first_id}/'),
+        Scenario('event create', 'POST', '/api/events/', body=new_event),
+        Scenario('event patch', 'PATCH', f'/api/events/{first_id}/', body=lambda: {'order': next(counter)}),
+        Scenario('events bulk reorder (100)', 'POST', '/api/events/bulk/', body=reorder),
+    ]
+
+
+def compare_authentication(user, repeat=200):
+    """
+    Per-request cost of resolving the user's token with DRF's
+    TokenAuthentication and with CachedTokenAuthentication (starting cold).
+    """
+    token, _ = Token.objects.get_or_create(user=user)
+    request = RequestFactory().get('/', HTTP_AUTHORIZATION=f'Token {token.key}')
+    results = []
+    for backend in (TokenAuthentication(), CachedTokenAuthentication()):
+        local_tokens.clear()
+        cache.clear()
+        with CaptureQueriesContext(connection) as queries:
+            started = time.perf_counter()
+            for _ in range(repeat):
+                backend.authenticate(request)
+            elapsed = time.perf_counter() - started
+        results.append({
+            'name': type(backend).__name__,
+            'queries_per_request': round(len(queries) / repeat, 3),
+            'us_per_request': round(elapsed / repeat * 1e6, 1),
+        })
+    return results
+
+
+def wire_formats():
+    """(name, encode) for each way a document can go over the wire"""
+    json_renderer = JSONRenderer()
+    orjson_renderer = ORJSONRenderer()
+    formats = [('json', json_renderer.render), ('orjson', orjson_renderer.render)]
+    if msgpack:
+        formats.append(('msgpack', MessagePackRenderer().render))
+    for coding, compress in ENCODERS.items():
+        formats.append((f'orjson + {coding}', lambda data, compress=compress: compress(orjson_renderer.render(data))))
+    return formats
+
+
+def compare_formats(documents, repeat=20):
+    """
+    Payload size and encode time (p50) of each document per wire format:
+    plain JSON through json and orjson, MessagePack, and orjson output
+    compressed the way CompressionMiddleware sends it.
+    """
+    results = []
+    for document, data in documents:
+        for name, encode in wire_formats():
+            timings = []
+            for _ in range(repeat):
+                started = time.perf_counter()
+                body = encode(data)
+                timings.append((time.perf_counter() - started) * 1000)
+            results.append({
+                'document': document,
+                'format': name,
+                'bytes': len(body),
+                'encode_ms': round(percentile(timings, 50), 3),
+            })
+    return results
+
+
+def table_bytes(model):
+    """On-disk size of the model's table (SQLite needs dbstat); None when unknown"""
+    table = model._meta.db_table
+    if connection.vendor == 'sqlite':
+        sql = 'SELECT SUM(pgsize) FROM dbstat WHERE name = %s'
+    elif connection.vendor == 'postgresql':
+        sql = 'SELECT pg_table_size(%s)'
+    else:
+        return None
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute(sql, [table])
+            return cursor.fetchone()[0]
+    except DatabaseError:
+        return None
+
+
+def compare_storage(user, repeat=20):
+    """
+    What reading events costs now that their bodies live in EventContent:
+    the size of both tables, and per event query the p50 time and the bytes
+    of the values it returns. Summary timelines never read the body table,
+    full ones join it; the scan reads every event row and nothing else.
+    """
+    tables = [
+        {'table': model._meta.db_table, 'rows': model._default_manager.count(), 'bytes': table_bytes(model)}
+        for model in (Event, EventContent)
+    ]
+    queries = [
+        ('timeline events, summary', TimelineBuilder(user, event_fields=event_fields_for(summary=True)).event_rows),
+        ('timeline events, full', TimelineBuilder(user).event_rows),
+        ('scan of all event rows', lambda: [Event.all_objects.aggregate(title_length=Sum(Length('title')))]),
+    ]
+    results = []
+    for name, query in queries:
+        timings = []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            rows = list(query())
+            timings.append((time.perf_counter() - started) * 1000)
+        results.append({
+            'query': name,
+            'rows': len(rows),
+            'bytes': sum(len(str(value).encode()) for row in rows for value in row.values() if value is not None),
+            'p50_ms': round(percentile(timings, 50), 3),
+        })
+    return {'tables': tables, 'queries': results}
+
+
+class BenchmarkRunner:
+    """
+    Drives endpoints through the Django test client as `user`.
+
+    Each scenario is timed `repeat` times (after `warmup` untimed calls), then
+    run once more under query capture and tracemalloc for the SQL count, peak
+    Python memory and payload size, so the instrumentation does not skew the
+    latencies.
+    """
+
+    def __init__(self, user, repeat=20, warmup=2):
+        self.user = user
+        self.repeat = repeat
+        self.warmup = warmup
+        token, _ = Token.objects.get_or_create(user=user)
+        self.client = Client(HTTP_AUTHORIZATION=f'Token {token.key}')
+
+    def measure(self, scenario):
+        for _ in range(self.warmup):
+            if scenario.setup:
+                scenario.setup()
+            scenario.request(self.client)
+
+        timings = []
+        for _ in range(self.repeat):
+            if scenario.setup:
+                scenario.setup()
+            started = time.perf_counter()
+            response = scenario.request(self.client)
+            _body_size(response)
+            timings.append((time.perf_counter() - started) * 1000)
+
+        if scenario.setup:
+            scenario.setup()
+        tracemalloc.start()
+        try:
+            with CaptureQueriesContext(connection) as queries:
+                response = scenario.request(self.client)
+                size = _body_size(response)
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+
+        return {
+            'name': scenario.name,
+            'method': scenario.method,
+            'path': scenario.path,
+            'status': response.status_code,
+            'p50_ms': round(percentile(timings, 50), 3),
+            'p95_ms': round(percentile(timings, 95), 3),
+            'mean_ms': round(statistics.fmean(timings), 3),
+            'min_ms': round(min(timings), 3),
+            'queries': len(queries),
+            'peak_memory_kb': round(peak / 1024, 1),
+            'payload_bytes': size,
+        }
+
+    def run(self, scenarios=None, **meta):
+        scenarios = scenarios if scenarios is not None else default_scenarios(self.user)
+        return {
+            'meta': {
+                'timestamp': timezone.now().isoformat(),
+                'repeat': self.repeat,
+                'python': platform.python_version(),
+                'django': django.get_version(),
+                'database': connection.vendor,
+                'events': Event.objects.filter(user=self.user).count(),
+                **meta,
+            },
+            'results': [self.measure(scenario) for scenario in scenarios],
+            'authentication': compare_authentication(self.user, repeat=self.repeat * 10),
+            'formats': compare_formats(self.documents(), repeat=self.repeat),
+            'storage': compare_storage(self.user, repeat=self.repeat),
+        }
+
+    def documents(self):
+        """The timeline and list documents as the API serves them, decoded"""
+        paths = [
+            ('timeline_data', '/api/chapters/timeline_data/'),
+            ('chapters list', '/api/chapters/'),
+            ('events list', '/api/events/'),
+        ]
+        return [(name, json.loads(self.client.get(path).content)) for name, path in paths]
@@ -0,0 +1,126 @@
+# cache.py
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+from .models import ChangeSequence
+from .timeline import abuild_timeline, build_timeline, event_fields_for
+
+# How long an unused snapshot stays in the cache (seconds)
+SNAPSHOT_TIMEOUT = getattr(settings, 'TIMELINE_SNAPSHOT_TIMEOUT', 60 * 60 * 24)
+
+HITS_KEY = 'timeline:stats:hits'
+MISSES_KEY = 'timeline:stats:misses'
+INVALIDATIONS_KEY = 'timeline:stats:invalidations'
+
+
+def _generation_key(user_id):
+    return f'timeline:gen:{user_id}'
+
+
+def _snapshot_key(user_id, version, generation, summary=False, stubs=False):
+    view = 'summary' if summary else 'full'
+    if stubs:
+        view += '-stubs'
+    return f'timeline:snapshot:{user_id}:{version}:{generation}:{view}'
+
+
+def _incr(key):
+    # incr() raises on a missing key, so seed it first
+    cache.add(key, 0, timeout=None)
+    try:
+        return cache.incr(key)
+    except ValueError:
+        # Evicted between add() and incr()
+        cache.set(key, 1, timeout=None)
+        return 1
+
+
+def get_timeline_snapshot(user, summary=False, version=None, stubs=False):
+    """
+    Return the user's serialized timeline, building it on a miss.
+    Full and summary (no event content) documents, with or without collapsed
+    chapters as stubs, are cached separately.
+
+    Snapshots are keyed by the user's committed change sequence, `version`
+    (read from the database when not given), which is also what the ETag is
+    made of (see myapp.conditional). A worker whose cache missed another
+    worker's invalidation, as with the per-process locmem backend, thus
+    finds no snapshot for the new version instead of serving an old one
+    under the new ETag. Within the cache, invalidation also bumps a
+    per-user generation, so a rebuild that raced with a write is stored
+    under a stale key and never served.
+    """
+    if version is None:
+        version = ChangeSequence.current(user.pk)
+    generation = cache.get(_generation_key(user.pk), 0)
+    key = _snapshot_key(user.pk, version, generation, summary, stubs)
+
+    snapshot = cache.get(key)
+    if snapshot is not None:
+        _incr(HITS_KEY)
+        return snapshot
+
+    _incr(MISSES_KEY)
+    snapshot = build_timeline(user, event_fields=event_fields_for(summary=summary), stubs=stubs)
+    cache.set(key, snapshot, SNAPSHOT_TIMEOUT)
+    return snapshot
+
+
+async def _aincr(key):
+    await cache.aadd(key, 0, timeout=None)
+    try:
+        return await cache.aincr(key)
+    except ValueError:
+        await cache.aset(key, 1, timeout=None)
+        return 1
+
+
+async def aget_timeline_snapshot(user, summary=False, version=None, stubs=False):
+    """get_timeline_snapshot() for async views"""
+    if version is None:
+        version = await ChangeSequence.acurrent(user.pk)
+    generation = await cache.aget(_generation_key(user.pk), 0)
+    key = _snapshot_key(user.pk, version, generation, summary, stubs)
+
+    snapshot = await cache.aget(key)
+    if snapshot is not None:
+        await _aincr(HITS_KEY)
+        return snapshot
+
+    await _aincr(MISSES_KEY)
+    snapshot = await abuild_timeline(user, event_fields=event_fields_for(summary=summary), stubs=stubs)
+    await cache.aset(key, snapshot, SNAPSHOT_TIMEOUT)
+    return snapshot
+
+
+def invalidate_timeline(user_id):
+    """
+    Retire the user's snapshots, e.g. after a Chapter or Event changed; they
+    stay in the cache until it evicts them
+    """
+    _incr(_generation_key(user_id))
+    _incr(INVALIDATIONS_KEY)
+
+
+def invalidate_timeline_on_commit(user_id):
+    """
+    Invalidate now and again once the current transaction commits, in case a
+    concurrent read rebuilt the snapshot from the pre-commit rows.
+    """
+    invalidate_timeline(user_id)
+    transaction.on_commit(lambda: invalidate_timeline(user_id))
+
+
+def snapshot_stats():
+    """Hit/miss counters for the timeline snapshot cache"""
+    values = cache.get_many([HITS_KEY, MISSES_KEY, INVALIDATIONS_KEY])
+    hits = values.get(HITS_KEY, 0)
+    misses = values.get(MISSES_KEY, 0)
+    lookups = hits + misses
+    return {
+        'hits': hits,
+        'misses': misses,
+        'invalidations': values.get(INVALIDATIONS_KEY, 0),
+        'hit_ratio': hits / lookups if lookups else None,
+    }
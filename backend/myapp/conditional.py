@@ -0,0 +1,80 @@
+# conditional.py
+import hashlib
+from functools import wraps
+
+from django.utils.cache import get_conditional_response, patch_vary_headers, quote_etag
+from django.utils.decorators import method_decorator
+from django.views.decorators.cache import cache_control
+from django.views.decorators.http import condition
+from django.views.decorators.vary import vary_on_headers
+
+from .models import ChangeSequence
+
+
+def timeline_version(user):
+    """
+    Per-user version of the timeline: the committed change sequence, which
+    every create, update and delete advances (see ChangeSequence).
+    """
+    return str(ChangeSequence.current(user.pk))
+
+
+def request_version(request):
+    """
+    timeline_version() of the requesting user, read once per request, so
+    that the ETag and the cached snapshot (see myapp.cache) share it
+    """
+    if getattr(request, '_timeline_version', None) is None:
+        request._timeline_version = timeline_version(request.user)
+    return request._timeline_version
+
+
+def _etag(request, version):
+    key = '|'.join([
+        str(request.user.pk),
+        request.get_full_path(),
+        request.META.get('HTTP_ACCEPT', ''),
+        version,
+    ])
+    return hashlib.sha256(key.encode()).hexdigest()
+
+
+def timeline_etag(request, *args, **kwargs):
+    """Strong ETag for a read of the user's timeline (varies by URL and Accept)"""
+    if not request.user.is_authenticated:
+        return None
+    return _etag(request, request_version(request))
+
+
+def _timeline_conditional(view):
+    # Answer If-None-Match with 304 before the view (and its serializers) runs
+    view = condition(etag_func=timeline_etag)(view)
+    # The body depends on Accept (JSON or MessagePack) as the ETag does
+    view = vary_on_headers('Accept')(view)
+    return cache_control(private=True, no_cache=True)(view)
+
+
+# For viewset methods
+timeline_conditional = method_decorator(_timeline_conditional)
+
+
+def async_timeline_conditional(view):
+    """
+    The same for async views; condition() would call the ETag function, and
+    so the ORM, synchronously. Expects request.user to be set already, and
+    reads the version request_version() then returns.
+    """
+    @wraps(view)
+    async def wrapper(request, *args, **kwargs):
+        request._timeline_version = str(await ChangeSequence.acurrent(request.user.pk))
+        etag = quote_etag(_etag(request, request._timeline_version))
+        response = get_conditional_response(request, etag=etag)
+        if response is None:
+            response = await view(request, *args, **kwargs)
+        if request.method in ('GET', 'HEAD'):
+            response.headers.setdefault('ETag', etag)
+        # On the 304 too, as _timeline_conditional does
+        patch_vary_headers(response, ('Accept',))
+        return response
+
+    return cache_control(private=True, no_cache=True)(wrapper)
@@ -0,0 +1,89 @@
+# content.py
+import zlib
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.db.models import F, Func, TextField
+
+try:
+    import zstandard
+except ImportError:  # optional, zlib only without it
+    zstandard = None
+
+# Event bodies live in EventContent, one row per event, so the scans and
+# range reads behind timelines, lists and sync never page through them. On
+# SQLite, bodies of COMPRESS_MIN bytes or more are stored compressed;
+# PostgreSQL compresses large values itself (TOAST), so they are stored as
+# text there. SQL reads a body through Inflate(), which SQLite runs as the
+# myapp_inflate() function registered on each connection (see
+# myapp.signals). Writes never need it: the FTS5 index keeps plain text.
+
+CODECS = {
+    'zlib': (lambda data: zlib.compress(data, 6), zlib.decompress),
+}
+if zstandard is not None:
+    CODECS['zstd'] = (zstandard.ZstdCompressor(level=3).compress, zstandard.ZstdDecompressor().decompress)
+
+# None or '' stores every body as text
+COMPRESSION = getattr(settings, 'EVENT_CONTENT_COMPRESSION', 'zlib')
+COMPRESS_MIN = getattr(settings, 'EVENT_CONTENT_COMPRESS_MIN', 4096)
+
+if COMPRESSION and COMPRESSION not in CODECS:
+    raise ImproperlyConfigured(
+        f'EVENT_CONTENT_COMPRESSION {COMPRESSION!r} is not available, choose one of {sorted(CODECS)}'
+    )
+
+
+def pack(text, vendor):
+    """(text, data, encoding) columns storing `text` on a `vendor` database"""
+    if COMPRESSION and vendor == 'sqlite':
+        raw = text.encode()
+        if len(raw) >= COMPRESS_MIN:
+            data = CODECS[COMPRESSION][0](raw)
+            # Incompressible bodies stay text
+            if len(data) < len(raw):
+                return '', data, COMPRESSION
+    return text, None, ''
+
+
+def unpack(text, data, encoding):
+    """The body stored in (text, data, encoding) columns; '' without a row"""
+    if not encoding:
+        return text or ''
+    try:
+        decompress = CODECS[encoding][1]
+    except KeyError:
+        raise ImproperlyConfigured(f'Event content is {encoding}-compressed, which is not available') from None
+    return decompress(bytes(data)).decode()
+
+
+class Inflate(Func):
+    """The body of the event the query is on, via its `body` relation"""
+    function = 'myapp_inflate'
+    output_field = TextField()
+
+    def __init__(self, prefix='body__', **extra):
+        super().__init__(F(f'{prefix}text'), F(f'{prefix}data'), F(f'{prefix}encoding'), **extra)
+
+    def as_sql(self, compiler, connection, **extra_context):
+        # Only SQLite stores compressed bodies
+        text, params = compiler.compile(self.source_expressions[0])
+        return f"COALESCE({text}, '')", params
+
+    def as_sqlite(self, compiler, connection, **extra_context):
+        # Calling into Python only for compressed bodies keeps plain ones at
+        # the cost of a column read
+        (text, text_params), (data, data_params), (encoding, encoding_params) = (
+            compiler.compile(expression) for expression in self.source_expressions
+        )
+        return (
+            f"CASE WHEN {encoding} <> '' THEN {self.function}({text}, {data}, {encoding}) "
+            f"ELSE COALESCE({text}, '') END",
+            (*encoding_params, *text_params, *data_params, *encoding_params, *text_params),
+        )
+
+
+def register_functions(connection):
+    """Make myapp_inflate() available on a SQLite connection, if it is open"""
+    if connection.vendor == 'sqlite' and connection.connection is not None:
+        connection.connection.create_function('myapp_inflate', 3, unpack, deterministic=True)
@@ -0,0 +1,181 @@
+# deletion.py
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import connections, transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from .aggregates import COUNTED, update_aggregates
+from .cache import invalidate_timeline_on_commit
+from .lineage import children_of, drop_lineage, subtree, sync_lineage, sync_spawned
+from .models import Chapter, Event, EventContent
+from .periods import invalidate_periods
+from .sync import prune_tombstones, record_deletions
+
+# Rows removed per purge transaction
+PURGE_BATCH_SIZE = getattr(settings, 'PURGE_BATCH_SIZE', 500)
+# Purge in a background thread after each delete. With False, run the
+# purge_deleted command instead (e.g. from cron).
+PURGE_IN_BACKGROUND = getattr(settings, 'PURGE_IN_BACKGROUND', True)
+
+logger = logging.getLogger(__name__)
+
+# Deleting is two steps. A delete request only hides the rows (deleted_at, see
+# SoftDeleteModel) and leaves their tombstones: a few queries however big the
+# subtree. The purge then removes them with set-based UPDATE/DELETE
+# statements, a batch per transaction, outside the request.
+
+
+def _hide(queryset, kind, columns=()):
+    """Soft-delete the rows; returns their values(user_id, id, *columns)"""
+    rows = list(queryset.order_by('id').values('user_id', 'id', *columns))
+    if not rows:
+        return rows
+    # Cleared so a re-import of the same external ids creates fresh rows
+    queryset.model.objects.filter(pk__in=[row['id'] for row in rows]).update(
+        deleted_at=timezone.now(), external_id=None
+    )
+    record_deletions([(row['user_id'], kind, row['id']) for row in rows])
+    for user_id in {row['user_id'] for row in rows}:
+        invalidate_timeline_on_commit(user_id)
+        if kind == 'chapter':
+            invalidate_periods(user_id)
+    return rows
+
+
+def soft_delete_chapters(ids):
+    """
+    Delete chapters, and the periods of those that are branches. Events in
+    them keep pointing at them until the purge clears the references, as the
+    SET_NULL cascade would have.
+    """
+    with transaction.atomic():
+        _hide(Chapter.objects.filter(Q(pk__in=ids) | Q(parent_branch_id__in=ids)), 'chapter')
+        schedule_purge()
+
+
+def soft_delete_subtree(chapter_id):
+    """
+    Delete a chapter with everything below it: its periods, the branches
+    spawned from it or its entries, recursively, and the entries in all of them
+    """
+    with transaction.atomic():
+        ids = list(subtree(chapter_id).values_list('id', flat=True))
+        _hide(Chapter.objects.filter(pk__in=ids), 'chapter')
+        events = _hide(Event.objects.filter(Q(chapter_id__in=ids) | Q(branch_id__in=ids)), 'event', COUNTED)
+        # Only chapters outside the subtree (another container of an entry) need their numbers moved
+        update_aggregates(removed=events, skip=ids)
+        schedule_purge()
+
+
+def soft_delete_events(ids):
+    """Delete events along with the branches spawned from them"""
+    with transaction.atomic():
+        spawned = list(Chapter.objects.filter(source_entry_id__in=ids).values_list('id', flat=True))
+        if spawned:
+            soft_delete_chapters(spawned)
+        update_aggregates(removed=_hide(Event.objects.filter(pk__in=ids), 'event', COUNTED))
+        schedule_purge()
+
+
+def _raw_delete(queryset):
+    # A single DELETE ... WHERE: no collector, no per-row signals (the
+    # tombstones were written when the rows were soft-deleted)
+    return queryset._raw_delete(queryset.db)
+
+
+def _purge_chapters(batch_size):
+    with transaction.atomic():
+        ids = list(
+            Chapter.all_objects.filter(deleted_at__isnull=False)
+            .order_by('id')
+            .values_list('id', flat=True)[:batch_size]
+        )
+        if not ids:
+            return 0
+        # Periods go with their branch (CASCADE). They are soft-deleted along
+        # with it, but one added since still needs its tombstone.
+        children = Chapter.all_objects.filter(parent_branch_id__in=ids).exclude(pk__in=ids)
+        for user_id, pk, deleted_at in children.values_list('user_id', 'id', 'deleted_at'):
+            ids.append(pk)
+            if deleted_at is None:
+                record_deletions([(user_id, 'chapter', pk)])
+                invalidate_timeline_on_commit(user_id)
+                invalidate_periods(user_id)
+
+        # Chapters that hung off these become roots, keeping their own subtrees
+        survivors = children_of(ids)
+        Event.all_objects.filter(chapter_id__in=ids).update(chapter=None)
+        Event.all_objects.filter(branch_id__in=ids).update(branch=None)
+        Chapter.all_objects.filter(source_chapter_id__in=ids).update(source_chapter=None)
+        sync_lineage(survivors)
+        drop_lineage(ids)
+        return _raw_delete(Chapter.all_objects.filter(pk__in=ids))
+
+
+def _purge_events(batch_size):
+    with transaction.atomic():
+        ids = list(
+            Event.all_objects.filter(deleted_at__isnull=False)
+            .order_by('id')
+            .values_list('id', flat=True)[:batch_size]
+        )
+        if not ids:
+            return 0
+        spawned = list(Chapter.all_objects.filter(source_entry_id__in=ids).values_list('id', flat=True))
+        if spawned:
+            Chapter.all_objects.filter(pk__in=spawned).update(source_entry=None)
+            sync_lineage(spawned)
+        _raw_delete(EventContent.objects.filter(event_id__in=ids))
+        return _raw_delete(Event.all_objects.filter(pk__in=ids))
+
+
+def purge_deleted(batch_size=PURGE_BATCH_SIZE):
+    """
+    Remove soft-deleted chapters and events for good, `batch_size` rows per
+    transaction so no lock is held for long, and tombstones past their
+    retention. Returns the counts removed.
+    """
+    purged = {'chapters': 0, 'events': 0}
+    for key, purge in (('chapters', _purge_chapters), ('events', _purge_events)):
+        while count := purge(batch_size):
+            purged[key] += count
+    purged['tombstones'] = prune_tombstones()
+    return purged
+
+
+_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='purge')
+_lock = threading.Lock()
+_queued = False
+
+
+def _run_purge():
+    global _queued
+    with _lock:
+        # Deletes committed from here on queue another run
+        _queued = False
+    try:
+        purge_deleted()
+    except Exception:
+        # The rows stay soft-deleted and are picked up by the next purge
+        logger.exception('Purging soft-deleted rows failed')
+    finally:
+        connections.close_all()
+
+
+def _queue_purge():
+    global _queued
+    with _lock:
+        if _queued:
+            return
+        _queued = True
+    _executor.submit(_run_purge)
+
+
+def schedule_purge():
+    """Purge in the background once the current transaction commits"""
+    if PURGE_IN_BACKGROUND:
+        transaction.on_commit(_queue_purge)
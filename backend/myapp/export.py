@@ -0,0 +1,134 @@
+# export.py
+import json
+import zlib
+
+from django.utils import timezone
+
+from .content import Inflate
+from .models import Chapter, Event
+
+EXPORT_VERSION = 1
+CHUNK_SIZE = 2000
+# Yield roughly this many bytes at a time instead of one tiny write per row
+BUFFER_SIZE = 64 * 1024
+
+# (output name, values() column)
+CHAPTER_COLUMNS = [
+    ('id', 'id'),
+    ('type', 'type'),
+    ('title', 'title'),
+    ('start_date', 'start_date'),
+    ('end_date', 'end_date'),
+    ('color', 'color'),
+    ('x_position', 'x_position'),
+    ('parent_branch', 'parent_branch_id'),
+    ('source_entry', 'source_entry_id'),
+    ('source_chapter', 'source_chapter_id'),
+    ('collapsed', 'collapsed'),
+    ('order', 'order'),
+    ('created_at', 'created_at'),
+    ('updated_at', 'updated_at'),
+]
+
+EVENT_COLUMNS = [
+    ('id', 'id'),
+    ('title', 'title'),
+    ('content', 'content'),
+    ('date', 'date'),
+    ('order', 'order'),
+    ('chapter', 'chapter_id'),
+    ('branch', 'branch_id'),
+    ('created_at', 'created_at'),
+    ('updated_at', 'updated_at'),
+]
+
+
+def _isoformat(value):
+    return value.isoformat()
+
+
+_encoder = json.JSONEncoder(default=_isoformat, ensure_ascii=False, separators=(',', ':'))
+
+
+def _rows(queryset, columns, kind=None):
+    """Yield one dict per row, reading the table in chunks"""
+    for row in queryset.values(*[column for _, column in columns]).iterator(chunk_size=CHUNK_SIZE):
+        record = {'record': kind} if kind else {}
+        for name, column in columns:
+            record[name] = row[column]
+        yield record
+
+
+def chapter_rows(user, kind=None):
+    return _rows(Chapter.objects.filter(user=user).order_by('id'), CHAPTER_COLUMNS, kind)
+
+
+def event_rows(user, kind=None):
+    events = Event.objects.filter(user=user).annotate(content=Inflate()).order_by('id')
+    return _rows(events, EVENT_COLUMNS, kind)
+
+
+def _header(user):
+    return {
+        'record': 'meta',
+        'version': EXPORT_VERSION,
+        'user': user.email,
+        'exported_at': timezone.now(),
+    }
+
+
+def iter_ndjson(user):
+    """
+    One JSON document per line: a meta header, then every chapter, then
+    every event. Each line carries a "record" key saying which it is.
+    """
+    yield _encoder.encode(_header(user)) + '\n'
+    for record in chapter_rows(user, 'chapter'):
+        yield _encoder.encode(record) + '\n'
+    for record in event_rows(user, 'event'):
+        yield _encoder.encode(record) + '\n'
+
+
+def iter_json(user):
+    """A single {"meta": ..., "chapters": [...], "events": [...]} document, written piecewise"""
+    header = _header(user)
+    del header['record']
+    yield '{"meta":' + _encoder.encode(header) + ',"chapters":['
+    for i, record in enumerate(chapter_rows(user)):
+        yield (',' if i else '') + _encoder.encode(record)
+    yield '],"events":['
+    for i, record in enumerate(event_rows(user)):
+        yield (',' if i else '') + _encoder.encode(record)
+    yield ']}\n'
+
+
+def buffered(pieces, size=BUFFER_SIZE):
+    """Join small string pieces into byte chunks of about `size`"""
+    buffer = []
+    length = 0
+    for piece in pieces:
+        data = piece.encode()
+        buffer.append(data)
+        length += len(data)
+        if length >= size:
+            yield b''.join(buffer)
+            buffer = []
+            length = 0
+    if buffer:
+        yield b''.join(buffer)
+
+
+def gzipped(chunks):
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)  # wbits=31: gzip container
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def export_stream(user, fmt='ndjson', compress=False):
+    """Byte chunks of the user's export, memory stays flat regardless of journal size"""
+    pieces = iter_json(user) if fmt == 'json' else iter_ndjson(user)
+    chunks = buffered(pieces)
+    return gzipped(chunks) if compress else chunks
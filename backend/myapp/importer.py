@@ -0,0 +1,366 @@
+# importer.py
+import datetime
+import itertools
+
+from django.core.exceptions import ValidationError
+from django.db import transaction
+from django.utils.dateparse import parse_date
+
+from .aggregates import refresh_aggregates
+from .cache import invalidate_timeline_on_commit
+from .lineage import LineageCycleError, sync_lineage
+from .models import ChangeSequence, Chapter, Event, EventContent, count_words, make_excerpt
+from .periods import invalidate_periods
+
+BATCH_SIZE = 1000
+
+
+class ImportFormatError(ValueError):
+    pass
+
+
+def _date(value, where):
+    if isinstance(value, datetime.datetime):
+        return value.date()
+    if isinstance(value, datetime.date):
+        return value
+    if isinstance(value, str):
+        # Also accepts full ISO timestamps, as JSON-encoded JS Dates are
+        try:
+            parsed = parse_date(value[:10])
+        except ValueError:
+            parsed = None
+        if parsed is not None:
+            return parsed
+    raise ImportFormatError(f'{where}: invalid date {value!r}')
+
+
+def _optional_date(value, where):
+    return None if value in (None, '') else _date(value, where)
+
+
+def _int(value, where, default=0):
+    if value in (None, ''):
+        return default
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        raise ImportFormatError(f'{where}: expected a number, got {value!r}')
+
+
+def _ref(kind, value):
+    return None if value in (None, '') else f'{kind}:{value}'[:64]
+
+
+# Resolved in run(), once the rows they point at have ids
+RELATIONS = {
+    Chapter: ['user', 'parent_branch', 'source_entry', 'source_chapter'],
+    Event: ['user', 'chapter', 'branch'],
+}
+
+
+def _check(model, fields, where):
+    # The model's own validation (lengths, choices), so bad rows are reported
+    # here rather than failing (or being stored) at bulk_create
+    try:
+        model(**fields).full_clean(exclude=RELATIONS[model], validate_unique=False, validate_constraints=False)
+    except ValidationError as exc:
+        errors = '; '.join(
+            f"{name}: {' '.join(messages)}" for name, messages in sorted(exc.message_dict.items())
+        )
+        raise ImportFormatError(f'{where}: {errors}')
+
+
+class TimelineImporter:
+    """
+    Imports a timeline for one user with batched bulk_create.
+
+    Accepts the nested {"mainTimeline": [...], "branches": [...]} structure the
+    frontend works with, or the records of an export (NDJSON lines, or the
+    {"chapters": [...], "events": [...]} JSON document). References between
+    rows are resolved in memory; rows whose client id was already imported for
+    this user are skipped, so running the same import twice is harmless.
+    """
+
+    def __init__(self, user):
+        self.user = user
+        self.chapters = []
+        self.events = []
+        self._auto = itertools.count()
+
+    def _key(self, ref):
+        # Rows without a client id still need a key for in-memory references
+        return ref or f'_auto:{next(self._auto)}'
+
+    def add_chapter(self, ref, parent=None, source_entry=None, source_chapter=None, where='chapter', **fields):
+        _check(Chapter, fields, where)
+        key = self._key(ref)
+        self.chapters.append({
+            'key': key,
+            'external_id': ref,
+            'parent': parent,
+            'source_entry': source_entry,
+            'source_chapter': source_chapter,
+            'fields': fields,
+        })
+        return key
+
+    def add_event(self, ref, chapter=None, branch=None, where='event', **fields):
+        _check(Event, fields, where)
+        key = self._key(ref)
+        self.events.append({
+            'key': key,
+            'external_id': ref,
+            'chapter': chapter,
+            'branch': branch,
+            'fields': fields,
+        })
+        return key
+
+    # Input formats
+
+    def load(self, data):
+        if isinstance(data, list):
+            return self.load_records(data)
+        if not isinstance(data, dict):
+            raise ImportFormatError('Expected a timeline object or a list of records')
+        if 'chapters' in data or 'events' in data:
+            try:
+                records = [{**row, 'record': 'chapter'} for row in data.get('chapters') or []]
+                records += [{**row, 'record': 'event'} for row in data.get('events') or []]
+            except TypeError:
+                raise ImportFormatError('chapters and events must be lists of objects')
+            return self.load_records(records)
+        return self.load_nested(data)
+
+    def _nested_entry(self, entry, where, chapter=None, branch=None):
+        if not isinstance(entry, dict) or not entry.get('title'):
+            raise ImportFormatError(f'{where}: entries need a title')
+        self.add_event(
+            _ref('entry', entry.get('id')),
+            where=where,
+            chapter=chapter,
+            branch=branch,
+            title=str(entry['title']),
+            date=_date(entry.get('date'), where),
+            content=str(entry.get('content') or ''),
+            order=_int(entry.get('order'), where),
+        )
+
+    def _nested_period(self, period, where, kind, parent=None, color=None):
+        if not isinstance(period, dict) or not period.get('title'):
+            raise ImportFormatError(f'{where}: periods need a title')
+        key = self.add_chapter(
+            _ref('period', period.get('id')),
+            where=where,
+            parent=parent,
+            type=kind,
+            title=str(period['title']),
+            start_date=_date(period.get('startDate', period.get('start_date')), where),
+            end_date=_optional_date(period.get('endDate', period.get('end_date')), where),
+            color=period.get('color') or color or '#3B82F6',
+            collapsed=bool(period.get('collapsed', False)),
+            order=_int(period.get('order'), where),
+        )
+        for i, entry in enumerate(period.get('entries') or []):
+            self._nested_entry(entry, f'{where}.entries[{i}]', chapter=key)
+        return key
+
+    def load_nested(self, data):
+        main = data.get('mainTimeline', data.get('main_timeline')) or []
+        branches = data.get('branches') or []
+        if not isinstance(main, list) or not isinstance(branches, list):
+            raise ImportFormatError('mainTimeline and branches must be lists')
+
+        for i, period in enumerate(main):
+            self._nested_period(period, f'mainTimeline[{i}]', 'main_period')
+
+        for i, branch in enumerate(branches):
+            where = f'branches[{i}]'
+            if not isinstance(branch, dict):
+                raise ImportFormatError(f'{where}: expected an object')
+            periods = branch.get('periods') or []
+            entries = branch.get('directEntries', branch.get('entries')) or []
+            title = branch.get('name') or branch.get('title')
+            if not title:
+                raise ImportFormatError(f'{where}: branches need a name')
+
+            # Branches have no dates of their own in the nested format
+            start = branch.get('startDate', branch.get('start_date'))
+            if start in (None, ''):
+                dates = [p.get('startDate', p.get('start_date')) for p in periods if isinstance(p, dict)]
+                dates += [e.get('date') for e in entries if isinstance(e, dict)]
+                dates = [_date(d, where) for d in dates if d not in (None, '')]
+                start = min(dates) if dates else datetime.date.today()
+
+            color = branch.get('color') or '#3B82F6'
+            key = self.add_chapter(
+                _ref('branch', branch.get('id')),
+                where=where,
+                source_entry=_ref('entry', branch.get('sourceEntryId', branch.get('source_entry'))),
+                type='branch',
+                title=str(title),
+                start_date=_date(start, where),
+                end_date=_optional_date(branch.get('endDate', branch.get('end_date')), where),
+                color=color,
+                x_position=_int(branch.get('x', branch.get('x_position')), where),
+                collapsed=bool(branch.get('collapsed', False)),
+                order=_int(branch.get('order'), where, default=i),
+            )
+            for j, period in enumerate(periods):
+                self._nested_period(period, f'{where}.periods[{j}]', 'branch_period', parent=key, color=color)
+            for j, entry in enumerate(entries):
+                self._nested_entry(entry, f'{where}.entries[{j}]', branch=key)
+        return self
+
+    def load_records(self, records):
+        """Records in the export format, e.g. parsed NDJSON lines"""
+        for i, record in enumerate(records):
+            where = f'record {i}'
+            if not isinstance(record, dict):
+                raise ImportFormatError(f'{where}: expected an object')
+            kind = record.get('record')
+            if kind == 'meta':
+                continue
+            if not record.get('title'):
+                raise ImportFormatError(f'{where}: missing title')
+            if kind == 'chapter':
+                self.add_chapter(
+                    _ref('chapter', record.get('id')),
+                    where=where,
+                    parent=_ref('chapter', record.get('parent_branch')),
+                    source_entry=_ref('event', record.get('source_entry')),
+                    source_chapter=_ref('chapter', record.get('source_chapter')),
+                    type=record.get('type') or 'main_period',
+                    title=str(record['title']),
+                    start_date=_date(record.get('start_date'), where),
+                    end_date=_optional_date(record.get('end_date'), where),
+                    color=record.get('color') or '#3B82F6',
+                    x_position=_int(record.get('x_position'), where),
+                    collapsed=bool(record.get('collapsed', False)),
+                    order=_int(record.get('order'), where),
+                )
+            elif kind == 'event':
+                self.add_event(
+                    _ref('event', record.get('id')),
+                    where=where,
+                    chapter=_ref('chapter', record.get('chapter')),
+                    branch=_ref('chapter', record.get('branch')),
+                    title=str(record['title']),
+                    date=_date(record.get('date'), where),
+                    content=str(record.get('content') or ''),
+                    order=_int(record.get('order'), where),
+                )
+            else:
+                raise ImportFormatError(f'{where}: unknown record type {kind!r}')
+        return self
+
+    # Writing
+
+    def run(self):
+        with transaction.atomic():
+            chapter_ids = dict(
+                Chapter.objects.filter(user=self.user, external_id__isnull=False)
+                .values_list('external_id', 'id')
+            )
+            event_ids = dict(
+                Event.objects.filter(user=self.user, external_id__isnull=False)
+                .values_list('external_id', 'id')
+            )
+
+            new_chapters = self._create_chapters(chapter_ids)
+            new_events = self._create_events(chapter_ids, event_ids)
+            self._link_sources(new_chapters, chapter_ids, event_ids)
+            try:
+                sync_lineage([obj.pk for _, obj in new_chapters])
+            except LineageCycleError:
+                raise ImportFormatError('Branch sources form a cycle')
+            filled = {event.chapter_id for event in new_events} | {event.branch_id for event in new_events}
+            refresh_aggregates(Chapter.objects.filter(pk__in=filled - {None}))
+            invalidate_timeline_on_commit(self.user.pk)
+            if new_chapters:
+                invalidate_periods(self.user.pk)
+
+        return {
+            'chapters_created': len(new_chapters),
+            'chapters_skipped': len(self.chapters) - len(new_chapters),
+            'events_created': len(new_events),
+            'events_skipped': len(self.events) - len(new_events),
+        }
+
+    def _unseen(self, specs, existing):
+        # Skip rows imported before, and repeats of a client id within this import
+        seen = set(existing)
+        unseen = []
+        for spec in specs:
+            if spec['key'] not in seen:
+                seen.add(spec['key'])
+                unseen.append(spec)
+        return unseen
+
+    def _create_chapters(self, chapter_ids):
+        pending = self._unseen(self.chapters, chapter_ids)
+        pending_keys = {spec['key'] for spec in pending}
+        created = []
+        # Insert level by level so every parent has a pk before its children
+        while pending:
+            ready = [
+                spec for spec in pending
+                if spec['parent'] is None or spec['parent'] not in pending_keys
+            ]
+            if not ready:
+                raise ImportFormatError('Branch references form a cycle')
+            objs = [
+                Chapter(
+                    user=self.user,
+                    external_id=spec['external_id'],
+                    parent_branch_id=chapter_ids.get(spec['parent']),
+                    **spec['fields'],
+                )
+                for spec in ready
+            ]
+            ChangeSequence.stamp(objs)
+            Chapter.objects.bulk_create(objs, batch_size=BATCH_SIZE)
+            for spec, obj in zip(ready, objs):
+                chapter_ids[spec['key']] = obj.pk
+                pending_keys.discard(spec['key'])
+                created.append((spec, obj))
+            pending = [spec for spec in pending if spec['key'] in pending_keys]
+        return created
+
+    def _create_events(self, chapter_ids, event_ids):
+        ready = self._unseen(self.events, event_ids)
+        objs = [
+            Event(
+                user=self.user,
+                external_id=spec['external_id'],
+                chapter_id=chapter_ids.get(spec['chapter']),
+                branch_id=chapter_ids.get(spec['branch']),
+                excerpt=make_excerpt(spec['fields']['content']),
+                word_count=count_words(spec['fields']['content']),
+                **spec['fields'],
+            )
+            for spec in ready
+        ]
+        ChangeSequence.stamp(objs)
+        Event.objects.bulk_create(objs, batch_size=BATCH_SIZE)
+        EventContent.save_for(objs, created=True)
+        for spec, obj in zip(ready, objs):
+            event_ids[spec['key']] = obj.pk
+        return objs
+
+    def _link_sources(self, new_chapters, chapter_ids, event_ids):
+        # Branch sources can point at events, which only exist now
+        linked = []
+        for spec, obj in new_chapters:
+            source_entry = event_ids.get(spec['source_entry'])
+            source_chapter = chapter_ids.get(spec['source_chapter'])
+            if source_entry or source_chapter:
+                obj.source_entry_id = source_entry
+                obj.source_chapter_id = source_chapter
+                linked.append(obj)
+        if linked:
+            ChangeSequence.stamp(linked)
+            Chapter.objects.bulk_update(
+                linked, ['source_entry', 'source_chapter', 'change_seq'], batch_size=BATCH_SIZE
+            )
@@ -0,0 +1,165 @@
+# lineage.py
+from django.db import connections, router, transaction
+from django.db.models import F, Q
+
+from .models import Chapter, ChapterLineage
+
+# The chapter tree is spread over three references: a period's
+# parent_branch, and a branch's source_entry (an event, so the chapter
+# holding it) or source_chapter. ChapterLineage keeps its transitive closure,
+# so a subtree, an ancestry or a cycle check is one indexed query instead of
+# a walk. sync_lineage() brings it up to date after any write that may have
+# changed a chapter's parent; everything here reads and writes the closure
+# in the caller's transaction.
+
+
+class LineageCycleError(ValueError):
+    """A chapter would become its own ancestor"""
+
+
+def _parents(ids):
+    """{chapter id: parent id or None}, as ChapterLineage defines the parent"""
+    rows = Chapter.all_objects.filter(pk__in=ids).values_list(
+        'id', 'parent_branch_id', 'source_entry__chapter_id', 'source_entry__branch_id', 'source_chapter_id'
+    )
+    return {pk: next((parent for parent in candidates if parent is not None), None) for pk, *candidates in rows}
+
+
+def parent_for(parent_branch=None, source_entry=None, source_chapter=None):
+    """The parent id a chapter with these references gets"""
+    if parent_branch is not None:
+        return parent_branch.pk
+    if source_entry is not None and (source_entry.chapter_id or source_entry.branch_id):
+        return source_entry.chapter_id or source_entry.branch_id
+    return source_chapter.pk if source_chapter is not None else None
+
+
+def is_descendant(chapter_id, ancestor_id):
+    """True when chapter_id is ancestor_id or descends from it"""
+    return ChapterLineage.objects.filter(ancestor_id=ancestor_id, descendant_id=chapter_id).exists()
+
+
+def spawned_subtree_contains(event_id, chapter_id):
+    """True when chapter_id is in the subtree of a branch spawned from the event"""
+    return ChapterLineage.objects.filter(ancestor__source_entry_id=event_id, descendant_id=chapter_id).exists()
+
+
+def subtree(chapter_id):
+    """The chapter and its live descendants, annotated with their depth below it"""
+    return (
+        Chapter.objects.filter(ancestor_links__ancestor_id=chapter_id)
+        .annotate(depth=F('ancestor_links__depth'))
+        .order_by('depth', 'order', 'start_date', 'id')
+    )
+
+
+def ancestry(chapter_id):
+    """The chapter's live ancestors and itself, root first (breadcrumbs)"""
+    return (
+        Chapter.objects.filter(descendant_links__descendant_id=chapter_id)
+        .annotate(depth=F('descendant_links__depth'))
+        .order_by('-depth')
+    )
+
+
+def _insert_sql(connection):
+    table = connection.ops.quote_name(ChapterLineage._meta.db_table)
+    return (
+        f'INSERT INTO {table} (ancestor_id, descendant_id, depth) '
+        f'SELECT above.ancestor_id, below.descendant_id, above.depth + below.depth + 1 '
+        f'FROM {table} above, {table} below '
+        f'WHERE above.descendant_id = %s AND below.ancestor_id = %s'
+    )
+
+
+def _move(chapter_id, parent_id):
+    """Hang the chapter's subtree under parent_id (None: make it a root)"""
+    if parent_id is not None and is_descendant(parent_id, chapter_id):
+        raise LineageCycleError(f'Chapter {parent_id} descends from chapter {chapter_id}')
+    below = ChapterLineage.objects.filter(ancestor_id=chapter_id).values('descendant_id')
+    # Cut the subtree loose from its old ancestors, keeping the paths within it
+    ChapterLineage.objects.filter(descendant_id__in=below).exclude(ancestor_id__in=below).delete()
+    if parent_id is not None:
+        # Every ancestor of the parent (itself included) over every node of the subtree
+        connection = connections[router.db_for_write(ChapterLineage)]
+        with connection.cursor() as cursor:
+            cursor.execute(_insert_sql(connection), [parent_id, chapter_id])
+
+
+def sync_lineage(ids):
+    """
+    Update the closure for chapters whose parent may have changed, or which
+    are new. New chapters are added in one INSERT; each moved one costs a
+    cycle check and two statements, whatever the size of its subtree.
+    Raises LineageCycleError (rolling back the caller's transaction if it
+    lets it through) when the references form a cycle.
+    """
+    ids = set(ids)
+    if not ids:
+        return
+    with transaction.atomic(using=router.db_for_write(ChapterLineage)):
+        parents = _parents(ids)
+        current, known = {}, set()
+        for descendant, ancestor, depth in ChapterLineage.objects.filter(
+            descendant_id__in=parents, depth__lte=1
+        ).values_list('descendant_id', 'ancestor_id', 'depth'):
+            if depth == 0:
+                known.add(descendant)
+            else:
+                current[descendant] = ancestor
+
+        new = {pk: parent for pk, parent in parents.items() if pk not in known}
+        if new:
+            _insert_new(new)
+        for pk, parent in parents.items():
+            if pk in known and current.get(pk) != parent:
+                _move(pk, parent)
+
+
+def _insert_new(new):
+    # Parents come first, so a parent created in the same batch already has
+    # its rows when its children are added
+    outside = {parent for parent in new.values() if parent is not None and parent not in new}
+    ancestors = {}
+    for descendant, ancestor, depth in ChapterLineage.objects.filter(
+        descendant_id__in=outside
+    ).values_list('descendant_id', 'ancestor_id', 'depth'):
+        ancestors.setdefault(descendant, []).append((ancestor, depth))
+
+    rows = []
+    pending = dict(new)
+    while pending:
+        ready = [pk for pk, parent in pending.items() if parent not in pending]
+        if not ready:
+            raise LineageCycleError(f'Chapters {sorted(pending)} form a cycle')
+        for pk in ready:
+            parent = pending.pop(pk)
+            chain = [(pk, 0)]
+            if parent is not None:
+                chain += [(ancestor, depth + 1) for ancestor, depth in ancestors.get(parent, [])]
+            ancestors[pk] = chain
+            rows += [ChapterLineage(ancestor_id=ancestor, descendant_id=pk, depth=depth) for ancestor, depth in chain]
+    ChapterLineage.objects.bulk_create(rows, batch_size=1000)
+
+
+def sync_spawned(event_ids):
+    """sync_lineage() for the branches spawned from events that may have moved"""
+    sync_lineage(Chapter.all_objects.filter(source_entry_id__in=event_ids).values_list('id', flat=True))
+
+
+def children_of(ids):
+    """Chapters, outside `ids`, whose parent is one of `ids`"""
+    return list(
+        ChapterLineage.objects.filter(ancestor_id__in=ids, depth=1)
+        .exclude(descendant_id__in=ids)
+        .values_list('descendant_id', flat=True)
+    )
+
+
+def drop_lineage(ids):
+    """
+    Remove the chapters from the closure before they are deleted for good.
+    Call sync_lineage(children_of(ids)) first, once their references have
+    been cleared, so those children keep their own subtrees.
+    """
+    ChapterLineage.objects.filter(Q(ancestor_id__in=ids) | Q(descendant_id__in=ids)).delete()
@@ -0,0 +1,220 @@
+# loadtest.py
+import asyncio
+import itertools
+import statistics
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+from asgiref.sync import ThreadSensitiveContext
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.test import AsyncClient, Client
+from rest_framework.authtoken.models import Token
+from users import hashing
+
+from .benchmark import percentile
+
+
+def default_pairs():
+    """(name, WSGI path, ASGI path) for the endpoints that have async versions"""
+    return [
+        ('timeline_data (cached)', '/api/chapters/timeline_data/', '/api/async/chapters/timeline_data/'),
+        (
+            'timeline_data window',
+            '/api/chapters/timeline_data/?start=2000-01-01&end=2004-12-31',
+            '/api/async/chapters/timeline_data/?start=2000-01-01&end=2004-12-31',
+        ),
+        ('chapters list (20)', '/api/chapters/?page_size=20', '/api/async/chapters/?page_size=20'),
+        ('events list summary', '/api/events/?view=summary', '/api/async/events/?view=summary'),
+    ]
+
+
+@contextmanager
+def simulated_latency(seconds):
+    """
+    Make every query on every connection take at least `seconds` longer, to
+    stand in for a database across the network (SQLite answers in
+    microseconds, which hides what blocking on the database costs).
+    """
+    if not seconds:
+        yield
+        return
+
+    def slow(execute, sql, params, many, context):
+        time.sleep(seconds)
+        return execute(sql, params, many, context)
+
+    def install(sender, connection, **kwargs):
+        connection.execute_wrappers.append(slow)
+
+    connection_created.connect(install, weak=False)
+    existing = list(connections.all(initialized_only=True))
+    for connection in existing:
+        connection.execute_wrappers.append(slow)
+    try:
+        yield
+    finally:
+        connection_created.disconnect(install)
+        for connection in existing:
+            connection.execute_wrappers.remove(slow)
+
+
+def _summary(latencies, elapsed, statuses):
+    return {
+        'requests': len(latencies),
+        'throughput_rps': round(len(latencies) / elapsed, 1),
+        'p50_ms': round(percentile(latencies, 50), 2),
+        'p95_ms': round(percentile(latencies, 95), 2),
+        'mean_ms': round(statistics.fmean(latencies), 2),
+        'errors': sum(1 for status in statuses if status >= 400),
+    }
+
+
+class LoadTest:
+    """
+    Closed-loop load test run in-process: `concurrency` clients each send
+    requests back to back until `requests` have been made in total.
+
+    The WSGI side runs the sync DRF views through the WSGI handler on a pool
+    of `threads` threads that takes requests in order, like one gthread
+    worker. The ASGI side
+    runs the async views through the ASGI handler on one event loop, like one
+    uvicorn worker. Latencies are as the clients see them, queueing included.
+    """
+
+    def __init__(self, user, concurrency=16, requests=200, threads=4):
+        self.concurrency = concurrency
+        self.requests = requests
+        self.threads = threads
+        token, _ = Token.objects.get_or_create(user=user)
+        self.header = f'Token {token.key}'
+
+    def _per_client(self):
+        base, extra = divmod(self.requests, self.concurrency)
+        return [base + (1 if i < extra else 0) for i in range(self.concurrency)]
+
+    def run_wsgi(self, path, server=None):
+        latencies, statuses = [], []
+        lock = threading.Lock()
+
+        def handle(client):
+            response = client.get(path)
+            response.content
+            return response
+
+        def client_loop(count):
+            client = Client(HTTP_AUTHORIZATION=self.header)
+            for _ in range(count):
+                started = time.perf_counter()
+                response = server.submit(handle, client).result()
+                with lock:
+                    latencies.append((time.perf_counter() - started) * 1000)
+                    statuses.append(response.status_code)
+
+        own_server = server is None
+        if own_server:
+            server = self._server()
+        try:
+            started = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=self.concurrency) as pool:
+                list(pool.map(client_loop, self._per_client()))
+            return _summary(latencies, time.perf_counter() - started, statuses)
+        finally:
+            if own_server:
+                server.shutdown()
+
+    def _server(self):
+        # The worker's threads, taking requests first come first served
+        return ThreadPoolExecutor(max_workers=self.threads, thread_name_prefix='wsgi')
+
+    def run_asgi(self, path):
+        latencies, statuses = [], []
+        headers = {'Authorization': self.header}
+
+        async def client_loop(count):
+            client = AsyncClient()
+            for _ in range(count):
+                started = time.perf_counter()
+                # As ASGIHandler does (the test client does not): each request
+                # gets its own thread for the ORM's sync_to_async calls
+                async with ThreadSensitiveContext():
+                    response = await client.get(path, headers=headers)
+                latencies.append((time.perf_counter() - started) * 1000)
+                statuses.append(response.status_code)
+
+        async def main():
+            await asyncio.gather(*(client_loop(count) for count in self._per_client()))
+
+        started = time.perf_counter()
+        asyncio.run(main())
+        return _summary(latencies, time.perf_counter() - started, statuses)
+
+    def run(self, pairs=None, db_latency=0.0):
+        results = []
+        with simulated_latency(db_latency):
+            for name, wsgi_path, asgi_path in pairs or default_pairs():
+                # Warm caches (snapshot, token) on both sides first
+                Client(HTTP_AUTHORIZATION=self.header).get(wsgi_path)
+                asyncio.run(AsyncClient().get(asgi_path, headers={'Authorization': self.header}))
+                results.append({
+                    'name': name,
+                    'wsgi': self.run_wsgi(wsgi_path),
+                    'asgi': self.run_asgi(asgi_path),
+                })
+        return results
+
+    def run_login_flood(self, path, attackers=8, login_path='/api/users/login/'):
+        """
+        WSGI latency of reads of `path` on their own, then while `attackers`
+        clients post failing logins back to back, sharing the `threads`
+        workers with the reads. Every login comes from a new IP for a new
+        email, as in credential stuffing, so the throttles let all of them
+        through. The flood runs with hashing bounded as configured (see
+        users.hashing), then unbounded for comparison.
+        """
+        Client(HTTP_AUTHORIZATION=self.header).get(path)
+        results = [{'name': 'no flood', 'reads': self.run_wsgi(path), 'logins': {}}]
+        for name, executor in (
+            ('login flood, bounded hashing', hashing.executor),
+            ('login flood, unbounded hashing', hashing.BoundedExecutor(workers=attackers, queue=0)),
+        ):
+            results.append({'name': name, **self._flood(path, attackers, login_path, executor)})
+        return results
+
+    def _flood(self, path, attackers, login_path, executor):
+        server = self._server()
+        stop = threading.Event()
+        logins = Counter()
+        lock = threading.Lock()
+
+        def attack(n):
+            client = Client()
+            for i in itertools.count():
+                if stop.is_set():
+                    return
+                response = server.submit(
+                    client.post,
+                    login_path,
+                    {'email': f'flood-{n}-{i}@example.com', 'password': 'wrong'},
+                    REMOTE_ADDR=f'10.{n % 256}.{i // 256 % 256}.{i % 256}',
+                ).result()
+                with lock:
+                    logins[response.status_code] += 1
+
+        default, hashing.executor = hashing.executor, executor
+        try:
+            with ThreadPoolExecutor(max_workers=attackers) as pool:
+                flood = [pool.submit(attack, n) for n in range(attackers)]
+                try:
+                    reads = self.run_wsgi(path, server)
+                finally:
+                    stop.set()
+                for future in flood:
+                    future.result()
+        finally:
+            hashing.executor = default
+            server.shutdown()
+        return {'reads': reads, 'logins': {str(code): count for code, count in sorted(logins.items())}}
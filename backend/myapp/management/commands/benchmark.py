@@ -0,0 +1,103 @@
+import json
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test.utils import setup_test_environment, teardown_test_environment
+
+from myapp.benchmark import BenchmarkRunner
+from myapp.synthetic import SIZES, populate
+
+
+class Command(BaseCommand):
+    help = (
+        'Benchmark the API against a synthetic journal: p50/p95 latency, SQL '
+        'queries, peak memory and payload size per endpoint, size and encode '
+        'time per wire format, and event table sizes and read costs'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--size', choices=sorted(SIZES), default='1k')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--repeat', type=int, default=20)
+        parser.add_argument('--output', help='Write the results as JSON to this file')
+        parser.add_argument('--label', default='', help='Free-form tag stored with the results')
+        parser.add_argument(
+            '--no-test-db', action='store_true',
+            help='Use the configured database instead of a throwaway test database',
+        )
+
+    def handle(self, *args, **options):
+        setup_test_environment()
+        old_name = None
+        if not options['no_test_db']:
+            old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True)
+        try:
+            results = self.run(options)
+        finally:
+            if old_name is not None:
+                connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+
+        self.report(results)
+        if options['output']:
+            with open(options['output'], 'w') as out:
+                json.dump(results, out, indent=2)
+            self.stdout.write(f"Results written to {options['output']}")
+
+    def run(self, options):
+        User = get_user_model()
+        email = f"bench-{options['size']}-{options['seed']}@example.com"
+        user = User.objects.filter(email=email).first()
+        if user is None:
+            user = User.objects.create_user(email=email, password=None)
+            self.stdout.write(f"Generating {options['size']} journal...")
+            populate(user, size=options['size'], seed=options['seed'])
+
+        runner = BenchmarkRunner(user, repeat=options['repeat'])
+        return runner.run(size=options['size'], seed=options['seed'], label=options['label'])
+
+    def report(self, results):
+        header = f"{'scenario':<32}{'status':>7}{'p50 ms':>10}{'p95 ms':>10}{'queries':>9}{'peak KB':>11}{'bytes':>12}"
+        self.stdout.write(header)
+        self.stdout.write('-' * len(header))
+        for row in results['results']:
+            self.stdout.write(
+                f"{row['name']:<32}{row['status']:>7}{row['p50_ms']:>10.2f}{row['p95_ms']:>10.2f}"
+                f"{row['queries']:>9}{row['peak_memory_kb']:>11.1f}{row['payload_bytes']:>12}"
+            )
+
+        self.stdout.write('')
+        header = f"{'authentication':<32}{'queries/req':>14}{'us/req':>10}"
+        self.stdout.write(header)
+        self.stdout.write('-' * len(header))
+        for row in results['authentication']:
+            self.stdout.write(
+                f"{row['name']:<32}{row['queries_per_request']:>14.3f}{row['us_per_request']:>10.1f}"
+            )
+
+        self.stdout.write('')
+        header = f"{'document':<18}{'format':<14}{'bytes':>12}{'vs json':>9}{'encode ms':>11}"
+        self.stdout.write(header)
+        self.stdout.write('-' * len(header))
+        plain = {row['document']: row['bytes'] for row in results['formats'] if row['format'] == 'json'}
+        for row in results['formats']:
+            ratio = row['bytes'] / plain[row['document']]
+            self.stdout.write(
+                f"{row['document']:<18}{row['format']:<14}{row['bytes']:>12}{ratio:>9.2f}{row['encode_ms']:>11.2f}"
+            )
+
+        self.stdout.write('')
+        header = f"{'table':<32}{'rows':>9}{'bytes':>14}"
+        self.stdout.write(header)
+        self.stdout.write('-' * len(header))
+        for row in results['storage']['tables']:
+            size = '-' if row['bytes'] is None else row['bytes']
+            self.stdout.write(f"{row['table']:<32}{row['rows']:>9}{size:>14}")
+
+        self.stdout.write('')
+        header = f"{'event query':<32}{'rows':>9}{'bytes':>14}{'p50 ms':>10}"
+        self.stdout.write(header)
+        self.stdout.write('-' * len(header))
+        for row in results['storage']['queries']:
+            self.stdout.write(f"{row['query']:<32}{row['rows']:>9}{row['bytes']:>14}{row['p50_ms']:>10.2f}")
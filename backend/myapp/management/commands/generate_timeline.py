@@ -0,0 +1,33 @@
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+
+from myapp.synthetic import SIZES, populate
+
+
+class Command(BaseCommand):
+    help = 'Create (or extend) a user with a deterministic synthetic timeline'
+
+    def add_arguments(self, parser):
+        parser.add_argument('email', help='User to fill; created if missing')
+        parser.add_argument('--size', choices=sorted(SIZES), default='1k')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--main-periods', type=int)
+        parser.add_argument('--branches', type=int)
+        parser.add_argument('--branch-periods', type=int, help='Periods per branch')
+        parser.add_argument('--events', type=int)
+
+    def handle(self, *args, **options):
+        User = get_user_model()
+        user = User.objects.filter(email=options['email']).first()
+        if user is None:
+            user = User.objects.create_user(email=options['email'], password=None)
+
+        overrides = {
+            name: options[name]
+            for name in ('main_periods', 'branches', 'branch_periods', 'events')
+            if options[name] is not None
+        }
+        stats = populate(user, size=options['size'], seed=options['seed'], **overrides)
+        self.stdout.write(self.style.SUCCESS(
+            f"{user.email}: created {stats['chapters_created']} chapters and {stats['events_created']} events"
+        ))
@@ -0,0 +1,51 @@
+import gzip
+import json
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+
+from myapp.importer import ImportFormatError, TimelineImporter
+
+
+class Command(BaseCommand):
+    help = (
+        "Import a timeline for a user from a nested mainTimeline/branches JSON "
+        "file or an export (.ndjson / .json, optionally .gz)"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('email', help='Email of the user to import into')
+        parser.add_argument('path', help='File to import')
+        parser.add_argument(
+            '--format', choices=['auto', 'json', 'ndjson'], default='auto',
+            help='Input format (default: guess from the file name)',
+        )
+
+    def handle(self, *args, **options):
+        User = get_user_model()
+        try:
+            user = User.objects.get(email=options['email'])
+        except User.DoesNotExist:
+            raise CommandError(f"No user with email {options['email']}")
+
+        path = options['path']
+        fmt = options['format']
+        if fmt == 'auto':
+            fmt = 'ndjson' if path.removesuffix('.gz').endswith('.ndjson') else 'json'
+        opener = gzip.open if path.endswith('.gz') else open
+
+        importer = TimelineImporter(user)
+        try:
+            with opener(path, 'rt', encoding='utf-8') as source:
+                if fmt == 'ndjson':
+                    importer.load_records(json.loads(line) for line in source if line.strip())
+                else:
+                    importer.load(json.load(source))
+            stats = importer.run()
+        except (OSError, json.JSONDecodeError, ImportFormatError) as exc:
+            raise CommandError(str(exc))
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Imported {stats['chapters_created']} chapters and {stats['events_created']} events "
+            f"({stats['chapters_skipped']} chapters and {stats['events_skipped']} events already present)"
+        ))
@@ -0,0 +1,103 @@
+import json
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test.utils import setup_test_environment, teardown_test_environment
+
+from myapp.loadtest import LoadTest
+from myapp.synthetic import SIZES, populate
+
+
+class Command(BaseCommand):
+    help = (
+        'Load test the sync read endpoints over WSGI against their async '
+        'versions over ASGI: throughput and client-side latency'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--size', choices=sorted(SIZES), default='1k')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--concurrency', type=int, default=16, help='Simultaneous clients')
+        parser.add_argument('--requests', type=int, default=200, help='Requests per endpoint and side')
+        parser.add_argument('--threads', type=int, default=4, help='WSGI worker threads')
+        parser.add_argument(
+            '--db-latency', type=float, default=0.0,
+            help='Milliseconds added to every query, to simulate a remote database',
+        )
+        parser.add_argument(
+            '--login-flood', type=int, metavar='ATTACKERS',
+            help='Instead, measure cached timeline reads over WSGI while this many clients flood the login endpoint',
+        )
+        parser.add_argument('--output', help='Write the results as JSON to this file')
+        parser.add_argument(
+            '--no-test-db', action='store_true',
+            help='Use the configured database instead of a throwaway test database',
+        )
+
+    def handle(self, *args, **options):
+        setup_test_environment()
+        old_name = None
+        if not options['no_test_db']:
+            old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True)
+        try:
+            results = self.run(options)
+        finally:
+            if old_name is not None:
+                connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+
+        self.report(results)
+        if options['output']:
+            with open(options['output'], 'w') as out:
+                json.dump({'options': self.meta(options), 'results': results}, out, indent=2)
+            self.stdout.write(f"Results written to {options['output']}")
+
+    def meta(self, options):
+        keys = ('size', 'seed', 'concurrency', 'requests', 'threads', 'db_latency', 'login_flood')
+        return {key: options[key] for key in keys}
+
+    def run(self, options):
+        User = get_user_model()
+        email = f"bench-{options['size']}-{options['seed']}@example.com"
+        user = User.objects.filter(email=email).first()
+        if user is None:
+            user = User.objects.create_user(email=email, password=None)
+            self.stdout.write(f"Generating {options['size']} journal...")
+            populate(user, size=options['size'], seed=options['seed'])
+
+        test = LoadTest(
+            user,
+            concurrency=options['concurrency'],
+            requests=options['requests'],
+            threads=options['threads'],
+        )
+        if options['login_flood']:
+            return test.run_login_flood('/api/chapters/timeline_data/', attackers=options['login_flood'])
+        return test.run(db_latency=options['db_latency'] / 1000)
+
+    def report(self, results):
+        if results and 'reads' in results[0]:
+            return self.report_login_flood(results)
+        header = f"{'endpoint':<26}{'side':>6}{'req/s':>9}{'p50 ms':>10}{'p95 ms':>10}{'errors':>8}"
+        self.stdout.write(header)
+        self.stdout.write('-' * len(header))
+        for row in results:
+            for side in ('wsgi', 'asgi'):
+                stats = row[side]
+                self.stdout.write(
+                    f"{row['name'] if side == 'wsgi' else '':<26}{side:>6}{stats['throughput_rps']:>9.1f}"
+                    f"{stats['p50_ms']:>10.2f}{stats['p95_ms']:>10.2f}{stats['errors']:>8}"
+                )
+
+    def report_login_flood(self, results):
+        header = f"{'timeline_data reads':<32}{'req/s':>9}{'p50 ms':>10}{'p95 ms':>10}  logins by status"
+        self.stdout.write(header)
+        self.stdout.write('-' * len(header))
+        for row in results:
+            stats = row['reads']
+            logins = ', '.join(f'{code}: {count}' for code, count in row['logins'].items()) or '-'
+            self.stdout.write(
+                f"{row['name']:<32}{stats['throughput_rps']:>9.1f}{stats['p50_ms']:>10.2f}{stats['p95_ms']:>10.2f}  {logins}"
+            )
+
@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+
+from myapp.deletion import PURGE_BATCH_SIZE, purge_deleted
+
+
+class Command(BaseCommand):
+    help = 'Remove soft-deleted chapters and events for good, and expired tombstones'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size', type=int, default=PURGE_BATCH_SIZE,
+            help=f'Rows per transaction (default {PURGE_BATCH_SIZE})',
+        )
+
+    def handle(self, *args, **options):
+        purged = purge_deleted(batch_size=options['batch_size'])
+        self.stdout.write(
+            f"Purged {purged['chapters']} chapters, {purged['events']} events and {purged['tombstones']} tombstones"
+        )
@@ -0,0 +1,38 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from myapp.aggregates import REFRESH_BATCH_SIZE, check_aggregates
+from myapp.models import Chapter
+
+
+class Command(BaseCommand):
+    help = "Recount chapters' entry counts, word counts and entry dates, fixing those that are off"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', type=int, help='Only this user id')
+        parser.add_argument(
+            '--verify', action='store_true',
+            help='Report wrong chapters without fixing them; fails if there are any',
+        )
+        parser.add_argument(
+            '--batch-size', type=int, default=REFRESH_BATCH_SIZE,
+            help=f'Chapters per query (default {REFRESH_BATCH_SIZE})',
+        )
+
+    def handle(self, *args, **options):
+        chapters = Chapter.all_objects.all()
+        if options['user'] is not None:
+            chapters = chapters.filter(user_id=options['user'])
+        stale = check_aggregates(chapters, fix=not options['verify'], batch_size=options['batch_size'])
+
+        for chapter_id, diff in list(stale.items())[:20]:
+            changes = ', '.join(f'{name} {stored} -> {right}' for name, (stored, right) in diff.items())
+            self.stdout.write(f'chapter {chapter_id}: {changes}')
+        if len(stale) > 20:
+            self.stdout.write(f'... and {len(stale) - 20} more')
+
+        if options['verify']:
+            if stale:
+                raise CommandError(f'{len(stale)} chapters have wrong aggregates')
+            self.stdout.write('All chapter aggregates are correct')
+        else:
+            self.stdout.write(f'Fixed {len(stale)} chapters')
@@ -0,0 +1,105 @@
+# metrics.py
+import threading
+from bisect import bisect_left
+
+# Upper bounds in seconds / queries, Prometheus style (+Inf is implicit)
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200, 500)
+
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class RequestMetrics:
+    """
+    Per-process request histograms keyed by URL name.
+
+    Recording is a dict lookup and a few bisects under one lock, cheap enough
+    to leave on. Each worker process keeps its own numbers.
+    """
+    phases = ('total', 'view', 'render', 'db')
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._durations = {}
+        self._queries = {}
+        self._statuses = {}
+
+    def record(self, view, status, timings, queries):
+        with self._lock:
+            for phase in self.phases:
+                key = (view, phase)
+                histogram = self._durations.get(key)
+                if histogram is None:
+                    histogram = self._durations[key] = Histogram(DURATION_BUCKETS)
+                histogram.observe(timings[phase])
+
+            histogram = self._queries.get(view)
+            if histogram is None:
+                histogram = self._queries[view] = Histogram(QUERY_BUCKETS)
+            histogram.observe(queries)
+
+            key = (view, str(status))
+            self._statuses[key] = self._statuses.get(key, 0) + 1
+
+    def reset(self):
+        with self._lock:
+            self._durations.clear()
+            self._queries.clear()
+            self._statuses.clear()
+
+    def render(self, extra=()):
+        """Prometheus text exposition format (version 0.0.4)"""
+        lines = []
+        with self._lock:
+            lines += [
+                '# HELP tree_requests_total Requests handled, by URL name and status.',
+                '# TYPE tree_requests_total counter',
+            ]
+            for (view, status), count in sorted(self._statuses.items()):
+                lines.append(f'tree_requests_total{{view="{view}",status="{status}"}} {count}')
+
+            lines += [
+                '# HELP tree_request_duration_seconds Request time by phase (total, view, render, db).',
+                '# TYPE tree_request_duration_seconds histogram',
+            ]
+            for (view, phase), histogram in sorted(self._durations.items()):
+                lines += _histogram_lines(
+                    'tree_request_duration_seconds', f'view="{view}",phase="{phase}"', histogram
+                )
+
+            lines += [
+                '# HELP tree_request_queries SQL queries per request.',
+                '# TYPE tree_request_queries histogram',
+            ]
+            for view, histogram in sorted(self._queries.items()):
+                lines += _histogram_lines('tree_request_queries', f'view="{view}"', histogram)
+
+        for name, kind, help_text, value in extra:
+            lines += [f'# HELP {name} {help_text}', f'# TYPE {name} {kind}', f'{name} {value}']
+        return '\n'.join(lines) + '\n'
+
+
+def _histogram_lines(name, labels, histogram):
+    lines = []
+    cumulative = 0
+    for bound, count in zip(histogram.buckets, histogram.counts):
+        cumulative += count
+        lines.append(f'{name}_bucket{{{labels},le="{bound}"}} {cumulative}')
+    lines.append(f'{name}_bucket{{{labels},le="+Inf"}} {histogram.count}')
+    lines.append(f'{name}_sum{{{labels}}} {histogram.sum:.6f}')
+    lines.append(f'{name}_count{{{labels}}} {histogram.count}')
+    return lines
+
+
+request_metrics = RequestMetrics()
@@ -0,0 +1,257 @@
+# middleware.py
+import gzip
+import time
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.utils.cache import patch_vary_headers
+from whitenoise.middleware import WhiteNoiseMiddleware as BaseWhiteNoiseMiddleware
+
+from .metrics import request_metrics
+
+try:
+    import brotli
+except ImportError:  # optional, gzip only without it
+    brotli = None
+
+COMPRESSION_MIN_SIZE = getattr(settings, 'COMPRESSION_MIN_SIZE', 1024)
+# Compression runs on every response, so the fastest levels: on a 10 MB
+# timeline document brotli 1 takes ~55 ms for 5x, where quality 5 takes
+# ~430 ms for 5.7x and the default (11) is meant for static files. gzip 6
+# would take ~700 ms against ~140 ms at level 1.
+BROTLI_QUALITY = getattr(settings, 'COMPRESSION_BROTLI_QUALITY', 1)
+GZIP_LEVEL = getattr(settings, 'COMPRESSION_GZIP_LEVEL', 1)
+COMPRESSIBLE_TYPES = ('application/json', 'application/x-ndjson', 'application/msgpack', 'text/')
+
+
+class QueryTimer:
+    """execute_wrapper that counts queries and adds up their time"""
+
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.duration += time.perf_counter() - started
+            self.count += 1
+
+
+# The timer of the request being handled. A context variable rather than a
+# per-request wrapper on each connection: connections are thread-local, and
+# the async ORM runs its queries in another thread, which sync_to_async
+# hands a copy of the context.
+current_timer = ContextVar('current_timer', default=None)
+
+
+def timed_execute(execute, sql, params, many, context):
+    timer = current_timer.get()
+    if timer is None:
+        return execute(sql, params, many, context)
+    return timer(execute, sql, params, many, context)
+
+
+def install_query_timer(connection):
+    """Add timed_execute to a connection once (see signals.py)"""
+    if timed_execute not in connection.execute_wrappers:
+        connection.execute_wrappers.append(timed_execute)
+
+
+class RequestMetricsMiddleware:
+    """
+    Times each request's SQL, view and render phases, reports them in a
+    Server-Timing header and feeds the per-URL-name histograms served by the
+    metrics endpoint.
+
+    The view phase ends when process_template_response runs, i.e. just before
+    a DRF Response is rendered. Queries run while a streaming response is
+    being consumed are not counted. Works in both sync and async stacks; async
+    views render their own responses, so their render phase is always zero.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        timer = QueryTimer()
+        started = time.perf_counter()
+        request._metrics_view_done = None
+        token = current_timer.set(timer)
+        try:
+            response = self.get_response(request)
+        finally:
+            current_timer.reset(token)
+        return self.finish(request, response, timer, started)
+
+    async def __acall__(self, request):
+        timer = QueryTimer()
+        started = time.perf_counter()
+        request._metrics_view_done = None
+        token = current_timer.set(timer)
+        try:
+            response = await self.get_response(request)
+        finally:
+            current_timer.reset(token)
+        return self.finish(request, response, timer, started)
+
+    def finish(self, request, response, timer, started):
+        finished = time.perf_counter()
+
+        view_done = request._metrics_view_done or finished
+        timings = {
+            'total': finished - started,
+            'view': view_done - started,
+            'render': finished - view_done,
+            'db': timer.duration,
+        }
+        match = getattr(request, 'resolver_match', None)
+        view = match.view_name if match else 'unmatched'
+        request_metrics.record(view, response.status_code, timings, timer.count)
+
+        response['Server-Timing'] = ', '.join([
+            f'db;dur={timings["db"] * 1000:.1f};desc="{timer.count} queries"',
+            f'view;dur={timings["view"] * 1000:.1f}',
+            f'render;dur={timings["render"] * 1000:.1f}',
+            f'total;dur={timings["total"] * 1000:.1f}',
+        ])
+        return response
+
+    def process_template_response(self, request, response):
+        request._metrics_view_done = time.perf_counter()
+        return response
+
+
+class WhiteNoiseMiddleware(BaseWhiteNoiseMiddleware):
+    """
+    WhiteNoise that also runs in an async middleware stack. The stock class
+    is sync-only, which under ASGI puts every request, async views included,
+    through a thread. Looking up a static file is a dict lookup either way.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response=None, *args, **kwargs):
+        super().__init__(get_response, *args, **kwargs)
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        return super().__call__(request)
+
+    async def __acall__(self, request):
+        if self.autorefresh:
+            static_file = self.find_file(request.path_info)
+        else:
+            static_file = self.files.get(request.path_info)
+        if static_file is not None:
+            return self.serve(static_file, request)
+        return await self.get_response(request)
+
+
+def _brotli(data):
+    return brotli.compress(data, quality=BROTLI_QUALITY)
+
+
+def _gzip(data):
+    return gzip.compress(data, compresslevel=GZIP_LEVEL, mtime=0)
+
+
+# In order of preference when the client accepts several equally
+ENCODERS = {'br': _brotli, 'gzip': _gzip} if brotli else {'gzip': _gzip}
+
+
+def accepted_encodings(header):
+    """Accept-Encoding as {coding: q}"""
+    accepted = {}
+    for part in header.split(','):
+        coding, _, params = part.partition(';')
+        coding = coding.strip().lower()
+        if not coding:
+            continue
+        q = 1.0
+        for param in params.split(';'):
+            name, _, value = param.partition('=')
+            if name.strip().lower() == 'q':
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        accepted[coding] = q
+    return accepted
+
+
+def choose_encoding(header):
+    """The encoder the client ranks highest (ties go to ENCODERS order), or None"""
+    accepted = accepted_encodings(header)
+    best, best_q = None, 0.0
+    for coding in ENCODERS:
+        q = accepted.get(coding, accepted.get('*', 0.0))
+        if q > best_q:
+            best, best_q = coding, q
+    return best
+
+
+class CompressionMiddleware:
+    """
+    Brotli or gzip for API responses of COMPRESSION_MIN_SIZE bytes and up,
+    negotiated on Accept-Encoding. At the default levels a 10 MB timeline
+    document goes out as about 2 MB.
+
+    Streaming responses (exports, which gzip themselves on request) and
+    small ones are left alone, the latter also so login responses, which
+    carry the token, never get compressed (BREACH). Like Django's
+    GZipMiddleware it makes the ETag weak, as the bytes now depend on the
+    encoding, which keeps If-None-Match working.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        return self.compress(request, self.get_response(request))
+
+    async def __acall__(self, request):
+        return self.compress(request, await self.get_response(request))
+
+    def compress(self, request, response):
+        if response.streaming or response.has_header('Content-Encoding'):
+            return response
+        if not response.get('Content-Type', '').startswith(COMPRESSIBLE_TYPES):
+            return response
+        # Representations differ by encoding from here on, whatever this one gets
+        patch_vary_headers(response, ('Accept-Encoding',))
+        if len(response.content) < COMPRESSION_MIN_SIZE:
+            return response
+
+        coding = choose_encoding(request.META.get('HTTP_ACCEPT_ENCODING', ''))
+        if coding is None:
+            return response
+        compressed = ENCODERS[coding](response.content)
+        if len(compressed) >= len(response.content):
+            return response
+
+        response.content = compressed
+        response['Content-Length'] = str(len(compressed))
+        response['Content-Encoding'] = coding
+        etag = response.get('ETag')
+        if etag and etag.startswith('"'):
+            response['ETag'] = 'W/' + etag
+        return response
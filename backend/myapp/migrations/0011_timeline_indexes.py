@@ -0,0 +1,23 @@
+# Generated by Django 5.2.9 on 2026-10-18 06:10
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('myapp', '0010_alter_chapter_source_chapter'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='chapter',
+            index=models.Index(fields=['user', 'type', 'parent_branch', 'order', 'start_date'], name='chapter_user_tree_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='event',
+            index=models.Index(fields=['user', 'date', 'order'], name='event_user_date_idx'),
+        ),
+    ]
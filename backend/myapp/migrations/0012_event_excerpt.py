@@ -0,0 +1,42 @@
+# Generated by Django 5.2.9 on 2026-10-18 06:11
+
+from django.db import migrations, models
+
+EXCERPT_LENGTH = 160
+
+
+def make_excerpt(content):
+    """Frozen copy of myapp.models.make_excerpt, so backfilled and saved excerpts match"""
+    text = ' '.join(content[:EXCERPT_LENGTH * 4].split())
+    if len(text) <= EXCERPT_LENGTH and len(content) <= EXCERPT_LENGTH * 4:
+        return text
+    return text[:EXCERPT_LENGTH - 1].rstrip() + '…'
+
+
+def fill_excerpts(apps, schema_editor):
+    Event = apps.get_model('myapp', 'Event')
+    batch = []
+    for event in Event.objects.only('id', 'content').iterator(chunk_size=2000):
+        event.excerpt = make_excerpt(event.content)
+        batch.append(event)
+        if len(batch) >= 2000:
+            Event.objects.bulk_update(batch, ['excerpt'])
+            batch = []
+    if batch:
+        Event.objects.bulk_update(batch, ['excerpt'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('myapp', '0011_timeline_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='event',
+            name='excerpt',
+            field=models.CharField(blank=True, editable=False, max_length=160),
+        ),
+        migrations.RunPython(fill_excerpts, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 5.2.9 on 2026-10-18 06:14
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('myapp', '0012_event_excerpt'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='event',
+            name='event_user_date_idx',
+        ),
+        migrations.AddIndex(
+            model_name='chapter',
+            index=models.Index(fields=['user', 'order', 'start_date', 'id'], name='chapter_user_keyset_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='event',
+            index=models.Index(fields=['user', 'date', 'order', 'id'], name='event_user_keyset_idx'),
+        ),
+    ]
@@ -0,0 +1,45 @@
+from django.db import migrations
+
+from . import _fts
+
+# PostgreSQL: a generated tsvector column (kept current by the database) with
+# a GIN index. The column is not on the model; myapp.search queries it.
+POSTGRES_FORWARD = [
+    """
+    ALTER TABLE myapp_event ADD COLUMN search_vector tsvector
+    GENERATED ALWAYS AS (
+        setweight(to_tsvector('english', coalesce(title, '')), 'A') ||
+        setweight(to_tsvector('english', coalesce(content, '')), 'B')
+    ) STORED
+    """,
+    "CREATE INDEX myapp_event_search_idx ON myapp_event USING GIN (search_vector)",
+]
+POSTGRES_BACKWARD = [
+    "DROP INDEX IF EXISTS myapp_event_search_idx",
+    "ALTER TABLE myapp_event DROP COLUMN IF EXISTS search_vector",
+]
+
+# SQLite: an external-content FTS5 table kept in sync by triggers.
+SQLITE_FORWARD = [_fts.TABLE, *_fts.TRIGGERS, _fts.REBUILD]
+SQLITE_BACKWARD = [*_fts.DROP_TRIGGERS, "DROP TABLE IF EXISTS myapp_event_fts"]
+
+
+def _run(statements_by_vendor):
+    def run(apps, schema_editor):
+        for sql in statements_by_vendor.get(schema_editor.connection.vendor, []):
+            schema_editor.execute(sql)
+    return run
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('myapp', '0014_external_ids'),
+    ]
+
+    operations = [
+        migrations.RunPython(
+            _run({'postgresql': POSTGRES_FORWARD, 'sqlite': SQLITE_FORWARD}),
+            _run({'postgresql': POSTGRES_BACKWARD, 'sqlite': SQLITE_BACKWARD}),
+        ),
+    ]
@@ -0,0 +1,88 @@
+# Generated by Django 5.2.9 on 2026-10-18 06:26
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+from . import _fts
+
+
+def number_existing_rows(apps, schema_editor):
+    # Existing rows get sequence numbers in updated_at order, per user
+    ChangeSequence = apps.get_model('myapp', 'ChangeSequence')
+    counters = {}
+    for model_name in ('Chapter', 'Event'):
+        model = apps.get_model('myapp', model_name)
+        batch = []
+        rows = model.objects.only('id', 'user_id').order_by('updated_at', 'id')
+        for obj in rows.iterator(chunk_size=2000):
+            counters[obj.user_id] = obj.change_seq = counters.get(obj.user_id, 0) + 1
+            batch.append(obj)
+            if len(batch) >= 2000:
+                model.objects.bulk_update(batch, ['change_seq'])
+                batch = []
+        if batch:
+            model.objects.bulk_update(batch, ['change_seq'])
+    ChangeSequence.objects.bulk_create(
+        [ChangeSequence(user_id=user_id, value=value) for user_id, value in counters.items()]
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('myapp', '0015_event_search'),
+        ('users', '0001_initial'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        # Reversing the AddField below rebuilds myapp_event again
+        migrations.RunPython(migrations.RunPython.noop, _fts.restore_triggers),
+        migrations.CreateModel(
+            name='ChangeSequence',
+            fields=[
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='change_sequence', serialize=False, to=settings.AUTH_USER_MODEL)),
+                ('value', models.BigIntegerField(default=0)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='Tombstone',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('chapter', 'Chapter'), ('event', 'Event')], max_length=10)),
+                ('object_id', models.BigIntegerField()),
+                ('change_seq', models.BigIntegerField()),
+                ('deleted_at', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='chapter',
+            name='change_seq',
+            field=models.BigIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='event',
+            name='change_seq',
+            field=models.BigIntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(_fts.restore_triggers, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='chapter',
+            index=models.Index(fields=['user', 'change_seq'], name='chapter_user_change_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='event',
+            index=models.Index(fields=['user', 'change_seq'], name='event_user_change_idx'),
+        ),
+        migrations.AddField(
+            model_name='tombstone',
+            name='user',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='tombstones', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddIndex(
+            model_name='tombstone',
+            index=models.Index(fields=['user', 'change_seq'], name='tombstone_user_change_idx'),
+        ),
+        migrations.RunPython(number_existing_rows, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,82 @@
+# Generated by Django 5.2.9 on 2026-10-18 07:47
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def build_lineage(apps, schema_editor):
+    # Same parent rule as myapp.lineage. Cycles, which nothing used to
+    # prevent, are broken by clearing the branch source of one chapter in
+    # them (a period keeps its branch where possible): it becomes a root.
+    Chapter = apps.get_model('myapp', 'Chapter')
+    ChapterLineage = apps.get_model('myapp', 'ChapterLineage')
+    parents = {}
+    periods = set()
+    rows = Chapter.objects.values_list(
+        'id', 'parent_branch_id', 'source_entry__chapter_id', 'source_entry__branch_id', 'source_chapter_id'
+    )
+    for pk, *candidates in rows.iterator(chunk_size=2000):
+        parents[pk] = next((parent for parent in candidates if parent is not None), None)
+        if candidates[0] is not None:
+            periods.add(pk)
+
+    chains = {}
+    broken = []
+    batch = []
+    for pk in parents:
+        path = []
+        node = pk
+        while node is not None and node not in chains:
+            if node in path:
+                cycle = path[path.index(node):]
+                root = next((member for member in cycle if member not in periods), cycle[-1])
+                broken.append(root)
+                parents[root] = None
+                # Walk again from the top: everything past the cut is above it now
+                path = path[:path.index(root) + 1]
+                break
+            path.append(node)
+            node = parents.get(node)
+        # Resolve from the top of the walk down
+        for node in reversed(path):
+            parent = parents[node]
+            chain = [(node, 0)]
+            if parent is not None:
+                chain += [(ancestor, depth + 1) for ancestor, depth in chains[parent]]
+            chains[node] = chain
+            batch += [ChapterLineage(ancestor_id=ancestor, descendant_id=node, depth=depth) for ancestor, depth in chain]
+        if len(batch) >= 2000:
+            ChapterLineage.objects.bulk_create(batch)
+            batch = []
+    ChapterLineage.objects.bulk_create(batch)
+    if broken:
+        Chapter.objects.filter(pk__in=[pk for pk in broken if pk not in periods]).update(
+            source_entry=None, source_chapter=None
+        )
+        Chapter.objects.filter(pk__in=[pk for pk in broken if pk in periods]).update(
+            parent_branch=None, source_entry=None, source_chapter=None
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('myapp', '0017_soft_delete'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ChapterLineage',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('depth', models.PositiveIntegerField()),
+                ('ancestor', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='descendant_links', to='myapp.chapter')),
+                ('descendant', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='ancestor_links', to='myapp.chapter')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['descendant', 'depth'], name='lineage_descendant_idx')],
+                'constraints': [models.UniqueConstraint(fields=('ancestor', 'descendant'), name='lineage_ancestor_descendant_uniq')],
+            },
+        ),
+        migrations.RunPython(build_lineage, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,72 @@
+# Generated by Django 5.2.9 on 2026-10-18 07:57
+
+from django.db import migrations, models
+
+from . import _fts
+
+
+def fill_aggregates(apps, schema_editor):
+    # One pass over the events: count their words, and sum them up per chapter
+    Chapter = apps.get_model('myapp', 'Chapter')
+    Event = apps.get_model('myapp', 'Event')
+    totals = {}
+    batch = []
+    rows = Event.objects.filter(deleted_at__isnull=True).only('id', 'content', 'chapter_id', 'branch_id', 'date')
+    for event in rows.iterator(chunk_size=2000):
+        event.word_count = len(event.content.split())
+        batch.append(event)
+        if len(batch) >= 2000:
+            Event.objects.bulk_update(batch, ['word_count'])
+            batch = []
+        for chapter_id in {event.chapter_id, event.branch_id} - {None}:
+            count, words, first, last = totals.get(chapter_id, (0, 0, event.date, event.date))
+            totals[chapter_id] = (count + 1, words + event.word_count, min(first, event.date), max(last, event.date))
+    if batch:
+        Event.objects.bulk_update(batch, ['word_count'])
+
+    chapters = [
+        Chapter(pk=pk, entry_count=count, word_count=words, first_entry_date=first, last_entry_date=last)
+        for pk, (count, words, first, last) in totals.items()
+    ]
+    Chapter.objects.bulk_update(
+        chapters, ['entry_count', 'word_count', 'first_entry_date', 'last_entry_date'], batch_size=2000
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('myapp', '0018_chapter_lineage'),
+    ]
+
+    operations = [
+        # Reversing the AddField on event below rebuilds myapp_event again
+        migrations.RunPython(migrations.RunPython.noop, _fts.restore_triggers),
+        migrations.AddField(
+            model_name='chapter',
+            name='entry_count',
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='chapter',
+            name='first_entry_date',
+            field=models.DateField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='chapter',
+            name='last_entry_date',
+            field=models.DateField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='chapter',
+            name='word_count',
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='event',
+            name='word_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(_fts.restore_triggers, migrations.RunPython.noop),
+        migrations.RunPython(fill_aggregates, migrations.RunPython.noop),
+    ]
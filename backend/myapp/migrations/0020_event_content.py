@@ -0,0 +1,27 @@
+# Generated by Django 5.2.9 on 2026-10-18 08:09
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    # The bodies move in 0021, the old column and its search index go in 0022
+    # and the new search index comes in 0023. Each is a transaction of its own:
+    # PostgreSQL cannot ALTER a table with pending (deferred foreign key)
+    # trigger events from rows inserted in the same transaction.
+
+    dependencies = [
+        ('myapp', '0019_chapter_aggregates'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='EventContent',
+            fields=[
+                ('event', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='body', serialize=False, to='myapp.event')),
+                ('text', models.TextField(blank=True)),
+                ('data', models.BinaryField(null=True)),
+                ('encoding', models.CharField(blank=True, max_length=8)),
+            ],
+        ),
+    ]
@@ -0,0 +1,43 @@
+from django.db import migrations
+
+from myapp.content import pack, unpack
+
+BATCH_SIZE = 2000
+
+
+def move_bodies(apps, schema_editor):
+    Event = apps.get_model('myapp', 'Event')
+    EventContent = apps.get_model('myapp', 'EventContent')
+    vendor = schema_editor.connection.vendor
+    batch = []
+    for pk, content in Event.objects.values_list('id', 'content').iterator(chunk_size=BATCH_SIZE):
+        text, data, encoding = pack(content, vendor)
+        batch.append(EventContent(event_id=pk, text=text, data=data, encoding=encoding))
+        if len(batch) >= BATCH_SIZE:
+            EventContent.objects.bulk_create(batch)
+            batch = []
+    EventContent.objects.bulk_create(batch)
+
+
+def restore_bodies(apps, schema_editor):
+    Event = apps.get_model('myapp', 'Event')
+    EventContent = apps.get_model('myapp', 'EventContent')
+    rows = EventContent.objects.values_list('event_id', 'text', 'data', 'encoding')
+    batch = []
+    for pk, text, data, encoding in rows.iterator(chunk_size=BATCH_SIZE):
+        batch.append(Event(pk=pk, content=unpack(text, data, encoding)))
+        if len(batch) >= BATCH_SIZE:
+            Event.objects.bulk_update(batch, ['content'])
+            batch = []
+    Event.objects.bulk_update(batch, ['content'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('myapp', '0020_event_content'),
+    ]
+
+    operations = [
+        migrations.RunPython(move_bodies, restore_bodies),
+    ]
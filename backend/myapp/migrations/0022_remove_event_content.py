@@ -0,0 +1,47 @@
+from django.db import migrations
+
+from . import _fts
+
+# The old index, dropped before its column goes (see 0015_event_search)
+POSTGRES_FORWARD = [
+    "DROP INDEX IF EXISTS myapp_event_search_idx",
+    "ALTER TABLE myapp_event DROP COLUMN IF EXISTS search_vector",
+]
+POSTGRES_BACKWARD = [
+    """
+    ALTER TABLE myapp_event ADD COLUMN search_vector tsvector
+    GENERATED ALWAYS AS (
+        setweight(to_tsvector('english', coalesce(title, '')), 'A') ||
+        setweight(to_tsvector('english', coalesce(content, '')), 'B')
+    ) STORED
+    """,
+    "CREATE INDEX myapp_event_search_idx ON myapp_event USING GIN (search_vector)",
+]
+SQLITE_FORWARD = [*_fts.DROP_TRIGGERS, "DROP TABLE IF EXISTS myapp_event_fts"]
+# Empty bodies until 0021 moves them back, which the triggers pick up
+SQLITE_BACKWARD = [_fts.TABLE, *_fts.TRIGGERS, _fts.REBUILD]
+
+
+def _run(statements_by_vendor):
+    def run(apps, schema_editor):
+        for sql in statements_by_vendor.get(schema_editor.connection.vendor, []):
+            schema_editor.execute(sql)
+    return run
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('myapp', '0021_move_event_bodies'),
+    ]
+
+    operations = [
+        migrations.RunPython(
+            _run({'postgresql': POSTGRES_FORWARD, 'sqlite': SQLITE_FORWARD}),
+            _run({'postgresql': POSTGRES_BACKWARD, 'sqlite': SQLITE_BACKWARD}),
+        ),
+        migrations.RemoveField(
+            model_name='event',
+            name='content',
+        ),
+    ]
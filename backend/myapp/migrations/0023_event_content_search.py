@@ -0,0 +1,101 @@
+from django.db import migrations
+
+from myapp.content import unpack
+
+from . import _fts
+
+BATCH_SIZE = 2000
+
+# PostgreSQL: the tsvector moves to myapp_eventcontent. A generated column
+# cannot read the title from myapp_event, so triggers keep it current: on a
+# body write, and on a title change (by rewriting the body row).
+POSTGRES_FORWARD = [
+    "ALTER TABLE myapp_eventcontent ADD COLUMN search_vector tsvector",
+    """
+    CREATE FUNCTION myapp_eventcontent_search() RETURNS trigger AS $$
+    BEGIN
+        NEW.search_vector :=
+            setweight(to_tsvector('english', coalesce(
+                (SELECT title FROM myapp_event WHERE id = NEW.event_id), ''
+            )), 'A') ||
+            setweight(to_tsvector('english', coalesce(NEW.text, '')), 'B');
+        RETURN NEW;
+    END
+    $$ LANGUAGE plpgsql
+    """,
+    """
+    CREATE TRIGGER myapp_eventcontent_search BEFORE INSERT OR UPDATE ON myapp_eventcontent
+    FOR EACH ROW EXECUTE FUNCTION myapp_eventcontent_search()
+    """,
+    """
+    CREATE FUNCTION myapp_event_title_search() RETURNS trigger AS $$
+    BEGIN
+        UPDATE myapp_eventcontent SET text = text WHERE event_id = NEW.id;
+        RETURN NULL;
+    END
+    $$ LANGUAGE plpgsql
+    """,
+    """
+    CREATE TRIGGER myapp_event_title_search AFTER UPDATE OF title ON myapp_event
+    FOR EACH ROW EXECUTE FUNCTION myapp_event_title_search()
+    """,
+    "UPDATE myapp_eventcontent SET text = text",
+    "CREATE INDEX myapp_eventcontent_search_idx ON myapp_eventcontent USING GIN (search_vector)",
+]
+POSTGRES_BACKWARD = [
+    "DROP INDEX IF EXISTS myapp_eventcontent_search_idx",
+    "DROP TRIGGER IF EXISTS myapp_event_title_search ON myapp_event",
+    "DROP FUNCTION IF EXISTS myapp_event_title_search()",
+    "DROP TRIGGER IF EXISTS myapp_eventcontent_search ON myapp_eventcontent",
+    "DROP FUNCTION IF EXISTS myapp_eventcontent_search()",
+    "ALTER TABLE myapp_eventcontent DROP COLUMN IF EXISTS search_vector",
+]
+
+# SQLite: an FTS5 table with its own copy of the text (see _fts)
+SQLITE_FORWARD = [_fts.BODY_TABLE, *_fts.EVENT_TRIGGERS, *_fts.BODY_TRIGGERS]
+SQLITE_BACKWARD = [
+    *_fts.DROP_BODY_TRIGGERS, *_fts.DROP_TRIGGERS,
+    "DROP TABLE IF EXISTS myapp_event_fts",
+]
+
+
+def forward(apps, schema_editor):
+    connection = schema_editor.connection
+    if connection.vendor == 'postgresql':
+        for sql in POSTGRES_FORWARD:
+            schema_editor.execute(sql)
+    elif connection.vendor == 'sqlite':
+        for sql in SQLITE_FORWARD:
+            schema_editor.execute(sql)
+        _index_events(apps, connection)
+
+
+def _index_events(apps, connection):
+    # Compressed bodies are inflated here, so the index holds plain text
+    Event = apps.get_model('myapp', 'Event')
+    rows = Event.objects.values_list('id', 'title', 'body__text', 'body__data', 'body__encoding')
+    batch = []
+    with connection.cursor() as cursor:
+        for pk, title, text, data, encoding in rows.iterator(chunk_size=BATCH_SIZE):
+            batch.append((pk, title, unpack(text, data, encoding)))
+            if len(batch) >= BATCH_SIZE:
+                cursor.executemany("INSERT INTO myapp_event_fts(rowid, title, content) VALUES (%s, %s, %s)", batch)
+                batch = []
+        cursor.executemany("INSERT INTO myapp_event_fts(rowid, title, content) VALUES (%s, %s, %s)", batch)
+
+
+def backward(apps, schema_editor):
+    statements = {'postgresql': POSTGRES_BACKWARD, 'sqlite': SQLITE_BACKWARD}
+    for sql in statements.get(schema_editor.connection.vendor, []):
+        schema_editor.execute(sql)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('myapp', '0022_remove_event_content'),
+    ]
+
+    operations = [
+        migrations.RunPython(forward, backward),
+    ]
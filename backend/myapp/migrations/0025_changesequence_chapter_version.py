@@ -0,0 +1,18 @@
+# Generated by Django 5.2.9 on 2026-10-18 09:30
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('myapp', '0024_tombstone_retention'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='changesequence',
+            name='chapter_version',
+            field=models.BigIntegerField(default=0),
+        ),
+    ]
@@ -0,0 +1,113 @@
+# SQLite FTS5 search index over myapp_event (see 0015_event_search).
+#
+# SQLite rebuilds a table for most ALTERs, which drops its triggers; later
+# migrations that touch myapp_event call restore_triggers afterwards.
+
+TABLE = """
+    CREATE VIRTUAL TABLE myapp_event_fts USING fts5(
+        title, content, content='myapp_event', content_rowid='id',
+        tokenize='porter unicode61'
+    )
+"""
+
+TRIGGERS = [
+    """
+    CREATE TRIGGER myapp_event_fts_ai AFTER INSERT ON myapp_event BEGIN
+        INSERT INTO myapp_event_fts(rowid, title, content)
+        VALUES (new.id, new.title, new.content);
+    END
+    """,
+    """
+    CREATE TRIGGER myapp_event_fts_ad AFTER DELETE ON myapp_event BEGIN
+        INSERT INTO myapp_event_fts(myapp_event_fts, rowid, title, content)
+        VALUES ('delete', old.id, old.title, old.content);
+    END
+    """,
+    """
+    CREATE TRIGGER myapp_event_fts_au AFTER UPDATE OF title, content ON myapp_event BEGIN
+        INSERT INTO myapp_event_fts(myapp_event_fts, rowid, title, content)
+        VALUES ('delete', old.id, old.title, old.content);
+        INSERT INTO myapp_event_fts(rowid, title, content)
+        VALUES (new.id, new.title, new.content);
+    END
+    """,
+]
+
+DROP_TRIGGERS = [
+    "DROP TRIGGER IF EXISTS myapp_event_fts_ai",
+    "DROP TRIGGER IF EXISTS myapp_event_fts_ad",
+    "DROP TRIGGER IF EXISTS myapp_event_fts_au",
+]
+
+REBUILD = "INSERT INTO myapp_event_fts(myapp_event_fts) VALUES ('rebuild')"
+
+
+def restore_triggers(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    for sql in DROP_TRIGGERS + TRIGGERS:
+        schema_editor.execute(sql)
+
+
+# From 0023_event_content_search on, the body is in myapp_eventcontent,
+# possibly compressed. The index then keeps its own copy of each title and
+# plain-text body, so the triggers on both tables need nothing but SQL and
+# keep working in the sqlite3 shell, dbshell and restores. A compressed body
+# has an empty `text`, so its trigger indexes nothing; EventContent.write()
+# indexes it from Python. Later migrations that touch myapp_event call
+# restore_body_triggers instead of restore_triggers.
+
+BODY_TABLE = """
+    CREATE VIRTUAL TABLE myapp_event_fts USING fts5(
+        title, content, tokenize='porter unicode61'
+    )
+"""
+
+EVENT_TRIGGERS = [
+    """
+    CREATE TRIGGER myapp_event_fts_ai AFTER INSERT ON myapp_event BEGIN
+        INSERT INTO myapp_event_fts(rowid, title, content)
+        VALUES (new.id, new.title, (SELECT text FROM myapp_eventcontent WHERE event_id = new.id));
+    END
+    """,
+    """
+    CREATE TRIGGER myapp_event_fts_ad AFTER DELETE ON myapp_event BEGIN
+        DELETE FROM myapp_event_fts WHERE rowid = old.id;
+    END
+    """,
+    """
+    CREATE TRIGGER myapp_event_fts_au AFTER UPDATE OF title ON myapp_event BEGIN
+        UPDATE myapp_event_fts SET title = new.title WHERE rowid = new.id;
+    END
+    """,
+]
+
+BODY_TRIGGERS = [
+    """
+    CREATE TRIGGER myapp_eventcontent_fts_ai AFTER INSERT ON myapp_eventcontent BEGIN
+        UPDATE myapp_event_fts SET content = new.text WHERE rowid = new.event_id;
+    END
+    """,
+    """
+    CREATE TRIGGER myapp_eventcontent_fts_ad AFTER DELETE ON myapp_eventcontent BEGIN
+        UPDATE myapp_event_fts SET content = NULL WHERE rowid = old.event_id;
+    END
+    """,
+    """
+    CREATE TRIGGER myapp_eventcontent_fts_au AFTER UPDATE ON myapp_eventcontent BEGIN
+        UPDATE myapp_event_fts SET content = new.text WHERE rowid = new.event_id;
+    END
+    """,
+]
+
+DROP_BODY_TRIGGERS = [
+    "DROP TRIGGER IF EXISTS myapp_eventcontent_fts_ai",
+    "DROP TRIGGER IF EXISTS myapp_eventcontent_fts_ad",
+    "DROP TRIGGER IF EXISTS myapp_eventcontent_fts_au",
+]
+
+def restore_body_triggers(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    for sql in DROP_TRIGGERS + EVENT_TRIGGERS:
+        schema_editor.execute(sql)
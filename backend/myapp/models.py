@@ -1,5 +1,8 @@
 # models.py
-from django.db import models
+from functools import partial
+
+from django.db import connections, models, router, transaction
+from django.db.models import F, Q
 from django.conf import settings
 
 try:
@@ -7,7 +10,137 @@ try:
 except ImportError:
     from django.contrib.auth.models import User
 
-class Chapter(models.Model):
+from .content import pack, unpack
+from .routers import pin_to_primary
+
+
+class ChangeSequence(models.Model):
+    """
+    Per-user counter behind change_seq and tombstones (see myapp.sync).
+
+    Every write to a user's timeline takes the next number(s) in the same
+    transaction. The counter row stays locked until that transaction ends, so
+    numbers become visible in the order they were handed out and a client that
+    has seen N has seen everything up to N.
+    """
+    user = models.OneToOneField(User, on_delete=models.CASCADE, primary_key=True, related_name='change_sequence')
+    value = models.BigIntegerField(default=0)
+    # Tombstones up to this number have been pruned (see myapp.sync)
+    pruned = models.BigIntegerField(default=0)
+    # Bumped by every change to the user's chapters; keys their cached
+    # PeriodIndex (see myapp.periods)
+    chapter_version = models.BigIntegerField(default=0)
+
+    @classmethod
+    def reserve(cls, user_id, count=1, using=None):
+        """Take the next `count` numbers; returns the last one"""
+        using = using or router.db_for_write(cls)
+        connection = connections[using]
+        # Read-your-writes: keep the user off the replica until it caught up
+        transaction.on_commit(partial(pin_to_primary, user_id), using=using)
+        for _ in range(2):
+            if connection.vendor in ('postgresql', 'sqlite'):
+                with connection.cursor() as cursor:
+                    cursor.execute(
+                        f'UPDATE {cls._meta.db_table} SET value = value + %s WHERE user_id = %s RETURNING value',
+                        [count, user_id],
+                    )
+                    row = cursor.fetchone()
+                if row is not None:
+                    return row[0]
+            else:
+                rows = cls.objects.using(using).filter(user_id=user_id)
+                if rows.update(value=F('value') + count):
+                    return rows.values_list('value', flat=True).get()
+            # First write for this user
+            cls.objects.using(using).bulk_create([cls(user_id=user_id)], ignore_conflicts=True)
+        raise RuntimeError(f'Could not reserve a change sequence for user {user_id}')
+
+    @classmethod
+    def stamp(cls, objs):
+        """
+        Give rows about to be bulk created/updated fresh change_seq values,
+        one reservation per user. Call inside the transaction that writes them.
+        """
+        by_user = {}
+        for obj in objs:
+            by_user.setdefault(obj.user_id, []).append(obj)
+        for user_id, rows in by_user.items():
+            last = cls.reserve(user_id, count=len(rows))
+            for seq, obj in enumerate(rows, start=last - len(rows) + 1):
+                obj.change_seq = seq
+
+    @classmethod
+    def current(cls, user_id):
+        return cls.objects.filter(user_id=user_id).values_list('value', flat=True).first() or 0
+
+    @classmethod
+    async def acurrent(cls, user_id):
+        return await cls.objects.filter(user_id=user_id).values_list('value', flat=True).afirst() or 0
+
+
+class SequencedModel(models.Model):
+    """Rows that carry their position in the owner's change sequence"""
+    change_seq = models.BigIntegerField(default=0, editable=False)
+
+    class Meta:
+        abstract = True
+
+    def save(self, *args, **kwargs):
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None:
+            kwargs['update_fields'] = {*update_fields, 'change_seq'}
+        using = kwargs.get('using') or router.db_for_write(type(self), instance=self)
+        with transaction.atomic(using=using):
+            self.change_seq = ChangeSequence.reserve(self.user_id, using=using)
+            super().save(*args, **kwargs)
+
+
+class LiveManager(models.Manager):
+    """Rows that are not soft-deleted"""
+
+    def get_queryset(self):
+        return super().get_queryset().filter(deleted_at__isnull=True)
+
+
+class SoftDeleteModel(models.Model):
+    """
+    Rows that are hidden first and removed later (see myapp.deletion).
+
+    `objects` (the default manager, so also reverse relations, prefetches and
+    serializer lookups) skips soft-deleted rows; `all_objects` sees them all.
+    """
+    deleted_at = models.DateTimeField(null=True, blank=True, editable=False)
+
+    objects = LiveManager()
+    all_objects = models.Manager()
+
+    class Meta:
+        abstract = True
+
+
+class Tombstone(models.Model):
+    """A deleted Chapter or Event, kept so delta sync can report it"""
+    KIND_CHOICES = [
+        ('chapter', 'Chapter'),
+        ('event', 'Event'),
+    ]
+
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='tombstones')
+    kind = models.CharField(max_length=10, choices=KIND_CHOICES)
+    object_id = models.BigIntegerField()
+    change_seq = models.BigIntegerField()
+    deleted_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', 'change_seq'], name='tombstone_user_change_idx'),
+            # For pruning (see myapp.sync.prune_tombstones)
+            models.Index(fields=['deleted_at'], name='tombstone_deleted_at_idx'),
+        ]
+
+
+class Chapter(SequencedModel, SoftDeleteModel):
     TYPE_CHOICES = [
         ('main_period', 'Main Period'),
         ('branch', 'Branch'),
@@ -50,18 +183,84 @@ class Chapter(models.Model):
     
     collapsed = models.BooleanField(default=False)
     order = models.IntegerField(default=0)
+
+    # Over the live entries and branch entries, kept current as they change
+    # (see myapp.aggregates), so headers need no event rows
+    entry_count = models.IntegerField(default=0, editable=False)
+    word_count = models.IntegerField(default=0, editable=False)
+    first_entry_date = models.DateField(null=True, blank=True, editable=False)
+    last_entry_date = models.DateField(null=True, blank=True, editable=False)
+
+    # Client-supplied id from an import, makes re-imports idempotent
+    external_id = models.CharField(max_length=64, null=True, blank=True, editable=False)
     
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
     class Meta:
         ordering = ['order', 'start_date']
+        indexes = [
+            models.Index(
+                fields=['user', 'type', 'parent_branch', 'order', 'start_date'],
+                name='chapter_user_tree_idx',
+            ),
+            # Keyset pagination order, see ChapterPagination
+            models.Index(
+                fields=['user', 'order', 'start_date', 'id'],
+                name='chapter_user_keyset_idx',
+            ),
+            # Delta sync, see myapp.sync
+            models.Index(fields=['user', 'change_seq'], name='chapter_user_change_idx'),
+            # Rows waiting to be purged, see myapp.deletion
+            models.Index(fields=['id'], condition=Q(deleted_at__isnull=False), name='chapter_deleted_idx'),
+        ]
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'external_id'], name='chapter_user_external_id_uniq'),
+        ]
         
     def __str__(self):
         return self.title
 
 
-class Event(models.Model):
+class ChapterLineage(models.Model):
+    """
+    Closure table of the chapter tree (see myapp.lineage): one row per
+    chapter and each of its ancestors, the chapter itself at depth 0. A
+    chapter's parent is its parent_branch, else the chapter holding its
+    source_entry, else its source_chapter.
+    """
+    ancestor = models.ForeignKey(Chapter, on_delete=models.CASCADE, related_name='descendant_links')
+    descendant = models.ForeignKey(Chapter, on_delete=models.CASCADE, related_name='ancestor_links')
+    depth = models.PositiveIntegerField()
+
+    class Meta:
+        constraints = [
+            # Also the index for subtree reads
+            models.UniqueConstraint(fields=['ancestor', 'descendant'], name='lineage_ancestor_descendant_uniq'),
+        ]
+        indexes = [
+            # Ancestry (breadcrumbs) and parent lookups
+            models.Index(fields=['descendant', 'depth'], name='lineage_descendant_idx'),
+        ]
+
+
+EXCERPT_LENGTH = 160
+
+
+def make_excerpt(content):
+    """Short single-line preview of an entry body"""
+    # Only the head of the body can end up in the excerpt
+    text = ' '.join(content[:EXCERPT_LENGTH * 4].split())
+    if len(text) <= EXCERPT_LENGTH and len(content) <= EXCERPT_LENGTH * 4:
+        return text
+    return text[:EXCERPT_LENGTH - 1].rstrip() + '…'
+
+
+def count_words(content):
+    return len(content.split())
+
+
+class Event(SequencedModel, SoftDeleteModel):
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name="events")
     
     # Chapter is optional - entries can exist in branches without chapters
@@ -85,14 +284,133 @@ class Event(models.Model):
     
     title = models.CharField(max_length=255)
     date = models.DateField()
-    content = models.TextField(blank=True)
+    # The body is in EventContent (see the content property); these are kept
+    # in sync with it on save, so list views can skip it
+    excerpt = models.CharField(max_length=EXCERPT_LENGTH, blank=True, editable=False)
+    word_count = models.PositiveIntegerField(default=0, editable=False)
     order = models.IntegerField(default=0)
 
+    # Client-supplied id from an import, makes re-imports idempotent
+    external_id = models.CharField(max_length=64, null=True, blank=True, editable=False)
+
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
     class Meta:
         ordering = ['date', 'order']
+        indexes = [
+            # Date range scans and keyset pagination order, see EventPagination
+            models.Index(fields=['user', 'date', 'order', 'id'], name='event_user_keyset_idx'),
+            models.Index(fields=['user', 'change_seq'], name='event_user_change_idx'),
+            models.Index(fields=['id'], condition=Q(deleted_at__isnull=False), name='event_deleted_idx'),
+        ]
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'external_id'], name='event_user_external_id_uniq'),
+        ]
 
     def __str__(self):
-        return self.title
\ No newline at end of file
+        return self.title
+
+    # Set when content is assigned, until save() writes it
+    _content_changed = False
+
+    @property
+    def content(self):
+        """The body, read from EventContent on first use"""
+        if '_content' not in self.__dict__:
+            try:
+                self._content = self.body.value if self.pk is not None else ''
+            except EventContent.DoesNotExist:
+                self._content = ''
+        return self._content
+
+    @content.setter
+    def content(self, value):
+        self._content = value
+        self._content_changed = True
+
+    def refresh_from_db(self, using=None, fields=None, from_queryset=None):
+        if fields is None or 'content' in fields:
+            self.__dict__.pop('_content', None)
+            self._content_changed = False
+            self._state.fields_cache.pop('body', None)
+            if fields is not None:
+                fields = [name for name in fields if name != 'content']
+                if not fields:
+                    return
+        super().refresh_from_db(using=using, fields=fields, from_queryset=from_queryset)
+
+    def save(self, *args, **kwargs):
+        # 'content' in update_fields writes the body, which is not a column
+        update_fields = kwargs.get('update_fields')
+        if update_fields is None:
+            rewrite = self._content_changed or self._state.adding
+        else:
+            rewrite = 'content' in update_fields
+            update_fields = set(update_fields) - {'content'}
+        if rewrite:
+            self.excerpt = make_excerpt(self.content)
+            self.word_count = count_words(self.content)
+            if update_fields is not None:
+                update_fields |= {'excerpt', 'word_count'}
+        if update_fields is not None:
+            kwargs['update_fields'] = update_fields
+        using = kwargs.get('using') or router.db_for_write(type(self), instance=self)
+        with transaction.atomic(using=using):
+            super().save(*args, **kwargs)
+            if rewrite:
+                EventContent.write({self.pk: self.content}, using=using)
+                self._content_changed = False
+
+
+# Sets the body the SQLite search index has for an event
+INDEX_BODY_SQL = "UPDATE myapp_event_fts SET content = %s WHERE rowid = %s"
+
+
+class EventContent(models.Model):
+    """
+    An event's body (see myapp.content). Kept out of the event row so that
+    reading events does not read their bodies. Every event gets one, empty or
+    not; compressed bodies are in `data`, the others in `text`.
+    """
+    event = models.OneToOneField(Event, on_delete=models.CASCADE, primary_key=True, related_name='body')
+    text = models.TextField(blank=True)
+    data = models.BinaryField(null=True)
+    # '' for text, else the codec `data` is compressed with
+    encoding = models.CharField(max_length=8, blank=True)
+
+    @property
+    def value(self):
+        return unpack(self.text, self.data, self.encoding)
+
+    @classmethod
+    def write(cls, bodies, using=None):
+        """Store {event id: body} in one statement per batch, replacing what was there"""
+        using = using or router.db_for_write(cls)
+        vendor = connections[using].vendor
+        rows = [
+            cls(event_id=pk, **dict(zip(('text', 'data', 'encoding'), pack(text, vendor))))
+            for pk, text in bodies.items()
+        ]
+        cls.objects.using(using).bulk_create(
+            rows, batch_size=500, update_conflicts=True,
+            unique_fields=['event'], update_fields=['text', 'data', 'encoding'],
+        )
+        compressed = [(bodies[row.event_id], row.event_id) for row in rows if row.encoding]
+        if compressed:
+            # The FTS5 triggers index `text`, which is empty for these (see
+            # migrations/_fts.py)
+            with connections[using].cursor() as cursor:
+                cursor.executemany(INDEX_BODY_SQL, compressed)
+
+    @classmethod
+    def save_for(cls, events, created=False, using=None):
+        """
+        write() the bodies of just saved `events`: those assigned since they
+        were loaded or saved, or all of them when they were `created`.
+        """
+        changed = [event for event in events if created or event._content_changed]
+        if changed:
+            cls.write({event.pk: event.content for event in changed}, using=using)
+            for event in changed:
+                event._content_changed = False
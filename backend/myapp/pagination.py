@@ -0,0 +1,151 @@
+# pagination.py
+import json
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+
+from django.core.exceptions import ValidationError as DjangoValidationError
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import replace_query_param
+
+
+class KeysetPagination(BasePagination):
+    """
+    Cursor pagination on a unique ordering tuple, e.g. (date, order, id).
+
+    The cursor holds the ordering values of the row at the page boundary, and
+    each page is a single range read (WHERE (date, order, id) > cursor ...
+    LIMIT n) instead of COUNT(*) plus OFFSET, so deep pages cost the same as
+    the first one. The ordering must end in a unique column, and values()
+    querysets must include the ordering columns.
+    """
+    ordering = ('id',)
+    cursor_query_param = 'cursor'
+    page_size = api_settings.PAGE_SIZE
+    page_size_query_param = 'page_size'
+    max_page_size = 1000
+    invalid_cursor_message = 'Invalid cursor'
+
+    def get_page_size(self, request):
+        try:
+            size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        return max(1, min(size, self.max_page_size))
+
+    def paginate_queryset(self, queryset, request, view=None):
+        return self.finish_page(list(self.page_queryset(queryset, request)))
+
+    async def apaginate_queryset(self, queryset, request, view=None):
+        """paginate_queryset() on the async ORM"""
+        queryset = self.page_queryset(queryset, request)
+        return self.finish_page([obj async for obj in queryset.aiterator()])
+
+    def page_queryset(self, queryset, request):
+        """The sliced queryset for the requested page, one row past its end"""
+        self.request = request
+        self.base_url = request.build_absolute_uri()
+        size = self.get_page_size(request)
+        cursor = self.decode_cursor(request, queryset.model)
+
+        if cursor is None:
+            position, reverse = None, False
+        else:
+            position, reverse = cursor
+
+        if reverse:
+            queryset = queryset.order_by(*[f'-{field}' for field in self.ordering])
+        else:
+            queryset = queryset.order_by(*self.ordering)
+        if position is not None:
+            queryset = queryset.filter(self._beyond(position, reverse))
+        self._page = (size, position, reverse)
+        return queryset[:size + 1]
+
+    def finish_page(self, rows):
+        size, position, reverse = self._page
+        has_more = len(rows) > size
+        rows = rows[:size]
+        if reverse:
+            rows.reverse()
+
+        self.next_position = self.previous_position = None
+        if rows:
+            if has_more or reverse:
+                self.next_position = self._position(rows[-1])
+            if (has_more and reverse) or (position is not None and not reverse):
+                self.previous_position = self._position(rows[0])
+        return rows
+
+    def _beyond(self, position, reverse):
+        # (a, b, c) > (x, y, z) spelled out so every backend can use the index
+        lookup = 'lt' if reverse else 'gt'
+        condition = Q()
+        for i, field in enumerate(self.ordering):
+            step = Q(**{f'{field}__{lookup}': position[i]})
+            for prior, value in zip(self.ordering[:i], position[:i]):
+                step &= Q(**{prior: value})
+            condition |= step
+        return condition
+
+    def _position(self, obj):
+        if isinstance(obj, dict):
+            # values() rows
+            return [obj[field] for field in self.ordering]
+        return [getattr(obj, field) for field in self.ordering]
+
+    def encode_cursor(self, position, reverse):
+        payload = {'p': position}
+        if reverse:
+            payload['r'] = 1
+        raw = json.dumps(payload, cls=DjangoJSONEncoder, separators=(',', ':'))
+        return urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+    def decode_cursor(self, request, model):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if encoded is None:
+            return None
+        try:
+            payload = json.loads(urlsafe_b64decode(encoded + '=' * (-len(encoded) % 4)))
+            values = payload['p']
+            if len(values) != len(self.ordering):
+                raise ValueError(values)
+            position = [
+                model._meta.get_field(field).to_python(value)
+                for field, value in zip(self.ordering, values)
+            ]
+            return position, bool(payload.get('r'))
+        except (TypeError, ValueError, KeyError, DjangoValidationError):
+            raise NotFound(self.invalid_cursor_message)
+
+    def get_next_link(self):
+        if self.next_position is None:
+            return None
+        return replace_query_param(
+            self.base_url, self.cursor_query_param, self.encode_cursor(self.next_position, False)
+        )
+
+    def get_previous_link(self):
+        if self.previous_position is None:
+            return None
+        return replace_query_param(
+            self.base_url, self.cursor_query_param, self.encode_cursor(self.previous_position, True)
+        )
+
+    def get_paginated_response(self, data):
+        return Response({
+            'next': self.get_next_link(),
+            'previous': self.get_previous_link(),
+            'results': data,
+        })
+
+
+class EventPagination(KeysetPagination):
+    ordering = ('date', 'order', 'id')
+
+
+class ChapterPagination(KeysetPagination):
+    ordering = ('order', 'start_date', 'id')
@@ -0,0 +1,141 @@
+# periods.py
+from bisect import bisect_right
+from collections import namedtuple
+from datetime import date
+from itertools import accumulate
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import F
+
+from .models import ChangeSequence, Chapter
+
+# Which main period or branch period covers a date is asked on every entry
+# created without a chapter. PeriodIndex answers it by bisection over the
+# user's periods sorted by start date. The index is cached per user under
+# their chapter version, so it is rebuilt after their chapters change, in
+# whichever process changed them; writing entries keeps it.
+
+# How long an unused index stays in the cache (seconds)
+INDEX_TIMEOUT = getattr(settings, 'PERIOD_INDEX_TIMEOUT', 60 * 60 * 24)
+
+PERIOD_TYPES = ('main_period', 'branch_period')
+
+Period = namedtuple('Period', 'id type parent_branch_id start_date end_date order')
+
+
+def _end(period):
+    # No end date: still going
+    return period.end_date or date.max
+
+
+def overlap(a, b):
+    """
+    The (first, last) days periods a and b share, last None when both are
+    still going; None when they share none. Consecutive periods, one ending
+    on the day the other starts, do not overlap.
+    """
+    first, last = max(a.start_date, b.start_date), min(_end(a), _end(b))
+    if first > last or (first == last and (a.end_date == b.start_date or b.end_date == a.start_date)):
+        return None
+    return first, None if last == date.max else last
+
+
+class PeriodIndex:
+    """
+    A user's live main and branch periods, sorted by start date. `reach[i]`
+    is the latest end among the first i + 1 periods, so a lookup bisects to
+    the last period starting by the date and walks back only while an
+    earlier one can still reach it.
+    """
+
+    def __init__(self, periods):
+        self.periods = sorted(periods, key=lambda period: (period.start_date, period.order, period.id))
+        self.starts = [period.start_date for period in self.periods]
+        self.reach = list(accumulate(map(_end, self.periods), max))
+
+    @classmethod
+    def build(cls, user_id):
+        rows = Chapter.objects.filter(user_id=user_id, type__in=PERIOD_TYPES).values_list(*Period._fields)
+        return cls(Period(*row) for row in rows)
+
+    def __len__(self):
+        return len(self.periods)
+
+    def active(self, day, branch=...):
+        """
+        Periods covering `day`, latest start first. `branch` limits them to
+        that branch's periods, None to main periods.
+        """
+        found = []
+        i = bisect_right(self.starts, day)
+        while i and self.reach[i - 1] >= day:
+            i -= 1
+            period = self.periods[i]
+            if _end(period) >= day and (branch is ... or period.parent_branch_id == branch):
+                found.append(period)
+        found.sort(key=lambda period: (-period.start_date.toordinal(), period.order, period.id))
+        return found
+
+    def chapter_for(self, day, branch=None):
+        """
+        Id of the period an entry on `day` belongs in: the main period (or,
+        for an entry in `branch`, the branch period) covering it that
+        started last. None when no period covers it.
+        """
+        found = self.active(day, branch)
+        return found[0].id if found else None
+
+    def overlaps(self):
+        """
+        (a, b, first, last) for each two periods of the same timeline (the
+        main one, or one branch) that share days, a starting first.
+        """
+        found = []
+        running = {}
+        for period in self.periods:
+            scope = running.setdefault(period.parent_branch_id, [])
+            # Periods over before this one starts are out of the sweep
+            scope[:] = [other for other in scope if _end(other) >= period.start_date]
+            for other in scope:
+                shared = overlap(other, period)
+                if shared is not None:
+                    found.append((other, period, *shared))
+            scope.append(period)
+        return found
+
+
+def _index_key(user_id, version):
+    return f'periods:index:{user_id}:{version}'
+
+
+def chapter_version(user_id):
+    return (
+        ChangeSequence.objects.filter(user_id=user_id).values_list('chapter_version', flat=True).first() or 0
+    )
+
+
+def period_index(user_id):
+    """
+    The user's PeriodIndex, built on a miss.
+
+    Keyed by the user's chapter version, read from the database, so an index
+    made stale by another worker or a management command (each with their
+    own cache) is never used. The version is read before the periods, so a
+    concurrent chapter write can leave an index newer than its key, never
+    older.
+    """
+    key = _index_key(user_id, chapter_version(user_id))
+    index = cache.get(key)
+    if index is None:
+        index = PeriodIndex.build(user_id)
+        cache.set(key, index, INDEX_TIMEOUT)
+    return index
+
+
+def invalidate_periods(user_id):
+    """
+    Retire the user's PeriodIndex, in every process, by bumping their chapter
+    version. Call in the transaction that changes their chapters.
+    """
+    ChangeSequence.objects.filter(user_id=user_id).update(chapter_version=F('chapter_version') + 1)
@@ -0,0 +1,87 @@
+# renderers.py
+import json
+
+from rest_framework.renderers import BaseRenderer, JSONRenderer
+from rest_framework.utils.encoders import JSONEncoder
+
+try:
+    import orjson
+except ImportError:  # optional, ORJSONRenderer falls back to the json module
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:  # optional, MessagePackRenderer is only listed when installed
+    msgpack = None
+
+# Turns what neither orjson nor msgpack format like JSONRenderer (dates,
+# Decimal, lazy strings, ...) into the values JSONRenderer would write
+json_default = JSONEncoder().default
+
+
+class NDJSONRenderer(BaseRenderer):
+    """
+    Newline-delimited JSON. Streaming views write their own body; this only
+    renders ordinary responses (e.g. errors) as a single line.
+    """
+    media_type = 'application/x-ndjson'
+    format = 'ndjson'
+    charset = 'utf-8'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        return (json.dumps(data, ensure_ascii=False) + '\n').encode()
+
+
+class ORJSONRenderer(JSONRenderer):
+    """
+    JSONRenderer through orjson when it is installed: same media type, same
+    bytes, several times faster on large documents.
+
+    It is listed ahead of JSONRenderer in DEFAULT_RENDERER_CLASSES, so content
+    negotiation picks it for application/json (and */*). Output matches
+    JSONRenderer's compact, unicode form; types orjson does not format the
+    same way (dates, Decimal, lazy strings) go through DRF's encoder, and
+    anything else orjson rejects, or an indented or ASCII-only rendering, is
+    handed to JSONRenderer. Floats are the exception: orjson writes 1e-6
+    where json writes 1e-06, so views returning floats should keep
+    JSONRenderer if the exact bytes matter.
+    """
+    options = orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_PASSTHROUGH_DATACLASS if orjson else 0
+    default = json_default
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        if (
+            orjson is None
+            or self.ensure_ascii
+            or not self.compact
+            or self.get_indent(accepted_media_type, renderer_context or {})
+        ):
+            return super().render(data, accepted_media_type, renderer_context)
+        try:
+            ret = orjson.dumps(data, default=self.default, option=self.options)
+        except TypeError:  # orjson.JSONEncodeError, e.g. int keys or huge ints
+            return super().render(data, accepted_media_type, renderer_context)
+        # Like JSONRenderer, escape the two characters that are valid JSON
+        # but not valid JavaScript
+        return ret.replace(b'\xe2\x80\xa8', b'\\u2028').replace(b'\xe2\x80\xa9', b'\\u2029')
+
+
+class MessagePackRenderer(BaseRenderer):
+    """
+    MessagePack (msgpack.org) for clients sending Accept: application/msgpack:
+    the same document as the JSON renderers, smaller and quicker to decode.
+    Dates and the like become the strings the JSON documents carry.
+    """
+    media_type = 'application/msgpack'
+    format = 'msgpack'
+    charset = None
+    render_style = 'binary'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        return msgpack.packb(data, default=json_default, use_bin_type=True)
@@ -0,0 +1,111 @@
+# routers.py
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS, connections
+
+# Alias of the read replica, used when DATABASES has it
+REPLICA = getattr(settings, 'REPLICA_DATABASE', 'replica')
+# Seconds a user's reads stay on the primary after they wrote
+PIN_SECONDS = getattr(settings, 'REPLICA_PIN_SECONDS', 10)
+
+# Where reads go in the current request; None for the default database. Set
+# only around reads that may be a little stale (see ReplicaReadsMixin), so
+# anything else, and everything in a transaction, reads from the primary.
+_read_alias = ContextVar('read_alias', default=None)
+
+
+def _pin_key(user_id):
+    return f'db:pinned:{user_id}'
+
+
+def has_replica():
+    return REPLICA in connections.settings
+
+
+def pin_to_primary(user_id):
+    """
+    Send the user's reads to the primary for PIN_SECONDS, so they see what
+    they just wrote however far the replica lags. ChangeSequence.reserve()
+    calls this as each write commits.
+    """
+    if has_replica():
+        cache.set(_pin_key(user_id), True, PIN_SECONDS)
+
+
+def replica_for(user):
+    """The alias to serve the user's safe reads from (None: the primary)"""
+    if not has_replica() or not user.is_authenticated or cache.get(_pin_key(user.pk)):
+        return None
+    return REPLICA
+
+
+async def areplica_for(user):
+    if not has_replica() or not user.is_authenticated or await cache.aget(_pin_key(user.pk)):
+        return None
+    return REPLICA
+
+
+def route_reads(alias):
+    """Send this context's reads to `alias`; returns the token for reset_reads()"""
+    return _read_alias.set(alias)
+
+
+def reset_reads(token):
+    _read_alias.reset(token)
+
+
+@contextmanager
+def reads_from(alias):
+    token = route_reads(alias)
+    try:
+        yield
+    finally:
+        reset_reads(token)
+
+
+def stream_reads_from(iterable, alias):
+    """
+    Iterate `iterable` reading from `alias`, for streaming response bodies,
+    which are produced after the view (and its reads_from()) has returned
+    """
+    iterator = iter(iterable)
+    while True:
+        with reads_from(alias):
+            try:
+                chunk = next(iterator)
+            except StopIteration:
+                return
+        yield chunk
+
+
+class ReplicaRouter:
+    """
+    Writes go to the primary; reads go wherever reads_from() says, else the
+    primary too. Reads inside a transaction, or of rows related to an
+    instance, stay on the database the transaction or instance is on.
+    """
+
+    def db_for_read(self, model, **hints):
+        alias = _read_alias.get()
+        if alias is None:
+            return None
+        instance = hints.get('instance')
+        if instance is not None and instance._state.db:
+            return instance._state.db
+        if connections[DEFAULT_DB_ALIAS].in_atomic_block:
+            return None
+        return alias
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Both aliases hold the same data
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # The replica gets its schema from the primary
+        return db != REPLICA
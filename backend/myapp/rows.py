@@ -0,0 +1,235 @@
+# rows.py
+import asyncio
+from collections import defaultdict
+
+from django.db.models import Q
+from rest_framework import serializers
+
+from .content import Inflate
+from .models import Chapter, Event
+
+# Format dates exactly the way the ModelSerializer fields do
+_date = serializers.DateField().to_representation
+_datetime = serializers.DateTimeField().to_representation
+
+
+class RowSerializer:
+    """
+    Read-only stand-in for a ModelSerializer that works on values() rows.
+
+    `columns` maps each output name, in the serializer's field order, to the
+    values() column it comes from and an optional formatter. The accessors
+    for the selected fields are worked out once per instance, so turning a row
+    into a dict is a single comprehension with no field lookups, to_attribute
+    walks or relation handling. The dicts match the serializer's output.
+
+    Columns in `computed` are not on the model's table; annotate() adds the
+    expressions for those the selected fields read.
+    """
+    columns = {}
+    computed = {}
+
+    def __init__(self, fields=None):
+        self.accessors = [
+            (name, column, formatter)
+            for name, (column, formatter) in self.columns.items()
+            if fields is None or name in fields
+        ]
+
+    def values(self):
+        """Columns to pass to values(), just those the selected fields read"""
+        return [column for _, column, _ in self.accessors if column is not None]
+
+    def annotate(self, queryset):
+        """`queryset` with the computed columns values() asks for"""
+        wanted = {column: self.computed[column] for column in self.values() if column in self.computed}
+        return queryset.annotate(**wanted) if wanted else queryset
+
+    def to_representation(self, row):
+        return {
+            name: formatter(row[column]) if formatter else row[column]
+            for name, column, formatter in self.accessors
+        }
+
+
+class EventRows(RowSerializer):
+    # In EventSerializer field order
+    columns = {
+        'id': ('id', None),
+        'title': ('title', None),
+        'content': ('content', None),
+        'excerpt': ('excerpt', None),
+        'date': ('date', _date),
+        'order': ('order', None),
+        'chapter': ('chapter_id', None),
+        'branch': ('branch_id', None),
+        'created_at': ('created_at', _datetime),
+        'updated_at': ('updated_at', _datetime),
+    }
+    # The body is joined in only when asked for
+    computed = {'content': Inflate()}
+
+
+class ChapterRows(RowSerializer):
+    """
+    ChapterSerializer for rows. The nested fields (column None) are not read
+    from the row but asked of `tree`, see ChapterTree.
+    """
+    # In ChapterSerializer field order
+    columns = {
+        'id': ('id', None),
+        'type': ('type', None),
+        'title': ('title', None),
+        'start_date': ('start_date', _date),
+        'end_date': ('end_date', _date),
+        'color': ('color', None),
+        'x_position': ('x_position', None),
+        'parent_branch': ('parent_branch_id', None),
+        'source_entry': ('source_entry_id', None),
+        'source_chapter': ('source_chapter_id', None),
+        'collapsed': ('collapsed', None),
+        'order': ('order', None),
+        'entry_count': ('entry_count', None),
+        'word_count': ('word_count', None),
+        'first_entry_date': ('first_entry_date', _date),
+        'last_entry_date': ('last_entry_date', _date),
+        'entries': (None, None),
+        'branch_entries': (None, None),
+        'periods': (None, None),
+        'created_at': ('created_at', _datetime),
+        'updated_at': ('updated_at', _datetime),
+    }
+    nested = ('entries', 'branch_entries', 'periods')
+
+    def values(self):
+        # id, type and parent_branch_id are always read, nesting needs them
+        return list(dict.fromkeys(['id', 'type', 'parent_branch_id', *super().values()]))
+
+    def to_representation(self, row, tree=None):
+        return {
+            name: (
+                getattr(tree, name)(row) if column is None
+                else formatter(row[column]) if formatter else row[column]
+            )
+            for name, column, formatter in self.accessors
+        }
+
+
+# All scalar chapter fields, e.g. for flat (non-nested) documents
+CHAPTER_SCALARS = [name for name, (column, _) in ChapterRows.columns.items() if column is not None]
+
+
+class ChapterTree:
+    """
+    Nests already fetched event and period rows under chapter rows, the way
+    ChapterSerializer does through its relations.
+
+    Event rows must come in (date, order, id) order and carry chapter_id and
+    branch_id; period rows in (order, start_date, id) order with
+    parent_branch_id. `fields` limits the chapters and their periods, as
+    ?fields= does (get_periods() serializes them as top-level chapters);
+    events are always complete but for `event_fields`.
+
+    With stubs=True, collapsed chapters (rows need `collapsed`) come out as
+    stubs: their fields and aggregates, but no entries or periods.
+    """
+
+    def __init__(self, event_rows=(), period_rows=(), fields=None, event_fields=None, stubs=False):
+        events = EventRows(event_fields)
+        self._entries = defaultdict(list)
+        self._branch_entries = defaultdict(list)
+        for row in event_rows:
+            event = events.to_representation(row)
+            if row['chapter_id'] is not None:
+                self._entries[row['chapter_id']].append(event)
+            if row['branch_id'] is not None:
+                self._branch_entries[row['branch_id']].append(event)
+
+        self._periods = defaultdict(list)
+        for row in period_rows:
+            self._periods[row['parent_branch_id']].append(row)
+
+        self.serializer = ChapterRows(fields)
+        self.stubs = stubs
+
+    def _stub(self, row):
+        return self.stubs and row['collapsed']
+
+    def entries(self, row):
+        if self._stub(row):
+            return []
+        return self._entries.get(row['id'], [])
+
+    def branch_entries(self, row):
+        if self._stub(row):
+            return []
+        return self._branch_entries.get(row['id'], [])
+
+    def periods(self, row):
+        if row['type'] != 'branch' or self._stub(row):
+            return []
+        return [self.chapter(child) for child in self._periods.get(row['id'], [])]
+
+    def chapter(self, row):
+        return self.serializer.to_representation(row, self)
+
+
+class ChapterPage:
+    """
+    The ChapterSerializer documents for a page of chapter rows (read with
+    ChapterRows(fields).values()), with two more queries whatever the page
+    holds: the periods of its branches, and every event of those chapters and
+    periods. Neither is run when ?fields= leaves out what needs it.
+    """
+
+    def __init__(self, rows, fields=None, event_fields=None):
+        self.rows = rows
+        self.fields = fields
+        self.event_fields = event_fields
+        wanted = set(ChapterRows.nested if fields is None else fields)
+        self.wants_periods = 'periods' in wanted
+        self.wants_events = bool(wanted & {'entries', 'branch_entries'})
+
+    def _branch_ids(self):
+        return [row['id'] for row in self.rows if row['type'] == 'branch']
+
+    def period_rows(self):
+        return (
+            Chapter.objects.filter(parent_branch_id__in=self._branch_ids())
+            .order_by('order', 'start_date', 'id')
+            .values(*ChapterRows(self.fields).values())
+        )
+
+    def event_rows(self):
+        ids = [row['id'] for row in self.rows]
+        events = EventRows(self.event_fields)
+        columns = {'chapter_id', 'branch_id', *events.values()}
+        chapters = Q(chapter_id__in=ids) | Q(branch_id__in=ids)
+        if self.wants_periods:
+            periods = Chapter.objects.filter(parent_branch_id__in=self._branch_ids()).values('id')
+            chapters |= Q(chapter_id__in=periods) | Q(branch_id__in=periods)
+        return (
+            events.annotate(Event.objects.filter(chapters))
+            .order_by('date', 'order', 'id')
+            .values(*columns)
+        )
+
+    def build(self):
+        periods = list(self.period_rows()) if self.wants_periods else []
+        events = list(self.event_rows()) if self.wants_events else []
+        return self.assemble(periods, events)
+
+    async def abuild(self):
+        """build() on the async ORM, reading periods and events concurrently"""
+        async def fetch(queryset, wanted):
+            return [row async for row in queryset.aiterator()] if wanted else []
+
+        periods, events = await asyncio.gather(
+            fetch(self.period_rows(), self.wants_periods),
+            fetch(self.event_rows(), self.wants_events),
+        )
+        return self.assemble(periods, events)
+
+    def assemble(self, period_rows, event_rows):
+        tree = ChapterTree(event_rows, period_rows, fields=self.fields, event_fields=self.event_fields)
+        return [tree.chapter(row) for row in self.rows]
@@ -0,0 +1,109 @@
+# search.py
+import re
+
+from django.db import connections, router
+from django.db.models import Q
+from django.utils.html import escape
+from rest_framework import serializers
+
+from .models import Event
+
+# Highlight markers that cannot appear in user text; swapped for <mark> after
+# the snippet has been HTML-escaped
+START, STOP = '\x02', '\x03'
+
+_date = serializers.DateField().to_representation
+
+POSTGRES_SQL = f"""
+    SELECT page.id, page.title, page.date, page.chapter_id, page.branch_id, page.excerpt,
+           page.rank, ts_headline(
+        'english', page.content, page.query,
+        'StartSel={START}, StopSel={STOP}, MaxFragments=2, MaxWords=20, MinWords=5'
+    ) AS snippet
+    FROM (
+        SELECT e.id, e.title, e.date, e.chapter_id, e.branch_id, e.excerpt, c.text AS content,
+               ts_rank(c.search_vector, q) AS rank, q AS query
+        FROM myapp_event e
+        JOIN myapp_eventcontent c ON c.event_id = e.id, websearch_to_tsquery('english', %s) q
+        WHERE e.user_id = %s AND e.deleted_at IS NULL AND c.search_vector @@ q
+        ORDER BY rank DESC, e.id
+        LIMIT %s OFFSET %s
+    ) page
+    ORDER BY page.rank DESC, page.id
+"""
+
+SQLITE_SQL = f"""
+    SELECT e.id, e.title, e.date, e.chapter_id, e.branch_id, e.excerpt,
+           -bm25(myapp_event_fts, 10.0, 1.0) AS rank,
+           snippet(myapp_event_fts, -1, '{START}', '{STOP}', '…', 16) AS snippet
+    FROM myapp_event_fts
+    JOIN myapp_event e ON e.id = myapp_event_fts.rowid
+    WHERE myapp_event_fts MATCH %s AND e.user_id = %s AND e.deleted_at IS NULL
+    ORDER BY rank DESC, e.id
+    LIMIT %s OFFSET %s
+"""
+
+
+def _fts5_query(text):
+    """Quote every word (so FTS5 syntax in user input is inert); prefix-match the last"""
+    words = re.findall(r'\w+', text)
+    if not words:
+        return None
+    terms = [f'"{word}"' for word in words]
+    terms[-1] += '*'
+    return ' '.join(terms)
+
+
+def _highlight(snippet):
+    return escape(snippet or '').replace(START, '<mark>').replace(STOP, '</mark>')
+
+
+def _result(row):
+    return {
+        'id': row[0],
+        'title': row[1],
+        'date': _date(row[2]),
+        'chapter': row[3],
+        'branch': row[4],
+        'excerpt': row[5],
+        'rank': round(float(row[6]), 6),
+        'snippet': _highlight(row[7]),
+    }
+
+
+def _fallback(user, text, limit, offset):
+    # Backends without a full-text index: unranked substring match
+    matches = (
+        Event.objects.filter(user=user)
+        .filter(Q(title__icontains=text) | Q(body__text__icontains=text))
+        .order_by('-date', 'id')
+        .values_list('id', 'title', 'date', 'chapter_id', 'branch_id', 'excerpt')
+    )[offset:offset + limit]
+    return [_result((*row, 0.0, row[5])) for row in matches]
+
+
+def search_events(user, text, limit=20, offset=0):
+    """
+    Ranked full-text search over the user's event titles and content.
+
+    Uses the tsvector column of the event bodies on PostgreSQL and the FTS5
+    table on SQLite (see migrations 0015 and 0020). Title matches weigh more
+    than content matches. Snippets are HTML-escaped with hits wrapped in <mark>.
+    """
+    text = text.strip()
+    if not text:
+        return []
+
+    connection = connections[router.db_for_read(Event)]
+    if connection.vendor == 'postgresql':
+        sql, query = POSTGRES_SQL, text
+    elif connection.vendor == 'sqlite':
+        sql, query = SQLITE_SQL, _fts5_query(text)
+        if query is None:
+            return []
+    else:
+        return _fallback(user, text, limit, offset)
+
+    with connection.cursor() as cursor:
+        cursor.execute(sql, [query, user.pk, limit, offset])
+        return [_result(row) for row in cursor.fetchall()]
@@ -1,15 +1,234 @@
 # serializers.py
-from rest_framework import serializers
-from .models import Chapter, Event
+from django.db import transaction
+from django.utils import timezone
+from rest_framework import permissions, serializers
+from .aggregates import counted, update_aggregates
+from .lineage import LineageCycleError, is_descendant, parent_for, spawned_subtree_contains, sync_lineage, sync_spawned
+from .models import ChangeSequence, Chapter, Event, EventContent, count_words, make_excerpt
+from .periods import invalidate_periods, period_index
 
+BULK_BATCH_SIZE = 500
+
+OWN_DESCENDANT = 'A chapter cannot branch from itself or from its own descendants.'
+MOVED_INTO_SPAWNED = 'An entry cannot move into a branch spawned from it, or below one.'
+
+
+def is_summary(request):
+    """True for ?view=summary"""
+    return request is not None and request.query_params.get('view') == 'summary'
+
+
+def wants_stubs(request):
+    """True for ?stubs=1, collapsed chapters as stubs (see TimelineBuilder)"""
+    return request is not None and request.query_params.get('stubs') in ('1', 'true')
+
+
+def requested_fields(request):
+    """Field names from ?fields=a,b,c, or None when not given"""
+    if request is None or not request.query_params.get('fields'):
+        return None
+    return {name.strip() for name in request.query_params['fields'].split(',') if name.strip()}
+
+
+class SparseFieldsMixin:
+    """
+    Trims the output on reads:
+    ?view=summary drops Meta.summary_exclude (e.g. Event.content) at every level
+    ?fields=a,b,c keeps only the named fields of the top-level objects
+    """
+
+    def get_fields(self):
+        fields = super().get_fields()
+        request = self.context.get('request')
+        if request is None or request.method not in permissions.SAFE_METHODS:
+            return fields
+
+        if is_summary(request):
+            for name in getattr(self.Meta, 'summary_exclude', ()):
+                fields.pop(name, None)
+
+        wanted = requested_fields(request)
+        parent = self.parent.parent if isinstance(self.parent, serializers.ListSerializer) else self.parent
+        if wanted and parent is None:
+            for name in list(fields):
+                if name not in wanted:
+                    fields.pop(name)
+        return fields
+
+
+def moves(serializer, attrs, names):
+    """True when a single-object update changes any of the tree references `names`"""
+    return (
+        serializer.instance is not None
+        and not isinstance(serializer.parent, serializers.ListSerializer)
+        and any(name in attrs for name in names)
+    )
+
+
+def after(serializer, attrs, name):
+    """The value `name` will have once attrs are applied to the instance"""
+    return attrs[name] if name in attrs else getattr(serializer.instance, name)
+
+
+class PreloadedPrimaryKeyRelatedField(serializers.PrimaryKeyRelatedField):
+    """
+    Resolves pks from the objects a BulkListSerializer loaded up front, so a
+    bulk write costs one query per relation instead of one per row. Only the
+    requesting user's rows can be referred to.
+    """
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        request = self.context.get('request')
+        if request is None:
+            return queryset
+        if not request.user.is_authenticated:
+            return queryset.none()
+        return queryset.filter(user=request.user)
+
+    def to_internal_value(self, data):
+        preloaded = getattr(self.root, 'preloaded', {}).get(self.field_name)
+        if preloaded is None:
+            return super().to_internal_value(data)
+        if isinstance(data, bool):
+            self.fail('incorrect_type', data_type=type(data).__name__)
+        try:
+            return preloaded[int(data)]
+        except KeyError:
+            self.fail('does_not_exist', pk_value=data)
+        except (TypeError, ValueError):
+            self.fail('incorrect_type', data_type=type(data).__name__)
+
+
+class BulkListSerializer(serializers.ListSerializer):
+    """
+    many=True serializer that writes with bulk_create/bulk_update.
+
+    For updates, pass the instances and partial dicts that each carry the 'id'
+    of the row they patch.
+    """
+
+    def to_internal_value(self, data):
+        if isinstance(data, list):
+            self.preloaded = {}
+            for name, field in self.child.fields.items():
+                if field.read_only or not isinstance(field, PreloadedPrimaryKeyRelatedField):
+                    continue
+                pks = set()
+                for item in data:
+                    try:
+                        pks.add(int(item[name]))
+                    except (KeyError, TypeError, ValueError):
+                        pass
+                self.preloaded[name] = field.get_queryset().in_bulk(pks) if pks else {}
+        if self.instance is not None:
+            self.instances_by_id = {obj.pk: obj for obj in self.instance}
+        return super().to_internal_value(data)
+
+    def run_child_validation(self, data):
+        if self.instance is not None and isinstance(data, dict):
+            self.child.instance = self.instances_by_id.get(data.get('id'))
+            self.child.initial_data = data
+        return super().run_child_validation(data)
+
+    def prepare(self, obj, attrs):
+        """Fill derived columns save() would have set; returns their names"""
+        return set()
+
+    def written(self, objs, created):
+        """Follow-up writes post_save receivers would have made, in the same transaction"""
+
+    def create(self, validated_data):
+        model = self.child.Meta.model
+        objs = []
+        for attrs in validated_data:
+            obj = model(**attrs)
+            self.prepare(obj, attrs)
+            objs.append(obj)
+        with transaction.atomic():
+            ChangeSequence.stamp(objs)
+            objs = model.objects.bulk_create(objs, batch_size=BULK_BATCH_SIZE)
+            self.written(objs, created=True)
+            return objs
+
+    def update(self, instances, validated_data):
+        model = self.child.Meta.model
+        by_id = {obj.pk: obj for obj in instances}
+        # bulk_update() skips auto_now and save(), so bump updated_at and
+        # change_seq ourselves
+        now = timezone.now()
+        changed = {'updated_at', 'change_seq'}
+        objs = []
+        for item, attrs in zip(self.initial_data, validated_data):
+            obj = by_id[item['id']]
+            for attr, value in attrs.items():
+                setattr(obj, attr, value)
+            changed.update(attrs)
+            changed.update(self.prepare(obj, attrs))
+            obj.updated_at = now
+            objs.append(obj)
+        # Attributes that are not columns (Event.content) are up to written()
+        changed &= {field.name for field in model._meta.concrete_fields}
+        if objs:
+            with transaction.atomic():
+                ChangeSequence.stamp(objs)
+                model.objects.bulk_update(objs, changed, batch_size=BULK_BATCH_SIZE)
+                self.written(objs, created=False)
+        return objs
+
+
+class EventListSerializer(BulkListSerializer):
+    def prepare(self, obj, attrs):
+        if obj.pk is None or 'content' in attrs:
+            obj.excerpt = make_excerpt(obj.content)
+            obj.word_count = count_words(obj.content)
+            return {'excerpt', 'word_count'}
+        return set()
+
+    def update(self, instances, validated_data):
+        # What the rows counted for before the update, see written()
+        self.counted_before = {obj.pk: counted(obj) for obj in instances}
+        return super().update(instances, validated_data)
+
+    def written(self, objs, created):
+        EventContent.save_for(objs, created)
+        if created:
+            update_aggregates(added=[counted(obj) for obj in objs])
+            return
+        update_aggregates(
+            removed=[self.counted_before[obj.pk] for obj in objs],
+            added=[counted(obj) for obj in objs],
+        )
+        try:
+            sync_spawned([obj.pk for obj in objs])
+        except LineageCycleError:
+            raise serializers.ValidationError(MOVED_INTO_SPAWNED)
+
+
+class ChapterListSerializer(BulkListSerializer):
+    def written(self, objs, created):
+        for user_id in {obj.user_id for obj in objs}:
+            invalidate_periods(user_id)
+        try:
+            sync_lineage([obj.pk for obj in objs])
+        except LineageCycleError:
+            raise serializers.ValidationError(OWN_DESCENDANT)
+
+
+class EventSerializer(SparseFieldsMixin, serializers.ModelSerializer):
+    serializer_related_field = PreloadedPrimaryKeyRelatedField
+
+    # A property on the model, stored in EventContent
+    content = serializers.CharField(allow_blank=True, required=False, style={'base_template': 'textarea.html'})
 
-class EventSerializer(serializers.ModelSerializer):
     class Meta:
         model = Event
+        list_serializer_class = EventListSerializer
         fields = [
             'id',
             'title',
             'content',
+            'excerpt',
             'date',
             'order',
             'chapter',
@@ -17,16 +236,42 @@ class EventSerializer(serializers.ModelSerializer):
             'created_at',
             'updated_at',
         ]
-        read_only_fields = ['created_at', 'updated_at']
+        read_only_fields = ['excerpt', 'created_at', 'updated_at']
+        summary_exclude = ['content']
+
+    def validate(self, attrs):
+        if self.instance is None and 'chapter' not in attrs and 'date' in attrs and 'request' in self.context:
+            # Created without a chapter (an explicit null keeps it out of
+            # one): the period covering the date, in the main timeline or
+            # the entry's branch
+            branch = attrs.get('branch')
+            attrs['chapter_id'] = self.period_index().chapter_for(
+                attrs['date'], branch=branch.pk if branch is not None else None
+            )
+        # Bulk writes are checked once, by the list serializer's sync
+        if moves(self, attrs, ('chapter', 'branch')):
+            container = next(filter(None, (after(self, attrs, 'chapter'), after(self, attrs, 'branch'))), None)
+            if container is not None and spawned_subtree_contains(self.instance.pk, container.pk):
+                raise serializers.ValidationError(MOVED_INTO_SPAWNED)
+        return attrs
+
+    def period_index(self):
+        # Fetched once per request, however many entries a bulk create has
+        if 'period_index' not in self.context:
+            self.context['period_index'] = period_index(self.context['request'].user.pk)
+        return self.context['period_index']
+
 
+class ChapterSerializer(SparseFieldsMixin, serializers.ModelSerializer):
+    serializer_related_field = PreloadedPrimaryKeyRelatedField
 
-class ChapterSerializer(serializers.ModelSerializer):
     entries = EventSerializer(many=True, read_only=True)
     branch_entries = EventSerializer(many=True, read_only=True)
     periods = serializers.SerializerMethodField()
 
     class Meta:
         model = Chapter
+        list_serializer_class = ChapterListSerializer
         fields = [
             'id',
             'type',
@@ -40,6 +285,10 @@ class ChapterSerializer(serializers.ModelSerializer):
             'source_chapter',
             'collapsed',
             'order',
+            'entry_count',
+            'word_count',
+            'first_entry_date',
+            'last_entry_date',
             'entries',
             'branch_entries',
             'periods',
@@ -48,9 +297,36 @@ class ChapterSerializer(serializers.ModelSerializer):
         ]
         read_only_fields = ['created_at', 'updated_at']
 
+    def validate(self, attrs):
+        lineage = ('parent_branch', 'source_entry', 'source_chapter')
+        if moves(self, attrs, lineage):
+            parent = parent_for(**{name: after(self, attrs, name) for name in lineage})
+            if parent is not None and is_descendant(parent, self.instance.pk):
+                raise serializers.ValidationError(OWN_DESCENDANT)
+        return attrs
+
     def get_periods(self, obj):
         """Get child periods for branches"""
         if obj.type == 'branch':
-            qs = obj.periods.all().order_by('order', 'start_date')
-            return ChapterSerializer(qs, many=True, context=self.context).data
-        return []
\ No newline at end of file
+            # Sort in Python so a 'periods' prefetch is reused
+            periods = sorted(obj.periods.all(), key=lambda c: (c.order, c.start_date))
+            return ChapterSerializer(periods, many=True, context=self.context).data
+        return []
+
+
+class ActivePeriodsSerializer(serializers.Serializer):
+    """Query parameters for the periods active on a date"""
+    date = serializers.DateField()
+    branch = serializers.IntegerField(required=False)
+
+
+class TimelineWindowSerializer(serializers.Serializer):
+    """Query parameters for a windowed timeline_data request"""
+    start = serializers.DateField(required=False)
+    end = serializers.DateField(required=False)
+    branch = serializers.IntegerField(required=False)
+
+    def validate(self, attrs):
+        if 'start' in attrs and 'end' in attrs and attrs['start'] > attrs['end']:
+            raise serializers.ValidationError('start must not be after end')
+        return attrs
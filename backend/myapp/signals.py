@@ -0,0 +1,117 @@
+# signals.py
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.db.models.signals import post_delete, post_save, pre_delete, pre_save
+from django.dispatch import receiver
+
+from .aggregates import COUNTED, counted, update_aggregates
+from .cache import invalidate_timeline_on_commit
+from .content import register_functions
+from .lineage import children_of, drop_lineage, sync_lineage, sync_spawned
+from .middleware import install_query_timer
+from .models import Chapter, Event
+from .periods import invalidate_periods
+from .sync import record_deletion
+
+
+@receiver(post_save, sender=Chapter)
+@receiver(post_save, sender=Event)
+@receiver(post_delete, sender=Chapter)
+@receiver(post_delete, sender=Event)
+def timeline_changed(sender, instance, **kwargs):
+    invalidate_timeline_on_commit(instance.user_id)
+
+
+@receiver(post_save, sender=Chapter)
+@receiver(post_delete, sender=Chapter)
+def periods_changed(sender, instance, **kwargs):
+    invalidate_periods(instance.user_id)
+
+
+def _touches(update_fields, names):
+    return update_fields is None or any(
+        name in update_fields or f'{name}_id' in update_fields for name in names
+    )
+
+
+@receiver(post_save, sender=Chapter)
+def chapter_lineage(sender, instance, update_fields=None, **kwargs):
+    if _touches(update_fields, ('parent_branch', 'source_entry', 'source_chapter')):
+        sync_lineage([instance.pk])
+
+
+@receiver(post_save, sender=Event)
+def spawned_lineage(sender, instance, created, update_fields=None, **kwargs):
+    # Branches spawned from the event hang below whichever chapter holds it
+    if not created and _touches(update_fields, ('chapter', 'branch')):
+        sync_spawned([instance.pk])
+
+
+# ORM deletes (the admin, Chapter.delete()); the API's soft deletes keep the
+# closure until the purge. The cascade would drop the chapter's closure rows
+# before SET_NULL clears the references to it, leaving its descendants linked
+# to its ancestors, so the references are cleared here first, as
+# deletion._purge_chapters does, and what hung off it re-parented.
+
+@receiver(pre_delete, sender=Chapter)
+def chapter_lineage_removed(sender, instance, **kwargs):
+    children = children_of([instance.pk])
+    Event.all_objects.filter(chapter_id=instance.pk).update(chapter=None)
+    Event.all_objects.filter(branch_id=instance.pk).update(branch=None)
+    Chapter.all_objects.filter(source_chapter_id=instance.pk).update(source_chapter=None)
+    sync_lineage(children)
+    drop_lineage([instance.pk])
+
+
+@receiver(pre_delete, sender=Event)
+def spawned_lineage_removed(sender, instance, **kwargs):
+    spawned = list(Chapter.all_objects.filter(source_entry_id=instance.pk).values_list('id', flat=True))
+    if spawned:
+        Chapter.all_objects.filter(pk__in=spawned).update(source_entry=None)
+        sync_lineage(spawned)
+
+
+# Event fields that move the aggregates of the chapters holding it (a
+# content save also saves word_count)
+COUNTED_FIELDS = ('chapter', 'branch', 'date', 'word_count')
+
+
+@receiver(pre_save, sender=Event)
+def remember_counted(sender, instance, update_fields=None, **kwargs):
+    # The stored row, not the instance: that is what the aggregates counted
+    if not instance._state.adding and _touches(update_fields, COUNTED_FIELDS):
+        instance._counted_before = Event.objects.filter(pk=instance.pk).values(*COUNTED).first()
+
+
+@receiver(post_save, sender=Event)
+def entry_aggregates(sender, instance, created, update_fields=None, **kwargs):
+    if _touches(update_fields, COUNTED_FIELDS):
+        before = instance.__dict__.pop('_counted_before', None)
+        update_aggregates(removed=[before], added=[counted(instance)])
+
+
+@receiver(post_delete, sender=Event)
+def entry_removed(sender, instance, **kwargs):
+    update_aggregates(removed=[counted(instance)])
+
+
+@receiver(post_delete, sender=Chapter)
+@receiver(post_delete, sender=Event)
+def leave_tombstone(sender, instance, **kwargs):
+    record_deletion(instance)
+
+
+@receiver(connection_created)
+def time_queries(sender, connection, **kwargs):
+    install_query_timer(connection)
+
+
+@receiver(connection_created)
+def content_functions(sender, connection, **kwargs):
+    register_functions(connection)
+
+
+# Connections opened before this module was imported
+for connection in connections.all(initialized_only=True):
+    install_query_timer(connection)
+    register_functions(connection)
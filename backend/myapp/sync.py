@@ -0,0 +1,168 @@
+# sync.py
+import threading
+from collections import defaultdict
+from contextlib import contextmanager
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Max
+from django.db.models.functions import Greatest
+from django.utils import timezone
+
+from .models import ChangeSequence, Chapter, Event, Tombstone
+from .rows import CHAPTER_SCALARS, ChapterRows, EventRows
+
+DEFAULT_LIMIT = 500
+MAX_LIMIT = 5000
+
+# Days tombstones are kept; a cursor from before the pruned ones is refused
+TOMBSTONE_RETENTION_DAYS = getattr(settings, 'TOMBSTONE_RETENTION_DAYS', 90)
+
+_local = threading.local()
+
+
+class CursorError(ValueError):
+    pass
+
+
+def _write_tombstones(deleted):
+    tombstones = []
+    by_user = defaultdict(list)
+    for user_id, kind, object_id in deleted:
+        by_user[user_id].append((kind, object_id))
+    for user_id, rows in by_user.items():
+        last = ChangeSequence.reserve(user_id, count=len(rows))
+        for seq, (kind, object_id) in enumerate(rows, start=last - len(rows) + 1):
+            tombstones.append(Tombstone(user_id=user_id, kind=kind, object_id=object_id, change_seq=seq))
+    Tombstone.objects.bulk_create(tombstones)
+
+
+def record_deletion(instance):
+    """Called for every deleted Chapter/Event (post_delete)"""
+    record_deletions([(instance.user_id, instance._meta.model_name, instance.pk)])
+
+
+def record_deletions(deleted):
+    """Leave tombstones for (user_id, 'chapter'|'event', id) triples"""
+    buffer = getattr(_local, 'tombstones', None)
+    if buffer is not None:
+        buffer.extend(deleted)
+    elif deleted:
+        _write_tombstones(deleted)
+
+
+@contextmanager
+def batched_tombstones():
+    """
+    Collect the tombstones of deletes (including cascades) made inside the
+    block and write them with one reservation and one insert per user, instead
+    of two queries per deleted row.
+    """
+    if getattr(_local, 'tombstones', None) is not None:
+        # Already batching further up the stack
+        yield
+        return
+
+    with transaction.atomic():
+        _local.tombstones = []
+        try:
+            yield
+            buffered = _local.tombstones
+        finally:
+            _local.tombstones = None
+        if buffered:
+            _write_tombstones(buffered)
+
+
+def prune_tombstones(retention_days=TOMBSTONE_RETENTION_DAYS):
+    """
+    Delete tombstones older than `retention_days`, remembering per user the
+    last change number pruned, so changes_since() can refuse older cursors.
+    Returns the number deleted.
+    """
+    old = Tombstone.objects.filter(deleted_at__lt=timezone.now() - timedelta(days=retention_days))
+    pruned = 0
+    with transaction.atomic():
+        horizons = old.values('user_id').annotate(last=Max('change_seq')).values_list('user_id', 'last')
+        for user_id, last in horizons:
+            ChangeSequence.objects.filter(user_id=user_id).update(pruned=Greatest('pruned', last))
+            pruned += Tombstone.objects.filter(user_id=user_id, change_seq__lte=last).delete()[0]
+    return pruned
+
+
+def parse_cursor(value):
+    if value in (None, ''):
+        return 0
+    try:
+        cursor = int(value)
+    except (TypeError, ValueError):
+        raise CursorError('since must be a cursor returned by this endpoint')
+    if cursor < 0:
+        raise CursorError('since must be a cursor returned by this endpoint')
+    return cursor
+
+
+def changes_since(user, since=0, limit=DEFAULT_LIMIT, event_fields=None):
+    """
+    Chapters and events created or updated after cursor `since`, and the ids
+    of those deleted since, in change order.
+
+    Rows are flat (no nesting); references to a deleted chapter or event
+    should be dropped by the client, as the database nulls them without a
+    change of their own. At most `limit` changes are returned; when `more` is
+    true, ask again with the returned cursor. since=0 is a full sync.
+    """
+    # Everything up to the committed counter value is visible now (see
+    # ChangeSequence); later numbers may still be in flight, so stop there
+    current, pruned = (
+        ChangeSequence.objects.filter(user=user).values_list('value', 'pruned').first() or (0, 0)
+    )
+    if since > current:
+        raise CursorError('Cursor is ahead of this journal, sync from scratch')
+    if 0 < since < pruned:
+        raise CursorError('Cursor has expired, sync from scratch')
+    window = {'user': user, 'change_seq__gt': since, 'change_seq__lte': current}
+
+    chapter_rows = ChapterRows(CHAPTER_SCALARS)
+    event_rows = EventRows(event_fields)
+
+    chapters = (
+        Chapter.objects.filter(**window)
+        .order_by('change_seq')
+        .values('change_seq', *chapter_rows.values())[:limit + 1]
+    )
+    events = (
+        event_rows.annotate(Event.objects.filter(**window))
+        .order_by('change_seq')
+        .values('change_seq', *event_rows.values())[:limit + 1]
+    )
+    tombstones = (
+        Tombstone.objects.filter(**window)
+        .order_by('change_seq')
+        .values_list('change_seq', 'kind', 'object_id')[:limit + 1]
+    )
+
+    # Merge the three streams by sequence and keep the first `limit`
+    merged = [(row['change_seq'], 'chapter', row) for row in chapters]
+    merged += [(row['change_seq'], 'event', row) for row in events]
+    merged += [(seq, 'deleted', (kind, object_id)) for seq, kind, object_id in tombstones]
+    merged.sort(key=lambda item: item[0])
+    more = len(merged) > limit
+    merged = merged[:limit]
+
+    result = {
+        'chapters': [],
+        'events': [],
+        'deleted': {'chapters': [], 'events': []},
+    }
+    for _, kind, row in merged:
+        if kind == 'chapter':
+            result['chapters'].append(chapter_rows.to_representation(row))
+        elif kind == 'event':
+            result['events'].append(event_rows.to_representation(row))
+        else:
+            result['deleted'][f'{row[0]}s'].append(row[1])
+
+    cursor = merged[-1][0] if more else current
+    return {'cursor': str(cursor), 'more': more, **result}
@@ -0,0 +1,109 @@
+# synthetic.py
+import datetime
+import random
+
+from .importer import TimelineImporter
+
+# Named sizes for benchmarks, keyed by total event count
+SIZES = {
+    '1k': {'main_periods': 10, 'branches': 4, 'branch_periods': 4, 'events': 1_000},
+    '10k': {'main_periods': 30, 'branches': 8, 'branch_periods': 6, 'events': 10_000},
+    '100k': {'main_periods': 80, 'branches': 16, 'branch_periods': 10, 'events': 100_000},
+}
+
+WORDS = (
+    'morning letter train river garden winter summer house school friend work '
+    'city coffee rain music book walk dinner family project trip sea mountain '
+    'road light evening window dream call paper night market bridge field'
+).split()
+
+COLORS = ['#3B82F6', '#10B981', '#F59E0B', '#EF4444', '#8B5CF6', '#EC4899']
+
+
+def _spans(rng, start, end, count):
+    """Split [start, end] into `count` consecutive date ranges"""
+    days = (end - start).days
+    cuts = sorted(rng.sample(range(1, days), count - 1)) if count > 1 else []
+    bounds = [0, *cuts, days]
+    return [
+        (start + datetime.timedelta(days=a), start + datetime.timedelta(days=b))
+        for a, b in zip(bounds, bounds[1:])
+    ]
+
+
+def _entries(rng, prefix, count, start, end, words):
+    days = max((end - start).days, 1)
+    entries = []
+    for i in range(count):
+        body = ' '.join(rng.choice(WORDS) for _ in range(rng.randint(*words)))
+        entries.append({
+            'id': f'{prefix}-{i}',
+            'title': ' '.join(rng.choice(WORDS) for _ in range(3)).capitalize(),
+            'date': (start + datetime.timedelta(days=rng.randrange(days))).isoformat(),
+            'content': body,
+            'order': i,
+        })
+    return entries
+
+
+def generate_timeline(main_periods, branches, branch_periods, events, seed=0,
+                      start=datetime.date(1990, 1, 1), end=datetime.date(2025, 1, 1),
+                      words=(20, 200)):
+    """
+    Deterministic nested {"mainTimeline", "branches"} document (see
+    TimelineImporter). Half of the events go to main periods, the rest to
+    branch periods, with one direct entry per branch.
+    """
+    rng = random.Random(seed)
+    branch_total = branches * branch_periods
+    main_events = events // 2 if branch_total else events
+    branch_events = events - main_events - (branches if branch_total else 0)
+
+    def share(total, parts, i):
+        return total // parts + (1 if i < total % parts else 0)
+
+    main = []
+    for i, (a, b) in enumerate(_spans(rng, start, end, main_periods)):
+        main.append({
+            'id': f'main-{i}',
+            'title': f'Period {i + 1}',
+            'startDate': a.isoformat(),
+            'endDate': b.isoformat(),
+            'order': i,
+            'entries': _entries(rng, f'main-{i}', share(main_events, main_periods, i), a, b, words),
+        })
+
+    result = []
+    n = 0
+    for i in range(branches):
+        branch_start = start + datetime.timedelta(days=rng.randrange((end - start).days // 2))
+        periods = []
+        for j, (a, b) in enumerate(_spans(rng, branch_start, end, branch_periods)):
+            count = share(branch_events, branch_total, n)
+            n += 1
+            periods.append({
+                'id': f'branch-{i}-{j}',
+                'title': f'Branch {i + 1} period {j + 1}',
+                'startDate': a.isoformat(),
+                'endDate': b.isoformat(),
+                'order': j,
+                'entries': _entries(rng, f'branch-{i}-{j}', count, a, b, words),
+            })
+        result.append({
+            'id': f'branch-{i}',
+            'name': f'Branch {i + 1}',
+            'color': COLORS[i % len(COLORS)],
+            'x': 300 + 120 * i,
+            'startDate': branch_start.isoformat(),
+            'order': i,
+            'periods': periods,
+            'directEntries': _entries(rng, f'branch-{i}-direct', 1 if branch_total else 0, branch_start, end, words),
+        })
+
+    return {'mainTimeline': main, 'branches': result}
+
+
+def populate(user, size='1k', seed=0, **overrides):
+    """Fill the user's journal with a synthetic timeline of a named size"""
+    params = {**SIZES[size], **overrides}
+    return TimelineImporter(user).load_nested(generate_timeline(seed=seed, **params)).run()
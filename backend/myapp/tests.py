@@ -1,3 +1,1326 @@
-from django.test import TestCase
+import gzip
+import io
+import json
+from datetime import date, datetime, timezone
+from decimal import Decimal
+from unittest import mock, skipUnless
 
-# Create your tests here.
+import msgpack
+from asgiref.sync import sync_to_async
+
+from django.core.management import CommandError, call_command
+from django.core.cache import cache
+from django.db import connections, transaction
+from django.db.models import Q
+from django.test import TestCase, TransactionTestCase
+from django.test.utils import CaptureQueriesContext
+from django.utils.translation import gettext_lazy
+from rest_framework.authtoken.models import Token
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory
+
+from users.models import CustomUser
+from .aggregates import check_aggregates
+from .cache import snapshot_stats
+from .content import register_functions
+from .deletion import purge_deleted
+from .importer import TimelineImporter
+from .lineage import ancestry, subtree
+from .metrics import request_metrics
+from .models import Chapter, ChapterLineage, Event, EventContent, Tombstone
+from .renderers import MessagePackRenderer, ORJSONRenderer
+from .routers import ReplicaRouter, reads_from
+from .rows import ChapterPage
+from .search import search_events
+from .sync import prune_tombstones
+from .serializers import ChapterSerializer, EventSerializer
+from .timeline import TimelineBuilder, build_timeline
+from .views.event_views import chapter_queryset, chapter_rows, event_queryset
+
+
+def make_timeline(user, branches=1, periods=1, entries=2):
+    for i in range(2):
+        chapter = Chapter.objects.create(
+            user=user, title=f'Main {i}', start_date=date(2000 + i, 1, 1), order=i
+        )
+        for j in range(entries):
+            Event.objects.create(user=user, chapter=chapter, title=f'M{i}.{j}', date=date(2000 + i, 2, j + 1))
+    for b in range(branches):
+        branch = Chapter.objects.create(
+            user=user, type='branch', title=f'Branch {b}', start_date=date(2010, 1, 1), order=b
+        )
+        Event.objects.create(user=user, branch=branch, title=f'B{b}', date=date(2010, 1, 2))
+        for p in range(periods):
+            period = Chapter.objects.create(
+                user=user, type='branch_period', parent_branch=branch,
+                title=f'Period {b}.{p}', start_date=date(2011 + p, 1, 1), order=p,
+            )
+            for j in range(entries):
+                Event.objects.create(user=user, chapter=period, title=f'P{b}.{p}.{j}', date=date(2011 + p, 3, j + 1))
+
+
+class TimelineBuilderTests(TestCase):
+    def setUp(self):
+        self.user = CustomUser.objects.create_user(email='reader@example.com', password='pw')
+
+    def test_query_count_is_constant(self):
+        make_timeline(self.user, branches=1, periods=1)
+        with self.assertNumQueries(2):
+            build_timeline(self.user)
+
+        make_timeline(self.user, branches=5, periods=4)
+        with self.assertNumQueries(2):
+            build_timeline(self.user)
+
+    def test_matches_chapter_serializer(self):
+        make_timeline(self.user, branches=2, periods=2)
+        main_periods = Chapter.objects.filter(
+            user=self.user, type='main_period', parent_branch__isnull=True
+        ).order_by('order', 'start_date')
+        branches = Chapter.objects.filter(
+            user=self.user, type='branch', parent_branch__isnull=True
+        ).order_by('order', 'start_date')
+
+        self.assertEqual(build_timeline(self.user), {
+            'main_timeline': ChapterSerializer(main_periods, many=True).data,
+            'branches': ChapterSerializer(branches, many=True).data,
+        })
+
+
+class TimelineWindowTests(TestCase):
+    URL = '/api/chapters/timeline_data/'
+
+    def setUp(self):
+        self.user = CustomUser.objects.create_user(email='reader@example.com', password='pw')
+        self.client.force_login(self.user)
+        make_timeline(self.user, branches=2, periods=2)
+        for chapter in Chapter.objects.filter(user=self.user):
+            Chapter.objects.filter(pk=chapter.pk).update(end_date=date(chapter.start_date.year, 12, 31))
+
+    def outline(self, document):
+        """Chapter titles mapped to the titles of the entries they carry"""
+        def walk(chapter):
+            yield chapter['title'], [entry['title'] for entry in chapter['entries'] + chapter['branch_entries']]
+            for period in chapter['periods']:
+                yield from walk(period)
+
+        return {
+            part: dict(item for chapter in document[part] for item in walk(chapter))
+            for part in ('main_timeline', 'branches')
+        }
+
+    def test_start_end_and_branch(self):
+        response = self.client.get(self.URL, {'start': '2001-01-01', 'end': '2011-12-31'})
+        self.assertEqual(self.outline(response.json()), {
+            'main_timeline': {'Main 1': ['M1.0', 'M1.1']},
+            'branches': {
+                'Branch 0': ['B0'], 'Period 0.0': ['P0.0.0', 'P0.0.1'],
+                'Branch 1': ['B1'], 'Period 1.0': ['P1.0.0', 'P1.0.1'],
+            },
+        })
+        # Branches are containers, kept outside the window without their entries
+        response = self.client.get(self.URL, {'start': '2012-01-01'})
+        self.assertEqual(self.outline(response.json())['branches'], {
+            'Branch 0': [], 'Period 0.1': ['P0.1.0', 'P0.1.1'],
+            'Branch 1': [], 'Period 1.1': ['P1.1.0', 'P1.1.1'],
+        })
+
+        branch = Chapter.objects.get(user=self.user, title='Branch 1')
+        response = self.client.get(self.URL, {'branch': branch.pk, 'end': '2011-06-30'})
+        self.assertEqual(self.outline(response.json()), {
+            'main_timeline': {},
+            'branches': {'Branch 1': ['B1'], 'Period 1.0': ['P1.0.0', 'P1.0.1']},
+        })
+        self.assertEqual(
+            self.client.get('/api/async/chapters/timeline_data/', {'branch': branch.pk, 'end': '2011-06-30'}).json(),
+            response.json(),
+        )
+
+    def test_start_after_end_is_rejected(self):
+        for url in (self.URL, '/api/async/chapters/timeline_data/'):
+            with self.subTest(url=url):
+                response = self.client.get(url, {'start': '2002-01-01', 'end': '2001-01-01'})
+                self.assertEqual(response.status_code, 400)
+                self.assertEqual(response.json(), {'non_field_errors': ['start must not be after end']})
+                self.assertEqual(self.client.get(url, {'start': 'soon'}).status_code, 400)
+
+
+class ConditionalTests(TestCase):
+    PATHS = ('/api/chapters/timeline_data/', '/api/chapters/', '/api/events/', '/api/async/chapters/timeline_data/')
+
+    def setUp(self):
+        self.user = CustomUser.objects.create_user(email='reader@example.com', password='pw')
+        self.client.force_login(self.user)
+        make_timeline(self.user, branches=0)
+
+    def assertCacheHeaders(self, response):
+        self.assertIn('Accept', response['Vary'])
+        self.assertEqual(response['Cache-Control'], 'private, no-cache')
+
+    def test_if_none_match(self):
+        etags = {}
+        for path in self.PATHS:
+            response = self.client.get(path)
+            self.assertEqual(response.status_code, 200)
+            self.assertCacheHeaders(response)
+            etags[path] = response['ETag']
+
+            response = self.client.get(path, HTTP_IF_NONE_MATCH=etags[path])
+            self.assertEqual((response.status_code, response.content), (304, b''))
+            self.assertCacheHeaders(response)
+            # Another representation, another ETag
+            msgpack_etag = self.client.get(path, HTTP_ACCEPT='application/msgpack')['ETag']
+            self.assertNotEqual(msgpack_etag, etags[path])
+
+        Event.objects.create(user=self.user, title='New', date=date(2001, 5, 1))
+        for path in self.PATHS:
+            response = self.client.get(path, HTTP_IF_NONE_MATCH=etags[path])
+            self.assertEqual(response.status_code, 200)
+            self.assertNotEqual(response['ETag'], etags[path])
+
+    async def test_async_views_answer_304(self):
+        path = '/api/async/events/'
+        await self.async_client.aforce_login(self.user)
+        etag = (await self.async_client.get(path))['ETag']
+        response = await self.async_client.get(path, headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 304)
+        self.assertCacheHeaders(response)
+
+
+class AsyncViewTests(TestCase):
+    # Async path: the sync endpoint serving the same document
+    PATHS = {
+        '/api/async/chapters/': '/api/chapters/',
+        '/api/async/chapters/timeline_data/': '/api/chapters/timeline_data/',
+        '/api/async/events/': '/api/events/',
+    }
+
+    def setUp(self):
+        self.user = CustomUser.objects.create_user(email='reader@example.com', password='pw')
+        make_timeline(self.user, branches=1, periods=2)
+        self.token = Token.objects.create(user=self.user)
+
+    async def test_authentication(self):
+        for path in self.PATHS:
+            with self.subTest(path=path):
+                response = await self.async_client.get(path)
+                self.assertEqual((response.status_code, response['WWW-Authenticate']), (401, 'Token'))
+                self.assertEqual(response.json(), {'detail': 'Authentication credentials were not provided.'})
+                response = await self.async_client.get(path, headers={'Authorization': 'Token nope'})
+                self.assertEqual((response.status_code, response.json()), (401, {'detail': 'Invalid token.'}))
+
+                response = await self.async_client.get(path, headers={'Authorization': f'Token {self.token.key}'})
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual((await self.async_client.post(path)).status_code, 405)
+
+    async def test_formats_and_304_match_the_sync_views(self):
+        await self.async_client.aforce_login(self.user)
+        await self.client.aforce_login(self.user)
+        for path, sync_path in self.PATHS.items():
+            for accept in ('application/json', 'application/msgpack'):
+                with self.subTest(path=path, accept=accept):
+                    response = await self.async_client.get(path, headers={'Accept': accept})
+                    expected = await sync_to_async(self.client.get)(sync_path, HTTP_ACCEPT=accept)
+                    self.assertEqual(response['Content-Type'], accept)
+                    self.assertEqual(response.content, expected.content)
+                    self.assertIn('Accept', response['Vary'])
+
+                    response = await self.async_client.get(
+                        path, headers={'Accept': accept, 'If-None-Match': response['ETag']}
+                    )
+                    self.assertEqual(response.status_code, 304)
+
+            response = await self.async_client.get(path, {'format': 'msgpack'})
+            self.assertEqual(response['Content-Type'], 'application/msgpack')
+            response = await self.async_client.get(path, headers={'Accept': 'text/csv'})
+            self.assertEqual(response.status_code, 406)
+
+
+class TimelineSnapshotTests(TestCase):
+    URL = '/api/chapters/timeline_data/'
+
+    def setUp(self):
+        self.user = CustomUser.objects.create_user(email='reader@example.com', password='pw')
+        self.client.force_login(self.user)
+        make_timeline(self.user, branches=0)
+        self.event = Event.objects.filter(user=self.user).first()
+        cache.clear()
+
+    def rename(self, title):
+        self.client.patch(f'/api/events/{self.event.pk}/', {'title': title}, content_type='application/json')
+
+    def test_writes_invalidate_and_stats_count(self):
+        for _ in range(2):
+            self.assertContains(self.client.get(self.URL), 'M0.0')
+        self.client.get(self.URL, {'view': 'summary'})
+        self.assertEqual(snapshot_stats(), {'hits': 1, 'misses': 2, 'invalidations': 0, 'hit_ratio': 1 / 3})
+
+        self.rename('Renamed')
+        stats = snapshot_stats()
+        self.assertGreater(stats['invalidations'], 0)
+        response = self.client.get(self.URL)
+        self.assertContains(response, 'Renamed')
+        self.assertEqual(snapshot_stats()['misses'], stats['misses'] + 1)
+
+    def test_snapshot_follows_the_etag_version(self):
+        # Another worker's cache, which never saw the write's invalidation
+        etag = self.client.get(self.URL)['ETag']
+        with mock.patch('myapp.cache.invalidate_timeline'):
+            self.rename('Renamed')
+
+        response = self.client.get(self.URL, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertContains(response, 'Renamed')
+
+
+class CollapsedChapterTests(TestCase):
+    def setUp(self):
+        self.user = CustomUser.objects.create_user(email='reader@example.com', password='pw')
+        make_timeline(self.user, branches=2, periods=2, entries=3)
+        self.main = Chapter.objects.filter(user=self.user, type='main_period').order_by('id').first()
+        self.branch = Chapter.objects.filter(user=self.user, type='branch').order_by('id').first()
+        Chapter.objects.filter(pk__in=[self.main.pk, self.branch.pk]).update(collapsed=True)
+        self.client.force_login(self.user)
+
+    def test_timeline_has_stubs(self):
+        with CaptureQueriesContext(connections['default']) as queries:
+            document = build_timeline(self.user, stubs=True)
+        self.assertEqual(len(queries), 2)
+        main = next(row for row in document['main_timeline'] if row['id'] == self.main.pk)
+        self.assertEqual((main['entries'], main['entry_count'], main['last_entry_date']), ([], 3, '2000-02-03'))
+        branch = next(row for row in document['branches'] if row['id'] == self.branch.pk)
+        self.assertEqual((branch['branch_entries'], branch['periods'], branch['entry_count']), ([], [], 1))
+        other = next(row for row in document['branches'] if row['id'] != self.branch.pk)
+        self.assertEqual([len(period['entries']) for period in other['periods']], [3, 3])
+
+        # Only the open chapters' events were read: 3 + 1 + 2 * 3
+        events = Event.objects.filter(user=self.user)
+        self.assertEqual(len(TimelineBuilder(self.user, stubs=True).event_rows()), 10)
+        self.assertEqual(events.count(), 20)
+
+    def test_stubs_are_opt_in(self):
+        # Clients that do not call expand get collapsed chapters in full
+        for path in ('/api/chapters/timeline_data/', '/api/async/chapters/timeline_data/'):
+            with self.subTest(path=path):
+                for query in ({}, {'view': 'summary'}, {'start': '2000-01-01'}):
+                    full = self.client.get(path, query).json()
+                    stubs = self.client.get(path, {**query, 'stubs': '1'}).json()
+                    main = [row['entries'] for row in full['main_timeline'] if row['id'] == self.main.pk]
+                    self.assertEqual(len(main[0]), 3)
+                    main = [row['entries'] for row in stubs['main_timeline'] if row['id'] == self.main.pk]
+                    self.assertEqual(main, [[]])
+                branch = next(row for row in full['branches'] if row['id'] == self.branch.pk)
+                self.assertEqual((len(branch['branch_entries']), len(branch['periods'])), (1, 2))
+
+    def test_expand_pages_through_entries(self):
+        period = self.branch.periods.order_by('order').first()
+        Chapter.objects.filter(pk=period.pk).update(collapsed=True)
+        url = f'/api/chapters/{self.branch.pk}/expand/'
+        expected = list(
+            Event.objects.filter(Q(branch=self.branch) | Q(chapter__parent_branch=self.branch))
+            .exclude(chapter=period).order_by('date', 'order', 'id').values_list('id', flat=True)
+        )
+
+        seen = []
+        response = self.client.get(url, {'page_size': 2, 'view': 'summary'})
+        self.assertEqual(
+            [row['id'] for row in response.json()['periods']],
+            list(self.branch.periods.order_by('order').values_list('id', flat=True)),
+        )
+        while True:
+            body = response.json()
+            self.assertNotIn('content', body['results'][0])
+            seen += [row['id'] for row in body['results']]
+            if body['next'] is None:
+                break
+            response = self.client.get(body['next'])
+        self.assertEqual(seen, expected)
+
+        response = self.client.get(f'/api/chapters/{period.pk}/expand/')
+        self.assertEqual(len(response.json()['results']), 3)
+        self.assertEqual(response.json()['periods'], [])
+
+
+class RowSerializerTests(TestCase):
+    """The list endpoints' fast path must return the serializers' exact bytes"""
+
+    def setUp(self):
+        self.user = CustomUser.objects.create_user(email='reader@example.com', password='pw')
+        make_timeline(self.user, branches=2, periods=2)
+        chapter = Chapter.objects.filter(user=self.user, type='main_period').first()
+        # Same date and order as another entry, so ties must break the same way
+        Event.objects.create(
+            user=self.user, chapter=chapter, title='Tie \u2028 ünïcode "quoted"',
+            content='<b>&</b>\u2029', date=date(2000, 2, 1),
+        )
+        self.client.force_login(self.user)
+
+    def expected(self, path, serializer_class, queryset):
+        request = Request(APIRequestFactory().get(path))
+        data = serializer_class(queryset, many=True, context={'request': request}).data
+        return JSONRenderer().render({'next': None, 'previous': None, 'results': data})
+
+    def test_chapter_list_matches_serializer(self):
+        for query in ('', '?view=summary', '?fields=id,title,periods', '?fields=id,entries', '?fields=id,color'):
+            with self.subTest(query=query):
+                path = f'/api/chapters/{query}'
+                queryset = chapter_queryset(self.user, summary='summary' in query).order_by(
+                    'order', 'start_date', 'id'
+                )
+                response = self.client.get(path)
+                self.assertIsInstance(response.accepted_renderer, ORJSONRenderer)
+                self.assertEqual(response.content, self.expected(path, ChapterSerializer, queryset))
+
+    def test_event_list_matches_serializer(self):
+        for query in ('', '?view=summary', '?fields=id,date,branch'):
+            with self.subTest(query=query):
+                path = f'/api/events/{query}'
+                request = Request(APIRequestFactory().get(path))
+                queryset = event_queryset(self.user, request).order_by('date', 'order', 'id')
+                response = self.client.get(path)
+                self.assertEqual(response.content, self.expected(path, EventSerializer, queryset))
+
+    def test_chapter_page_query_count(self):
+        rows = list(chapter_rows(self.user))
+        with self.assertNumQueries(2):
+            ChapterPage(rows).build()
+        # Nothing nested asked for, nothing nested read
+        rows = list(chapter_rows(self.user, {'id', 'title'}))
+        with self.assertNumQueries(0):
+            ChapterPage(rows, fields={'id', 'title'}).build()
+
+
+class KeysetPaginationTests(TestCase):
+    URL = '/api/events/'
+
+    def setUp(self):
+        self.user = CustomUser.objects.create_user(email='reader@example.com', password='pw')
+        self.client.force_login(self.user)
+        chapter = Chapter.objects.create(user=self.user, title='Main', start_date=date(2000, 1, 1))
+        # Pairs share a date, so pages break inside runs of equal dates
+        for i in range(10):
+            Event.objects.create(user=self.user, chapter=chapter, title=f'E{i}', date=date(2000, 1, i // 2 + 1))
+        self.chapter = chapter
+
+    def titles(self, response):
+        return [row['title'] for row in response.json()['results']]
+
+    def test_pages_are_stable_under_writes(self):
+        for url in (self.URL, '/api/async/events/'):
+            with self.subTest(url=url):
+                first = self.client.get(url, {'page_size': 4})
+                self.assertEqual(self.titles(first), ['E0', 'E1', 'E2', 'E3'])
+                self.assertIsNone(first.json()['previous'])
+                # Rows landing before the cursor neither shift nor repeat the next page
+                early = Event.objects.create(user=self.user, chapter=self.chapter, title='Early', date=date(1999, 1, 1))
+
+                second = self.client.get(first.json()['next'])
+                seen, response = self.titles(first), second
+                while True:
+                    seen += self.titles(response)
+                    if response.json()['next'] is None:
+                        break
+                    response = self.client.get(response.json()['next'])
+                self.assertEqual(seen, [f'E{i}' for i in range(10)])
+
+                # Going back is a page before the boundary, not an offset
+                response = self.client.get(second.json()['previous'])
+                self.assertEqual(self.titles(response), ['E0', 'E1', 'E2', 'E3'])
+                early.delete()
+
+    def test_invalid_cursor(self):
+        for url in (self.URL, '/api/async/events/', '/api/chapters/'):
+            for cursor in ('garbage', 'eyJwIjpbMV19', 'eyJwIjpbIm5vdC1hLWRhdGUiLDAsMV19'):
+                with self.subTest(url=url, cursor=cursor):
+                    response = self.client.get(url, {'cursor': cursor})
+                    self.assertEqual(response.status_code, 404)
+                    self.assertEqual(response.json(), {'detail': 'Invalid cursor'})
+
+
+class ORJSONRendererTests(TestCase):
+    def test_matches_json_renderer(self):
+        data = {
+            'text': 'a\u2028b\u2029c ünïcode <>&\x00',
+            'lazy': gettext_lazy('Invalid token.'),
+            'date': date(2020, 1, 2),
+            'datetime': datetime(2020, 1, 2, 3, 4, 5, 678901, tzinfo=timezone.utc),
+            'decimal': Decimal('1.50'),
+            'nested': [{'id': 1, 'none': None, 'flag': True}],
+            1: 'int keys are handed to JSONRenderer',
+        }
+        for value in (data, {'results': [data]}, [], None):
+            with self.subTest(value=value):
+                self.assertEqual(ORJSONRenderer().render(value), JSONRenderer().render(value))
+
+
+class WireFormatTests(TestCase):
+    def setUp(self):
+        self.user = CustomUser.objects.create_user(email='reader@example.com', password='pw')
+        make_timeline(self.user, branches=1, periods=2, entries=3)
+        self.client.force_login(self.user)
+
+    def test_msgpack_carries_the_json_document(self):
+        for path in ('/api/chapters/', '/api/events/', '/api/chapters/timeline_data/'):
+            with self.subTest(path=path):
+                expected = json.loads(self.client.get(path).content)
+                response = self.client.get(path, HTTP_ACCEPT='application/msgpack')
+                self.assertEqual(response['Content-Type'], 'application/msgpack')
+                self.assertEqual(msgpack.unpackb(response.content), expected)
+                self.assertEqual(
+                    self.client.get(path, {'format': 'msgpack'}).content, response.content
+                )
+
+    def test_renderer_formats_like_json(self):
+        data = {'date': date(2020, 1, 2), 'decimal': Decimal('1.50'), 'lazy': gettext_lazy('Invalid token.')}
+        self.assertEqual(
+            msgpack.unpackb(MessagePackRenderer().render(data)),
+            json.loads(JSONRenderer().render(data)),
+        )
+
+    def test_bulk_accepts_msgpack(self):
+        body = msgpack.packb({'create': [{'title': 'Packed', 'date': '2020-01-01'}]})
+        response = self.client.post(
+            '/api/events/bulk/', body, content_type='application/msgpack',
+            HTTP_ACCEPT='application/msgpack',
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(msgpack.unpackb(response.content)['created'][0]['title'], 'Packed')
+
+        response = self.client.post('/api/events/bulk/', b'\xc1', content_type='application/msgpack')
+        self.assertEqual(response.status_code, 400)
+
+    def test_compression(self):
+        path = '/api/chapters/timeline_data/'
+        plain = self.client.get(path)
+        self.assertIn('Accept-Encoding', plain['Vary'])
+        self.assertIn('Accept', plain['Vary'])
+        self.assertNotIn('Content-Encoding', plain)
+
+        response = self.client.get(path, HTTP_ACCEPT_ENCODING='gzip')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertEqual(gzip.decompress(response.content), plain.content)
+        self.assertEqual(int(response['Content-Length']), len(response.content))
+        self.assertEqual(response['ETag'], 'W/' + plain['ETag'])
+
+        response = self.client.get(path, HTTP_ACCEPT_ENCODING='br;q=0.5, gzip', HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 304)
+
+        # Below COMPRESSION_MIN_SIZE
+        response = self.client.get('/api/events/?page_size=1&view=summary', HTTP_ACCEPT_ENCODING='gzip')
+        self.assertNotIn('Content-Encoding', response)
+
+
+class RequestMetricsTests(TestCase):
+    def setUp(self):
+        self.user = CustomUser.objects.create_user(email='reader@example.com', password='pw')
+        self.admin = CustomUser.objects.create_user(email='admin@example.com', password='pw', is_staff=True)
+        make_timeline(self.user, branches=1)
+        cache.clear()
+        request_metrics.reset()
+        self.addCleanup(request_metrics.reset)
+
+    def test_server_timing(self):
+        self.client.force_login(self.user)
+        for path in ('/api/chapters/timeline_data/', '/api/async/events/'):
+            with self.subTest(path=path):
+                with CaptureQueriesContext(connections['default']) as queries:
+                    response = self.client.get(path)
+                self.assertRegex(response['Server-Timing'], (
+                    rf'^db;dur=[\d.]+;desc="{len(queries)} queries", '
+                    r'view;dur=[\d.]+, render;dur=[\d.]+, total;dur=[\d.]+$'
+                ))
+
+    def test_metrics_are_admin_only(self):
+        self.assertEqual(self.client.get('/api/metrics/').status_code, 401)
+        self.client.force_login(self.user)
+        self.client.get('/api/chapters/timeline_data/')
+        self.client.get('/api/chapters/timeline_data/')
+        self.assertEqual(self.client.get('/api/metrics/').status_code, 403)
+
+        self.client.force_login(self.admin)
+        response = self.client.get('/api/metrics/')
+        self.assertEqual(response['Content-Type'], 'text/plain; version=0.0.4; charset=utf-8')
+        text = response.content.decode()
+        for line in (
+            'tree_requests_total{view="chapter-timeline-data",status="200"} 2',
+            'tree_requests_total{view="metrics",status="403"} 1',
+            'tree_request_duration_seconds_count{view="chapter-timeline-data",phase="total"} 2',
+            'tree_request_queries_count{view="chapter-timeline-data"} 2',
+            'tree_timeline_cache_hits_total 1',
+            '# TYPE tree_timeline_cache_misses_total counter',
+        ):
+            self.assertIn(line, text.splitlines())
+
+
+class BulkTests(TestCase):
+    URL = '/api/events/bulk/'
+
+    def setUp(self):
+        self.user = CustomUser.objects.create_user(email='reader@example.com', password='pw')
+        self.client.force_login(self.user)
+        self.chapter = Chapter.objects.create(user=self.user, title='Main', start_date=date(2000, 1, 1))
+        self.events = [
+            Event.objects.create(user=self.user, chapter=self.chapter, title=f'E{i}', date=date(2000, 1, i + 1))
+            for i in range(3)
+        ]
+
+    def bulk(self, data, url=URL):
+        return self.client.post(url, data, content_type='application/json')
+
+    def test_create_update_delete_together(self):
+        response = self.bulk({
+            'create': [{'title': 'New', 'date': '2000-02-01', 'chapter': self.chapter.pk}],
+            'update': [{'id': self.events[0].pk, 'title': 'Renamed', 'content': 'Longer now'}],
+            'delete': [self.events[1].pk],
+        })
+        self.assertEqual(response.status_code, 200)
+        body = response.json()
+        self.assertEqual([row['title'] for row in body['created']], ['New'])
+        self.assertEqual(body['updated'][0]['content'], 'Longer now')
+        self.assertEqual(body['deleted'], [self.events[1].pk])
+        self.assertEqual(
+            sorted(Event.objects.filter(user=self.user).values_list('title', flat=True)), ['E2', 'New', 'Renamed']
+        )
+        chapter = Chapter.objects.get(pk=self.chapter.pk)
+        self.assertEqual((chapter.entry_count, chapter.word_count), (3, 2))
+
+    def test_one_invalid_row_fails_the_batch(self):
+        response = self.bulk({
+            'create': [{'title': 'New', 'date': '2000-02-01'}, {'title': 'Undated'}],
+            'update': [{'id': self.events[0].pk, 'title': 'Renamed'}],
+            'delete': [self.events[1].pk],
+        })
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('date', response.json()['create'][1])
+        self.assertEqual(
+            list(Event.objects.filter(user=self.user).order_by('id').values_list('title', flat=True)), ['E0', 'E1', 'E2']
+        )
+
+        response = self.bulk({'update': [{'id': self.events[0].pk, 'title': ''}, {'id': self.events[1].pk, 'title': 'Fine'}]})
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(Event.objects.filter(title='Fine').exists())
+
+    def test_other_users_rows_are_out_of_reach(self):
+        other = CustomUser.objects.create_user(email='other@example.com', password='pw')
+        theirs = Chapter.objects.create(user=other, title='Theirs', start_date=date(2000, 1, 1))
+        their_event = Event.objects.create(user=other, chapter=theirs, title='Private', date=date(2000, 1, 2))
+
+        for data in ({'update': [{'id': their_event.pk, 'title': 'Mine'}]}, {'delete': [their_event.pk]}):
+            response = self.bulk(data)
+            self.assertEqual(response.status_code, 404)
+            self.assertEqual(response.json(), {'missing': [their_event.pk]})
+        # Nor can rows of this user point at theirs
+        response = self.bulk({
+            'create': [{'title': 'New', 'date': '2000-02-01', 'chapter': theirs.pk}],
+            'update': [{'id': self.events[0].pk, 'chapter': theirs.pk}],
+        })
+        self.assertEqual(response.status_code, 400)
+        response = self.client.post(
+            '/api/events/', {'title': 'New', 'date': '2000-02-01', 'chapter': theirs.pk}, content_type='application/json'
+        )
+        self.assertEqual(response.status_code, 400)
+
+        self.assertEqual(Event.objects.get(pk=their_event.pk).title, 'Private')
+        self.assertEqual(Chapter.objects.get(pk=theirs.pk).entry_count, 1)
+        self.assertEqual(Event.objects.filter(chapter=theirs).count(), 1)
+
+    def test_limit_and_query_count(self):
+        response = self.bulk({'delete': list(range(1, 1002))})
+        self.assertEqual(response.status_code, 400)
+
+        def queries(size):
+            data = {
+                'create': [{'title': f'N{i}', 'date': '2000-02-01', 'chapter': self.chapter.pk} for i in range(size)],
+                'update': [{'id': event.pk, 'order': size} for event in self.events[:2]],
+            }
+            with CaptureQueriesContext(connections['default']) as captured:
+                self.assertEqual(self.bulk(data).status_code, 200)
+            return len(captured)
+
+        self.assertEqual(queries(2), queries(40))
+
+
+class DeltaSyncTests(TestCase):
+    def setUp(self):
+        self.user = CustomUser.objects.create_user(email='reader@example.com', password='pw')
+        self.client.force_login(self.user)
+        self.chapter = Chapter.objects.create(user=self.user, title='Main', start_date=date(2000, 1, 1))
+        self.kept, self.gone = (
+            Event.objects.create(user=self.user, chapter=self.chapter, title=title, date=date(2000, 1, 2))
+            for title in ('Kept', 'Gone')
+        )
+
+    def changes(self, since=None, **params):
+        if since is not None:
+            params['since'] = since
+        return self.client.get('/api/changes/', params)
+
+    def test_changes_and_tombstones_since_a_cursor(self):
+        full = self.changes().json()
+        self.assertEqual(len(full['chapters']) + len(full['events']), 3)
+        cursor = full['cursor']
+        self.assertEqual(self.changes(cursor).json(), {
+            'cursor': cursor, 'more': False, 'chapters': [], 'events': [],
+            'deleted': {'chapters': [], 'events': []},
+        })
+
+        self.client.patch(f'/api/events/{self.kept.pk}/', {'title': 'Kept still'}, content_type='application/json')
+        self.client.delete(f'/api/events/{self.gone.pk}/')
+        delta = self.changes(cursor).json()
+        self.assertEqual([event['title'] for event in delta['events']], ['Kept still'])
+        self.assertEqual(delta['deleted'], {'chapters': [], 'events': [self.gone.pk]})
+        # The tombstone outlives the purge of the row
+        purge_deleted()
+        self.assertEqual(self.changes(cursor).json()['deleted']['events'], [self.gone.pk])
+
+        # Pages of `limit` changes, in change order, until `more` is false
+        seen, cursor, more = [], '0', True
+        while more:
+            page = self.changes(cursor, limit=1).json()
+            self.assertLessEqual(len(page['chapters'] + page['events'] + page['deleted']['events']), 1)
+            seen += [row['title'] for row in page['chapters'] + page['events']] + page['deleted']['events']
+            cursor, more = page['cursor'], page['more']
+        # The chapter changed last, when its entry count went down
+        self.assertEqual(seen, ['Kept still', self.gone.pk, 'Main'])
+        self.assertEqual(cursor, delta['cursor'])
+
+    def test_cursors_the_server_cannot_serve(self):
+        cursor = self.changes().json()['cursor']
+        self.client.delete(f'/api/events/{self.gone.pk}/')
+        self.assertEqual(prune_tombstones(), 0)
+        Tombstone.objects.update(deleted_at=datetime(2000, 1, 1, tzinfo=timezone.utc))
+        self.assertEqual(prune_tombstones(), 1)
+
+        # The deletion is gone from the log, so a client that had not seen it must start over
+        self.assertEqual(self.changes(cursor).status_code, 410)
+        current = self.changes().json()['cursor']
+        self.assertEqual(self.changes(current).status_code, 200)
+        self.assertEqual(self.changes(int(current) + 1).status_code, 410)
+        self.assertEqual(self.changes('soon').status_code, 400)
+
+
+class ExportTests(TestCase):
+    URL = '/api/export/'
+    # Past EVENT_CONTENT_COMPRESS_MIN, so the export inflates it
+    BODY = 'Long enough to be stored compressed. ' * 150
+
+    def setUp(self):
+        self.user = CustomUser.objects.create_user(email='reader@example.com', password='pw')
+        self.client.force_login(self.user)
+        make_timeline(self.user, branches=1, periods=1)
+        event = Event.objects.get(user=self.user, title='M0.0')
+        event.content = self.BODY
+        event.save()
+        other = CustomUser.objects.create_user(email='other@example.com', password='pw')
+        make_timeline(other, branches=0)
+
+    def body(self, response):
+        self.assertTrue(response.streaming)
+        return b''.join(response.streaming_content)
+
+    def test_ndjson_and_json(self):
+        response = self.client.get(self.URL)
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        self.assertRegex(response['Content-Disposition'], r'filename="tree-export-\d{8}\.ndjson"')
+        records = [json.loads(line) for line in self.body(response).decode().splitlines()]
+        meta, rows = records[0], records[1:]
+        self.assertEqual((meta['record'], meta['user']), ('meta', 'reader@example.com'))
+        kinds = [row.pop('record') for row in rows]
+        self.assertEqual(kinds, ['chapter'] * 4 + ['event'] * 7)
+        self.assertEqual(
+            sorted(row['title'] for row in rows[4:]),
+            sorted(Event.objects.filter(user=self.user).values_list('title', flat=True)),
+        )
+        self.assertEqual(next(row for row in rows if row['title'] == 'M0.0')['content'], self.BODY)
+
+        response = self.client.get(self.URL, {'format': 'json'})
+        self.assertEqual(response['Content-Type'], 'application/json')
+        document = json.loads(self.body(response))
+        self.assertEqual(document['meta']['version'], meta['version'])
+        self.assertEqual(document['chapters'] + document['events'], rows)
+
+    def test_gzip(self):
+        plain = self.body(self.client.get(self.URL, {'format': 'json'}))
+        response = self.client.get(self.URL, {'format': 'json', 'gzip': '1'})
+        self.assertEqual(response['Content-Type'], 'application/gzip')
+        self.assertTrue(response['Content-Disposition'].endswith('.json.gz"'))
+        document = json.loads(gzip.decompress(self.body(response)))
+        expected = json.loads(plain)
+        del document['meta']['exported_at'], expected['meta']['exported_at']
+        self.assertEqual(document, expected)
+
+    def test_requires_a_user(self):
+        self.client.logout()
+        self.assertEqual(self.client.get(self.URL).status_code, 401)
+
+
+class ImportTests(TestCase):
+    TIMELINE = {
+        'mainTimeline': [{
+            'id': 1, 'title': 'School', 'startDate': '2000-01-01', 'color': '#10B981',
+            'entries': [{'id': 10, 'title': 'First day', 'date': '2000-01-02', 'content': 'Rain'}],
+        }],
+        'branches': [{
+            'id': 2, 'name': 'Music', 'sourceEntryId': 10,
+            'directEntries': [{'id': 11, 'title': 'Piano', 'date': '2000-03-01'}],
+        }],
+    }
+
+    def setUp(self):
+        self.user = CustomUser.objects.create_user(email='reader@example.com', password='pw')
+        self.client.force_login(self.user)
+
+    def post(self, data, **extra):
+        return self.client.post('/api/import/', data, content_type='application/json', **extra)
+
+    def test_reimport_skips_known_ids(self):
+        response = self.post(self.TIMELINE)
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.json(), {
+            'chapters_created': 2, 'chapters_skipped': 0, 'events_created': 2, 'events_skipped': 0,
+        })
+        branch = Chapter.objects.get(user=self.user, type='branch')
+        self.assertEqual(branch.source_entry.title, 'First day')
+
+        response = self.post(self.TIMELINE)
+        self.assertEqual(response.json(), {
+            'chapters_created': 0, 'chapters_skipped': 2, 'events_created': 0, 'events_skipped': 2,
+        })
+        self.assertEqual((Chapter.objects.count(), Event.objects.count()), (2, 2))
+
+        # An export of the journal imports into another account as is
+        export = b''.join(self.client.get('/api/export/?format=ndjson').streaming_content)
+        other = CustomUser.objects.create_user(email='other@example.com', password='pw')
+        self.client.force_login(other)
+        response = self.client.post('/api/import/', export, content_type='application/x-ndjson')
+        self.assertEqual(response.json()['events_created'], 2)
+        self.assertEqual(Event.objects.get(user=other, title='First day').content, 'Rain')
+
+    def test_invalid_rows_are_reported_with_their_path(self):
+        bad = [
+            ({'mainTimeline': [{'title': 'x' * 256, 'startDate': '2000-01-01'}]}, 'mainTimeline[0]: title'),
+            ({'branches': [{'name': 'Music', 'color': '#1234567'}]}, 'branches[0]: color'),
+            ([{'record': 'chapter', 'title': 'Loose', 'type': 'chapter', 'start_date': '2000-01-01'}], 'record 0: type'),
+            ({'mainTimeline': [{'title': 'School', 'startDate': '2000-01-01', 'entries': [
+                {'title': 'Day', 'date': 'soon'},
+            ]}]}, 'mainTimeline[0].entries[0]: invalid date'),
+        ]
+        for data, error in bad:
+            response = self.post(data)
+            self.assertEqual(response.status_code, 400, error)
+            self.assertTrue(response.json()['error'].startswith(error), response.json())
+        self.assertFalse(Chapter.objects.exists())
+
+
+class SoftDeleteTests(TestCase):
+    def setUp(self):
+        self.user = CustomUser.objects.create_user(email='reader@example.com', password='pw')
+        make_timeline(self.user, branches=1, periods=3, entries=5)
+        self.branch = Chapter.objects.get(user=self.user, type='branch')
+        self.client.force_login(self.user)
+
+    def test_delete_hides_subtree_then_purge_removes_it(self):
+        periods = list(self.branch.periods.values_list('id', flat=True))
+        events = list(Event.objects.filter(chapter_id__in=periods).values_list('id', flat=True))
+
+        # Constant whatever the subtree: session, user, the lookup, savepoint,
+        # select + update, reserve + tombstones, chapter version, release
+        with self.assertNumQueries(10):
+            response = self.client.delete(f'/api/chapters/{self.branch.pk}/')
+        self.assertEqual(response.status_code, 204)
+
+        self.assertFalse(Chapter.objects.filter(pk__in=[self.branch.pk, *periods]).exists())
+        self.assertEqual(Chapter.all_objects.filter(pk__in=[self.branch.pk, *periods]).count(), 4)
+        self.assertEqual(
+            set(Tombstone.objects.filter(kind='chapter').values_list('object_id', flat=True)),
+            {self.branch.pk, *periods},
+        )
+        self.assertEqual(self.client.get(f'/api/chapters/{self.branch.pk}/').status_code, 404)
+
+        self.assertEqual(purge_deleted(batch_size=2), {'chapters': 4, 'events': 0, 'tombstones': 0})
+        self.assertFalse(Chapter.all_objects.filter(pk__in=[self.branch.pk, *periods]).exists())
+        # Entries outlive their chapter, as with SET_NULL
+        self.assertEqual(Event.objects.filter(pk__in=events, chapter__isnull=True).count(), len(events))
+
+    def test_event_delete_takes_spawned_branches(self):
+        event = Event.objects.filter(user=self.user, chapter__type='main_period').first()
+        Chapter.objects.filter(pk=self.branch.pk).update(source_entry=event)
+
+        response = self.client.delete(f'/api/events/{event.pk}/')
+        self.assertEqual(response.status_code, 204)
+        self.assertFalse(Event.objects.filter(pk=event.pk).exists())
+        self.assertFalse(Chapter.objects.filter(user=self.user, type__startswith='branch').exists())
+
+        self.assertEqual(purge_deleted(), {'chapters': 4, 'events': 1, 'tombstones': 0})
+        self.assertFalse(Event.all_objects.filter(pk=event.pk).exists())
+
+
+class LineageTests(TestCase):
+    def setUp(self):
+        self.user = CustomUser.objects.create_user(email='reader@example.com', password='pw')
+        make_timeline(self.user, branches=2, periods=2, entries=1)
+        self.main = Chapter.objects.filter(user=self.user, type='main_period').first()
+        self.branch, self.other = Chapter.objects.filter(user=self.user, type='branch').order_by('id')
+        self.period = self.branch.periods.order_by('id').first()
+        self.client.force_login(self.user)
+
+    def closure(self):
+        return set(ChapterLineage.objects.values_list('ancestor_id', 'descendant_id', 'depth'))
+
+    def tree(self):
+        """The closure worked out by walking the references"""
+        parents = {}
+        for chapter in Chapter.all_objects.select_related('source_entry'):
+            source = chapter.source_entry
+            parents[chapter.pk] = (
+                chapter.parent_branch_id
+                or (source and (source.chapter_id or source.branch_id))
+                or chapter.source_chapter_id
+            )
+        rows = set()
+        for pk in parents:
+            node, depth = pk, 0
+            while node is not None:
+                rows.add((node, pk, depth))
+                node, depth = parents[node], depth + 1
+        return rows
+
+    def test_maintained_on_create_and_move(self):
+        self.assertEqual(self.closure(), self.tree())
+        # Spawn the branch from an entry of a main period, then from a period of the other branch
+        entry = self.main.entries.first()
+        self.branch.source_entry = entry
+        self.branch.save()
+        self.assertEqual(self.closure(), self.tree())
+        entry.chapter = self.other.periods.first()
+        entry.save()
+        self.assertEqual(self.closure(), self.tree())
+
+        with self.assertNumQueries(1):
+            crumbs = [chapter.pk for chapter in ancestry(self.period.pk)]
+        self.assertEqual(crumbs, [self.other.pk, entry.chapter_id, self.branch.pk, self.period.pk])
+        with self.assertNumQueries(1):
+            below = {chapter.pk: chapter.depth for chapter in subtree(self.other.pk)}
+        self.assertEqual(below[self.period.pk], 3)
+
+        response = self.client.get(f'/api/chapters/{self.period.pk}/ancestors/')
+        self.assertEqual([row['id'] for row in response.json()], crumbs)
+        response = self.client.get(f'/api/chapters/{self.other.pk}/subtree/')
+        self.assertEqual({row['id']: row['depth'] for row in response.json()}, below)
+
+    def test_cycles_are_rejected(self):
+        self.other.source_chapter = self.period
+        self.other.save()
+        closure = self.closure()
+
+        response = self.client.patch(
+            f'/api/chapters/{self.branch.pk}/', {'source_chapter': self.other.pk}, content_type='application/json'
+        )
+        self.assertEqual(response.status_code, 400)
+        entry = self.period.entries.first()
+        response = self.client.patch(
+            f'/api/chapters/{self.branch.pk}/', {'source_entry': entry.pk}, content_type='application/json'
+        )
+        self.assertEqual(response.status_code, 400)
+
+        # An entry cannot move below a branch spawned from it
+        self.branch.source_entry = self.main.entries.first()
+        self.branch.save()
+        response = self.client.patch(
+            f'/api/events/{self.branch.source_entry_id}/', {'chapter': self.period.pk}, content_type='application/json'
+        )
+        self.assertEqual(response.status_code, 400)
+        response = self.client.post(
+            '/api/chapters/bulk/', {'update': [{'id': self.branch.pk, 'source_entry': entry.pk}]},
+            content_type='application/json',
+        )
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(self.closure(), self.tree())
+        self.assertNotEqual(self.closure(), closure)
+
+    def test_subtree_delete_and_purge(self):
+        self.other.source_chapter = self.period
+        self.other.save()
+        response = self.client.delete(f'/api/chapters/{self.branch.pk}/subtree/')
+        self.assertEqual(response.status_code, 204)
+        self.assertEqual(list(Chapter.objects.filter(user=self.user, type__startswith='branch')), [])
+        self.assertFalse(Event.objects.filter(branch__isnull=False).exists())
+
+        # Purging one branch leaves what hung off it as a root with its own subtree
+        Chapter.all_objects.filter(pk=self.other.pk).update(deleted_at=None)
+        Chapter.all_objects.filter(parent_branch=self.other).update(deleted_at=None)
+        purge_deleted()
+        self.assertEqual(self.closure(), self.tree())
+        self.assertEqual({chapter.pk for chapter in ancestry(self.other.pk)}, {self.other.pk})
+        self.assertEqual(subtree(self.other.pk).count(), 3)
+
+
+    def test_hard_deletes(self):
+        # main <- branch (source_chapter) <- other (source_chapter), and a branch spawned from an entry of other
+        self.branch.source_chapter = self.main
+        self.branch.save()
+        self.other.source_chapter = self.branch
+        self.other.save()
+        entry = self.other.periods.first().entries.first()
+        spawned = Chapter.objects.create(
+            user=self.user, type='branch', title='Spawned', start_date=date(2012, 1, 1), source_entry=entry
+        )
+        self.assertIn(spawned.pk, subtree(self.main.pk).values_list('id', flat=True))
+
+        Chapter.objects.get(pk=self.branch.pk).delete()
+        self.assertIsNone(Chapter.objects.get(pk=self.other.pk).source_chapter_id)
+        self.assertEqual(self.closure(), self.tree())
+        self.assertEqual([chapter.pk for chapter in subtree(self.main.pk)], [self.main.pk])
+        self.assertEqual([chapter.pk for chapter in ancestry(spawned.pk)][0], self.other.pk)
+
+        entry.delete()
+        self.assertEqual(self.closure(), self.tree())
+        self.assertEqual([chapter.pk for chapter in ancestry(spawned.pk)], [spawned.pk])
+        # So a subtree delete of its former ancestor leaves it alone
+        self.client.delete(f'/api/chapters/{self.other.pk}/subtree/')
+        self.assertTrue(Chapter.objects.filter(pk=spawned.pk).exists())
+
+
+class AggregateTests(TestCase):
+    def setUp(self):
+        self.user = CustomUser.objects.create_user(email='reader@example.com', password='pw')
+        make_timeline(self.user, branches=1, periods=1, entries=3)
+        self.main = Chapter.objects.filter(user=self.user, type='main_period').order_by('id').first()
+        self.period = Chapter.objects.get(user=self.user, type='branch_period')
+        self.client.force_login(self.user)
+
+    def numbers(self, chapter):
+        return Chapter.objects.filter(pk=chapter.pk).values_list(
+            'entry_count', 'word_count', 'first_entry_date', 'last_entry_date'
+        ).get()
+
+    def test_kept_current_as_entries_change(self):
+        self.assertEqual(self.numbers(self.main), (3, 0, date(2000, 2, 1), date(2000, 2, 3)))
+
+        response = self.client.post('/api/events/', {
+            'title': 'New', 'content': 'three more words', 'date': '1999-12-31', 'chapter': self.main.pk,
+        }, content_type='application/json')
+        event = Event.objects.get(pk=response.json()['id'])
+        self.assertEqual(self.numbers(self.main), (4, 3, date(1999, 12, 31), date(2000, 2, 3)))
+
+        # Moving the first entry re-reads the first date
+        self.client.patch(f'/api/events/{event.pk}/', {'chapter': self.period.pk}, content_type='application/json')
+        self.assertEqual(self.numbers(self.main), (3, 0, date(2000, 2, 1), date(2000, 2, 3)))
+        self.assertEqual(self.numbers(self.period)[:2], (4, 3))
+
+        response = self.client.post('/api/events/bulk/', {
+            'create': [{'title': 'Late', 'content': 'a b', 'date': '2030-01-01', 'chapter': self.main.pk}],
+            'update': [{'id': event.pk, 'content': 'one', 'chapter': self.main.pk}],
+        }, content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.numbers(self.main), (5, 3, date(1999, 12, 31), date(2030, 1, 1)))
+
+        self.client.delete(f'/api/events/{event.pk}/')
+        last = self.main.entries.get(title='Late')
+        last.delete()
+        self.assertEqual(self.numbers(self.main), (3, 0, date(2000, 2, 1), date(2000, 2, 3)))
+        self.assertEqual(check_aggregates(), {})
+
+        # Headers straight from the chapter rows
+        response = self.client.get('/api/chapters/', {'fields': 'id,entry_count,first_entry_date'})
+        self.assertIn({'id': self.main.pk, 'entry_count': 3, 'first_entry_date': '2000-02-01'}, response.json()['results'])
+
+    def test_subtree_delete_and_rebuild(self):
+        branch = self.period.parent_branch
+        event = self.period.entries.first()
+        event.branch = branch
+        event.save()
+        response = self.client.delete(f'/api/chapters/{self.period.pk}/subtree/')
+        self.assertEqual(response.status_code, 204)
+        self.assertEqual(self.numbers(branch)[0], 1)
+        self.assertEqual(check_aggregates(Chapter.objects.all()), {})
+
+        Chapter.objects.filter(pk=self.main.pk).update(entry_count=7, last_entry_date=None)
+        with self.assertRaises(CommandError):
+            call_command('rebuild_aggregates', '--verify', stdout=io.StringIO())
+        call_command('rebuild_aggregates', stdout=io.StringIO())
+        self.assertEqual(self.numbers(self.main), (3, 0, date(2000, 2, 1), date(2000, 2, 3)))
+        call_command('rebuild_aggregates', '--verify', stdout=io.StringIO())
+
+
+class SearchTests(TestCase):
+    URL = '/api/events/search/'
+
+    def setUp(self):
+        self.user = CustomUser.objects.create_user(email='reader@example.com', password='pw')
+        self.client.force_login(self.user)
+
+    def add(self, title, content='', user=None):
+        return Event.objects.create(user=user or self.user, title=title, date=date(2000, 1, 2), content=content)
+
+    def search(self, q, **params):
+        response = self.client.get(self.URL, {'q': q, **params})
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_title_matches_rank_first(self):
+        body = self.add('Sunday', 'We walked to the harbour and back')
+        title = self.add('Harbour', 'Nothing else')
+        self.add('Walk', 'Unrelated')
+        results = self.search('harbour')['results']
+        self.assertEqual([row['id'] for row in results], [title.pk, body.pk])
+        self.assertGreater(results[0]['rank'], results[1]['rank'])
+        self.assertIn('<mark>harbour</mark>', results[1]['snippet'])
+
+        # The last word matches as a prefix; FTS syntax and markup stay inert
+        self.assertEqual([row['id'] for row in self.search('harb')['results']], [title.pk, body.pk])
+        self.assertEqual(self.search('harbour OR NOT "')['results'], [])
+        markup = self.add('Notes', '<script>alert(1)</script> harbour')
+        snippet = next(row for row in self.search('harbour')['results'] if row['id'] == markup.pk)['snippet']
+        self.assertIn('&lt;script&gt;', snippet)
+
+    def test_scoped_to_the_user(self):
+        other = CustomUser.objects.create_user(email='other@example.com', password='pw')
+        self.add('Harbour', user=other)
+        mine = self.add('Harbour')
+        gone = self.add('Harbour')
+        self.client.delete(f'/api/events/{gone.pk}/')
+        self.assertEqual([row['id'] for row in self.search('harbour')['results']], [mine.pk])
+
+        self.client.logout()
+        self.assertEqual(self.client.get(self.URL, {'q': 'harbour'}).status_code, 401)
+
+    def test_pages(self):
+        ids = [self.add(f'Harbour {i}').pk for i in range(5)]
+        first = self.search('harbour', page_size=2)
+        second = self.client.get(first['next']).json()
+        third = self.client.get(second['next']).json()
+        self.assertIsNone(first['previous'])
+        self.assertIsNone(third['next'])
+        self.assertEqual(
+            [row['id'] for page in (first, second, third) for row in page['results']], ids
+        )
+        self.assertEqual(self.client.get(third['previous']).json(), second)
+        self.assertEqual(self.client.get(self.URL, {'q': 'harbour', 'page': 'two'}).status_code, 400)
+
+
+class EventContentTests(TestCase):
+    # Long enough to be stored compressed
+    LONG = ' '.join(['walrus ocean harbour'] * 400)
+
+    def setUp(self):
+        self.user = CustomUser.objects.create_user(email='reader@example.com', password='pw')
+        self.chapter = Chapter.objects.create(user=self.user, title='Main', start_date=date(2000, 1, 1))
+        self.client.force_login(self.user)
+
+    def hits(self, text):
+        return [result['id'] for result in search_events(self.user, text)]
+
+    def test_bodies_round_trip_and_stay_searchable(self):
+        event = Event.objects.create(user=self.user, chapter=self.chapter, title='Walk', date=date(2000, 1, 2), content=self.LONG)
+        body = EventContent.objects.get(pk=event.pk)
+        self.assertEqual((body.text, body.encoding), ('', 'zlib'))
+        self.assertLess(len(body.data), len(self.LONG) // 10)
+        event = Event.objects.get(pk=event.pk)
+        self.assertEqual((event.content, event.word_count), (self.LONG, 1200))
+        self.assertEqual(self.hits('walrus'), [event.pk])
+
+        event.content = 'quiet kettle'
+        event.save()
+        self.assertEqual((self.hits('walrus'), self.hits('kettle')), ([], [event.pk]))
+        event.title = 'Lighthouse'
+        event.save(update_fields=['title'])
+        self.assertEqual(self.hits('lighthouse kettle'), [event.pk])
+
+        response = self.client.post('/api/events/bulk/', {
+            'create': [{'title': 'Bare', 'date': '2000-01-03', 'chapter': self.chapter.pk}],
+            'update': [{'id': event.pk, 'content': self.LONG}],
+        }, content_type='application/json')
+        self.assertEqual(response.json()['updated'][0]['content'], self.LONG)
+        self.assertEqual(EventContent.objects.count(), 2)
+        self.assertEqual((self.hits('walrus'), self.hits('kettle')), ([event.pk], []))
+
+        self.client.delete(f'/api/events/{event.pk}/')
+        self.assertEqual(self.hits('walrus'), [])
+        purge_deleted()
+        self.assertEqual(EventContent.objects.count(), 1)
+        with connections['default'].cursor() as cursor:
+            cursor.execute("INSERT INTO myapp_event_fts(myapp_event_fts, rank) VALUES ('integrity-check', 1)")
+
+    @skipUnless(connections['default'].vendor == 'sqlite', 'FTS5 index')
+    def test_index_is_kept_without_python_functions(self):
+        # As in the sqlite3 shell or a restore, where myapp_inflate() is unknown
+        plain = Event.objects.create(user=self.user, title='Walk', date=date(2000, 1, 2), content='quiet kettle')
+        packed = Event.objects.create(user=self.user, title='Sea', date=date(2000, 1, 2), content=self.LONG)
+        connection = connections['default']
+        connection.connection.create_function('myapp_inflate', 3, None)
+        self.addCleanup(register_functions, connection)
+        with connection.cursor() as cursor:
+            cursor.execute("UPDATE myapp_eventcontent SET text = 'lantern' WHERE event_id = %s", [plain.pk])
+            cursor.execute("UPDATE myapp_event SET title = 'Stroll' WHERE id = %s", [packed.pk])
+            cursor.execute("DELETE FROM myapp_eventcontent WHERE event_id = %s", [packed.pk])
+        self.assertEqual((self.hits('lantern'), self.hits('kettle')), ([plain.pk], []))
+        self.assertEqual((self.hits('stroll'), self.hits('walrus')), ([packed.pk], []))
+
+    def test_bodies_are_read_only_when_asked_for(self):
+        Event.objects.create(user=self.user, chapter=self.chapter, title='Walk', date=date(2000, 1, 2), content=self.LONG)
+        for path in ('/api/events/?view=summary', '/api/chapters/timeline_data/?view=summary'):
+            with CaptureQueriesContext(connections['default']) as queries:
+                self.assertNotIn(self.LONG, self.client.get(path).content.decode())
+            self.assertFalse([query for query in queries if 'eventcontent' in query['sql']], path)
+        for path in ('/api/events/', '/api/chapters/timeline_data/', '/api/changes/'):
+            self.assertIn(self.LONG, self.client.get(path).content.decode())
+        export = b''.join(self.client.get('/api/export/').streaming_content).decode()
+        self.assertIn(self.LONG, export)
+
+
+class PeriodIndexTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = CustomUser.objects.create_user(email='reader@example.com', password='pw')
+        self.client.force_login(self.user)
+        self.early = Chapter.objects.create(
+            user=self.user, title='Early', start_date=date(2000, 1, 1), end_date=date(2000, 6, 1)
+        )
+        self.late = Chapter.objects.create(user=self.user, title='Late', start_date=date(2000, 6, 1))
+        self.branch = Chapter.objects.create(user=self.user, type='branch', title='Branch', start_date=date(2000, 1, 1))
+        self.period = Chapter.objects.create(
+            user=self.user, type='branch_period', parent_branch=self.branch, title='Abroad',
+            start_date=date(2000, 3, 1), end_date=date(2000, 8, 1),
+        )
+
+    def create(self, **data):
+        response = self.client.post('/api/events/', {'title': 'Entry', **data}, content_type='application/json')
+        return response.json()['chapter']
+
+    def test_entries_land_in_the_period_covering_their_date(self):
+        self.assertEqual(self.create(date='2000-02-01'), self.early.pk)
+        # The boundary day goes to the period starting on it
+        self.assertEqual(self.create(date='2000-06-01'), self.late.pk)
+        self.assertEqual(self.create(date='1999-01-01'), None)
+        self.assertEqual(self.create(date='2000-04-01', branch=self.branch.pk), self.period.pk)
+        # An explicit null keeps the entry directly on the branch
+        self.assertEqual(self.create(date='2000-04-01', branch=self.branch.pk, chapter=None), None)
+
+        response = self.client.post('/api/events/bulk/', {'create': [
+            {'title': 'A', 'date': '2000-03-01'},
+            {'title': 'B', 'date': '2001-03-01'},
+            {'title': 'C', 'date': '2000-03-01', 'chapter': self.late.pk},
+        ]}, content_type='application/json')
+        self.assertEqual(
+            [row['chapter'] for row in response.json()['created']], [self.early.pk, self.late.pk, self.late.pk]
+        )
+        self.assertEqual(Chapter.objects.get(pk=self.early.pk).entry_count, 2)
+
+        # The index is rebuilt after a chapter changes, not after an entry
+        with CaptureQueriesContext(connections['default']) as queries:
+            self.create(date='2000-02-01')
+        self.assertFalse([query for query in queries if 'main_period' in query['sql']])
+        self.client.patch(f'/api/chapters/{self.early.pk}/', {'end_date': '2000-01-31'}, content_type='application/json')
+        self.assertEqual(self.create(date='2000-02-01'), None)
+
+    def test_changes_made_elsewhere_retire_the_index(self):
+        self.assertEqual(self.create(date='2000-02-01'), self.early.pk)
+        # Another worker or a management command, whose cache this one never hears from
+        with mock.patch.object(cache, 'delete'), mock.patch.object(cache, 'delete_many'):
+            self.client.delete(f'/api/chapters/{self.early.pk}/')
+            purge_deleted()
+        self.assertEqual(self.create(date='2000-02-01'), None)
+
+        with mock.patch.object(cache, 'delete'), mock.patch.object(cache, 'delete_many'):
+            importer = TimelineImporter(self.user)
+            importer.load({'mainTimeline': [{'title': 'Imported', 'startDate': '2000-01-15', 'endDate': '2000-03-01'}]})
+            importer.run()
+        imported = Chapter.objects.get(user=self.user, title='Imported')
+        self.assertEqual(self.create(date='2000-02-01'), imported.pk)
+
+    def test_active_and_overlaps(self):
+        response = self.client.get('/api/chapters/active/', {'date': '2000-06-01'})
+        self.assertEqual([row['id'] for row in response.json()], [self.late.pk, self.period.pk, self.early.pk])
+        response = self.client.get('/api/chapters/active/', {'date': '2000-06-01', 'branch': self.branch.pk})
+        self.assertEqual([row['title'] for row in response.json()], ['Abroad'])
+        self.assertEqual(self.client.get('/api/chapters/active/').status_code, 400)
+
+        # Consecutive periods and periods of different timelines do not overlap
+        self.assertEqual(self.client.get('/api/chapters/overlaps/').json(), [])
+        inner = Chapter.objects.create(
+            user=self.user, title='Inner', start_date=date(2000, 5, 1), end_date=date(2000, 7, 1)
+        )
+        self.assertEqual(self.client.get('/api/chapters/overlaps/').json(), [
+            {'chapters': [self.early.pk, inner.pk], 'first': '2000-05-01', 'last': '2000-06-01'},
+            {'chapters': [inner.pk, self.late.pk], 'first': '2000-06-01', 'last': '2000-07-01'},
+        ])
+        self.client.delete(f'/api/chapters/{inner.pk}/')
+        self.assertEqual(self.client.get('/api/chapters/overlaps/').json(), [])
+
+
+class ReplicaRouterTests(TestCase):
+    def test_reads_follow_reads_from(self):
+        router = ReplicaRouter()
+        event = Event(title='x', date=date(2020, 1, 1))
+        event._state.db = 'default'
+        self.assertIsNone(router.db_for_read(Event))
+        # TestCase runs in a transaction, so set one aside to see the routing
+        connection = connections['default']
+        in_atomic_block, connection.in_atomic_block = connection.in_atomic_block, False
+        try:
+            with reads_from('replica'):
+                self.assertEqual(router.db_for_read(Event), 'replica')
+                self.assertEqual(router.db_for_read(Chapter, instance=event), 'default')
+        finally:
+            connection.in_atomic_block = in_atomic_block
+        with reads_from('replica'), transaction.atomic():
+            self.assertIsNone(router.db_for_read(Event))
+        self.assertEqual(router.db_for_write(Event), 'default')
+
+
+class ReplicaReadsTests(TransactionTestCase):
+    # Adds a 'replica' alias mirroring the default database (the settings
+    # give one when DB_REPLICA_PATH or DB_REPLICA_HOST is set)
+    databases = '__all__'
+
+    @classmethod
+    def setUpClass(cls):
+        if 'replica' not in connections.settings:
+            connections.settings['replica'] = {**connections['default'].settings_dict, 'TEST': {'MIRROR': 'default'}}
+            cls.addClassCleanup(cls.drop_replica)
+        super().setUpClass()
+
+    @classmethod
+    def drop_replica(cls):
+        connections['replica'].close()
+        del connections['replica']
+        del connections.settings['replica']
+
+    def setUp(self):
+        cache.clear()
+        self.user = CustomUser.objects.create_user(email='reader@example.com', password='pw')
+        self.client.force_login(self.user)
+
+    def replica_queries(self, path):
+        with CaptureQueriesContext(connections['replica']) as queries:
+            self.assertEqual(self.client.get(path).status_code, 200)
+        return len(queries)
+
+    def test_writer_reads_from_primary_until_pin_expires(self):
+        response = self.client.post('/api/events/', {'title': 'New', 'date': '2020-01-01'})
+        self.assertEqual(response.status_code, 201)
+        for path in ('/api/events/', '/api/chapters/timeline_data/', '/api/export/'):
+            with self.subTest(path=path):
+                self.assertEqual(self.replica_queries(path), 0)
+
+        cache.clear()
+        for path in ('/api/events/', '/api/chapters/timeline_data/', '/api/events/search/?q=new'):
+            with self.subTest(path=path):
+                self.assertGreater(self.replica_queries(path), 0)
+        # Streamed after the view returned
+        with CaptureQueriesContext(connections['replica']) as queries:
+            b''.join(self.client.get('/api/export/').streaming_content)
+        self.assertGreater(len(queries), 0)
+        # Reads that are not listed stay on the primary
+        event = Event.objects.get(title='New')
+        self.assertEqual(self.replica_queries(f'/api/events/{event.pk}/'), 0)
+
+    def test_routing_ends_with_the_request(self):
+        with mock.patch('myapp.views.event_views.search_events', side_effect=RuntimeError):
+            with self.assertRaises(RuntimeError):
+                self.client.get('/api/events/search/?q=new')
+        self.assertIsNone(ReplicaRouter().db_for_read(Event))
+        self.assertGreater(self.replica_queries('/api/events/'), 0)
@@ -0,0 +1,142 @@
+# timeline.py
+import asyncio
+
+from django.db.models import Q
+
+from .models import Chapter, Event
+from .rows import ChapterRows, ChapterTree, EventRows
+from .serializers import EventSerializer
+
+
+class TimelineBuilder:
+    """
+    Builds the timeline_data document from two flat queries.
+
+    Chapters and events are read once each as values() rows, grouped by parent
+    in a single pass and then stitched into the main_timeline/branches tree, so
+    the query count does not depend on how many branches or periods exist.
+    The output matches ChapterSerializer/EventSerializer.
+
+    Passing start/end limits the document to periods overlapping that date
+    window and the events inside it (branches themselves are always kept, they
+    are only containers). Passing branch limits it to that branch.
+
+    event_fields selects which event fields are emitted; columns that are not
+    needed (e.g. content for summary views) are never read from the database.
+
+    With stubs=True (?stubs=1), collapsed chapters are stubs (see
+    ChapterTree): the periods of collapsed branches and the events only
+    collapsed chapters hold are not read at all, so the cost follows what is
+    open. Clients fetch their content on demand from ChapterViewSet.expand.
+    """
+
+    def __init__(self, user, start=None, end=None, branch=None, event_fields=None, stubs=False):
+        self.user = user
+        self.start = start
+        self.end = end
+        self.branch = branch
+        self.event_fields = event_fields
+        self.stubs = stubs
+
+    def chapter_rows(self):
+        qs = Chapter.objects.filter(user=self.user)
+        if self.stubs:
+            qs = qs.exclude(parent_branch__collapsed=True)
+        if self.branch is not None:
+            qs = qs.filter(Q(id=self.branch) | Q(parent_branch_id=self.branch))
+        window = Q()
+        if self.end is not None:
+            window &= Q(start_date__lte=self.end)
+        if self.start is not None:
+            window &= Q(end_date__gte=self.start) | Q(end_date__isnull=True)
+        if window:
+            qs = qs.filter(Q(type='branch') | window)
+        return qs.order_by('order', 'start_date', 'id').values(*ChapterRows().values())
+
+    def event_rows(self):
+        if self.stubs:
+            # Events of open chapters, found through the chapters so that their
+            # indexes, not a scan of all the user's events, drive the read
+            visible = open_chapters(self.user)
+            qs = Event.objects.filter(Q(chapter_id__in=visible) | Q(branch_id__in=visible))
+        else:
+            qs = Event.objects.filter(user=self.user)
+        if self.branch is not None:
+            qs = qs.filter(
+                Q(branch_id=self.branch)
+                | Q(chapter_id=self.branch)
+                | Q(chapter__parent_branch_id=self.branch)
+            )
+        if self.start is not None:
+            qs = qs.filter(date__gte=self.start)
+        if self.end is not None:
+            qs = qs.filter(date__lte=self.end)
+        events = EventRows(self.event_fields)
+        columns = {'chapter_id', 'branch_id', *events.values()}
+        return events.annotate(qs).order_by('date', 'order', 'id').values(*columns)
+
+    def build(self):
+        return self.assemble(self.chapter_rows(), self.event_rows())
+
+    async def abuild(self):
+        """build() on the async ORM, reading chapters and events concurrently"""
+        async def fetch(queryset):
+            return [row async for row in queryset.aiterator()]
+
+        chapter_rows, event_rows = await asyncio.gather(
+            fetch(self.chapter_rows()), fetch(self.event_rows())
+        )
+        return self.assemble(chapter_rows, event_rows)
+
+    def assemble(self, chapter_rows, event_rows):
+        """Group the flat rows into the main_timeline/branches document"""
+        main_timeline = []
+        branches = []
+        periods = []
+        for row in chapter_rows:
+            if row['id'] == self.branch:
+                branches.append(row)
+            elif row['parent_branch_id'] is not None:
+                periods.append(row)
+            elif row['type'] == 'main_period':
+                main_timeline.append(row)
+            elif row['type'] == 'branch':
+                branches.append(row)
+
+        tree = ChapterTree(event_rows, periods, event_fields=self.event_fields, stubs=self.stubs)
+        return {
+            'main_timeline': [tree.chapter(row) for row in main_timeline],
+            'branches': [tree.chapter(row) for row in branches],
+        }
+
+
+def open_chapters(user):
+    """Ids of the user's chapters that are not collapsed, nor periods of a collapsed branch"""
+    return (
+        Chapter.objects.filter(user=user, collapsed=False)
+        .exclude(parent_branch__collapsed=True)
+        .values('id')
+    )
+
+
+def event_fields_for(summary=False, fields=None):
+    """Event fields to emit for ?view=summary and/or ?fields=a,b,c"""
+    names = list(EventRows.columns)
+    if summary:
+        names = [name for name in names if name not in EventSerializer.Meta.summary_exclude]
+    if fields:
+        names = [name for name in names if name in fields]
+    return names
+
+
+def build_timeline(user, start=None, end=None, branch=None, event_fields=None, stubs=False):
+    """Serialize the user's main timeline and top-level branches"""
+    return TimelineBuilder(
+        user, start=start, end=end, branch=branch, event_fields=event_fields, stubs=stubs
+    ).build()
+
+
+async def abuild_timeline(user, start=None, end=None, branch=None, event_fields=None, stubs=False):
+    return await TimelineBuilder(
+        user, start=start, end=end, branch=branch, event_fields=event_fields, stubs=stubs
+    ).abuild()
@@ -1,12 +1,25 @@
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
+from .views import async_views
 from .views.event_views import ChapterViewSet, EventViewSet
+from .views.export_views import export_journal
+from .views.import_views import import_timeline
+from .views.metrics_views import metrics
+from .views.sync_views import changes
 
 router = DefaultRouter()
 router.register(r'chapters', ChapterViewSet, basename='chapter')
 router.register(r'events', EventViewSet, basename='event')
 
 urlpatterns = [
+    # Async read endpoints, see views.async_views
+    path('async/chapters/', async_views.chapter_list, name='async-chapter-list'),
+    path('async/chapters/timeline_data/', async_views.timeline_data, name='async-chapter-timeline-data'),
+    path('async/events/', async_views.event_list, name='async-event-list'),
+    path('changes/', changes, name='changes'),
+    path('export/', export_journal, name='export'),
+    path('import/', import_timeline, name='import'),
+    path('metrics/', metrics, name='metrics'),
     path('', include(router.urls)),
 ]
 
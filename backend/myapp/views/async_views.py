@@ -0,0 +1,148 @@
+# async_views.py
+from functools import wraps
+
+from django.http import HttpResponse
+from django.utils.cache import patch_vary_headers
+from django.views.decorators.http import require_GET
+from rest_framework import exceptions, status
+from rest_framework.negotiation import DefaultContentNegotiation
+from rest_framework.request import Request
+
+from users.authentication import CachedTokenAuthentication
+
+from ..cache import aget_timeline_snapshot
+from ..conditional import async_timeline_conditional, request_version
+from ..pagination import ChapterPagination, EventPagination
+from ..renderers import MessagePackRenderer, ORJSONRenderer, msgpack
+from ..routers import areplica_for, reads_from
+from ..rows import ChapterPage, EventRows
+from ..serializers import TimelineWindowSerializer, is_summary, requested_fields, wants_stubs
+from ..timeline import abuild_timeline, event_fields_for
+from .event_views import chapter_rows, event_rows
+
+# Async versions of the hot read endpoints, for running under ASGI
+# (djangostuff.asgi). They return the same documents as the DRF views, but
+# never leave the event loop except for the ORM's own database calls.
+
+_renderers = [ORJSONRenderer(), *([MessagePackRenderer()] if msgpack else [])]
+_negotiation = DefaultContentNegotiation()
+_token_auth = CachedTokenAuthentication()
+
+
+def _respond(request, data, status=status.HTTP_200_OK):
+    # The sync endpoints' renderers, picked from Accept (or ?format=) the same
+    # way, so the bytes match
+    if not isinstance(request, Request):
+        request = Request(request)
+    try:
+        renderer, media_type = _negotiation.select_renderer(request, _renderers)
+    except exceptions.NotAcceptable as exc:
+        renderer, media_type = _renderers[0], _renderers[0].media_type
+        data, status = {'detail': exc.detail}, exc.status_code
+    response = HttpResponse(renderer.render(data, media_type), content_type=media_type, status=status)
+    patch_vary_headers(response, ('Accept',))
+    return response
+
+
+def _unauthorized(request, detail):
+    response = _respond(request, {'detail': detail}, status=status.HTTP_401_UNAUTHORIZED)
+    response['WWW-Authenticate'] = _token_auth.authenticate_header(None)
+    return response
+
+
+def async_authenticated(view):
+    """Token or session authentication for async views, 401 like DRF otherwise"""
+    @wraps(view)
+    async def wrapper(request, *args, **kwargs):
+        try:
+            credentials = await _token_auth.aauthenticate(request)
+        except exceptions.AuthenticationFailed as exc:
+            return _unauthorized(request, exc.detail)
+        if credentials is not None:
+            request.user, request.auth = credentials
+        else:
+            request.user = await request.auser()
+            if not request.user.is_authenticated:
+                return _unauthorized(request, exceptions.NotAuthenticated.default_detail)
+        return await view(request, *args, **kwargs)
+
+    return wrapper
+
+
+def async_replica_reads(view):
+    """Serve the view from the read replica when there is one (see myapp.routers)"""
+    @wraps(view)
+    async def wrapper(request, *args, **kwargs):
+        # The ORM's threads get a copy of the context, and so the routing
+        with reads_from(await areplica_for(request.user)):
+            return await view(request, *args, **kwargs)
+
+    return wrapper
+
+
+async def _page(paginator, queryset, query, build):
+    try:
+        page = await paginator.apaginate_queryset(queryset, query)
+    except exceptions.NotFound as exc:
+        return _respond(query, {'detail': exc.detail}, status=status.HTTP_404_NOT_FOUND)
+    return _respond(query, paginator.get_paginated_response(await build(page)).data)
+
+
+@require_GET
+@async_authenticated
+@async_replica_reads
+@async_timeline_conditional
+async def timeline_data(request):
+    """Async GET /api/chapters/timeline_data/"""
+    # DRF's Request only for query_params, the helpers below expect it
+    query = Request(request)
+    window = TimelineWindowSerializer(data=query.query_params)
+    if not window.is_valid():
+        return _respond(request, window.errors, status=status.HTTP_400_BAD_REQUEST)
+    summary = is_summary(query)
+    fields = requested_fields(query)
+    stubs = wants_stubs(query)
+    if window.validated_data or fields:
+        data = await abuild_timeline(
+            request.user,
+            event_fields=event_fields_for(summary=summary, fields=fields),
+            stubs=stubs,
+            **window.validated_data,
+        )
+    else:
+        data = await aget_timeline_snapshot(
+            request.user, summary=summary, version=request_version(request), stubs=stubs
+        )
+    return _respond(request, data)
+
+
+@require_GET
+@async_authenticated
+@async_replica_reads
+@async_timeline_conditional
+async def chapter_list(request):
+    """Async GET /api/chapters/"""
+    query = Request(request)
+    fields = requested_fields(query) or None
+    event_fields = event_fields_for(summary=is_summary(query))
+
+    async def build(page):
+        return await ChapterPage(page, fields=fields, event_fields=event_fields).abuild()
+
+    return await _page(ChapterPagination(), chapter_rows(request.user, fields), query, build)
+
+
+@require_GET
+@async_authenticated
+@async_replica_reads
+@async_timeline_conditional
+async def event_list(request):
+    """Async GET /api/events/"""
+    query = Request(request)
+    fields = event_fields_for(summary=is_summary(query), fields=requested_fields(query))
+    serializer = EventRows(fields)
+
+    async def build(page):
+        return [serializer.to_representation(row) for row in page]
+
+    return await _page(EventPagination(), event_rows(request.user, fields), query, build)
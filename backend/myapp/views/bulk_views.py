@@ -0,0 +1,104 @@
+# bulk_views.py
+from django.db import transaction
+from django.db.models import prefetch_related_objects
+from rest_framework import status
+from rest_framework.decorators import action
+from rest_framework.exceptions import ValidationError
+from rest_framework.response import Response
+
+from ..cache import invalidate_timeline_on_commit
+from ..sync import batched_tombstones
+
+
+def _as_id(value):
+    if isinstance(value, bool):
+        raise ValueError(value)
+    return int(value)
+
+
+class BulkMixin:
+    """
+    Adds POST <list>/bulk/ to a ModelViewSet.
+
+    The body is {"create": [...], "update": [{"id": ..., ...}], "delete": [ids]}.
+    Everything is validated up front with many=True serializers, ownership of
+    the updated/deleted rows is checked in one query, and the changes are
+    applied in one transaction with bulk_create/bulk_update.
+    """
+    bulk_limit = 1000
+    # Relations the response serializer reads, prefetched for all rows at once
+    bulk_prefetch = ()
+
+    def bulk_destroy(self, instances):
+        raise NotImplementedError
+
+    def _bulk_payload(self, data):
+        if not isinstance(data, dict):
+            raise ValidationError({'non_field_errors': ['Expected an object with create/update/delete lists.']})
+
+        payload = {}
+        for key in ('create', 'update', 'delete'):
+            value = data.get(key, [])
+            if not isinstance(value, list):
+                raise ValidationError({key: ['Expected a list.']})
+            payload[key] = value
+        if sum(len(value) for value in payload.values()) > self.bulk_limit:
+            raise ValidationError({'non_field_errors': [f'At most {self.bulk_limit} items per request.']})
+
+        try:
+            for item in payload['update']:
+                item['id'] = _as_id(item['id'])
+        except (KeyError, TypeError, ValueError):
+            raise ValidationError({'update': ['Every update needs a numeric id.']})
+        try:
+            payload['delete'] = [_as_id(pk) for pk in payload['delete']]
+        except (TypeError, ValueError):
+            raise ValidationError({'delete': ['Expected a list of ids.']})
+
+        update_ids = [item['id'] for item in payload['update']]
+        if len(set(update_ids)) != len(update_ids):
+            raise ValidationError({'update': ['Each id may only be updated once.']})
+        if set(update_ids) & set(payload['delete']):
+            raise ValidationError({'non_field_errors': ['Rows cannot be updated and deleted together.']})
+        return payload
+
+    @action(detail=False, methods=['post'])
+    def bulk(self, request):
+        payload = self._bulk_payload(request.data)
+        model = self.get_serializer_class().Meta.model
+
+        update_ids = [item['id'] for item in payload['update']]
+        delete_ids = list(dict.fromkeys(payload['delete']))
+        owned = model.objects.filter(user=request.user, id__in=update_ids + delete_ids).in_bulk()
+        missing = sorted(set(update_ids + delete_ids) - set(owned))
+        if missing:
+            # Not raised as NotFound, which would turn the ids into strings
+            return Response({'missing': missing}, status=status.HTTP_404_NOT_FOUND)
+
+        creator = self.get_serializer(data=payload['create'], many=True)
+        updater = self.get_serializer(
+            [owned[pk] for pk in update_ids], data=payload['update'], many=True, partial=True
+        )
+        create_valid = creator.is_valid()
+        update_valid = updater.is_valid()
+        if not (create_valid and update_valid):
+            return Response(
+                {'create': creator.errors, 'update': updater.errors},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+
+        with transaction.atomic():
+            if delete_ids:
+                with batched_tombstones():
+                    self.bulk_destroy([owned[pk] for pk in delete_ids])
+            updated = updater.save() if update_ids else []
+            created = creator.save(user=request.user) if payload['create'] else []
+            invalidate_timeline_on_commit(request.user.pk)
+
+        if self.bulk_prefetch:
+            prefetch_related_objects(created + updated, *self.bulk_prefetch)
+        return Response({
+            'created': self.get_serializer(created, many=True).data,
+            'updated': self.get_serializer(updated, many=True).data,
+            'deleted': delete_ids,
+        })
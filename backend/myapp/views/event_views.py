@@ -1,68 +1,269 @@
 # viewsets.py
 from rest_framework import viewsets, permissions, status
 from rest_framework.decorators import action
+from rest_framework.exceptions import NotFound
+from rest_framework.renderers import BrowsableAPIRenderer, JSONRenderer
 from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
 from django.contrib.auth import get_user_model
+from django.db.models import Prefetch, Q
+from django.shortcuts import get_object_or_404
+from ..cache import get_timeline_snapshot, snapshot_stats
+from ..conditional import request_version, timeline_conditional
+from ..deletion import soft_delete_chapters, soft_delete_events, soft_delete_subtree
+from ..lineage import ancestry, subtree
 from ..models import Chapter, Event
-from ..serializers import ChapterSerializer, EventSerializer
+from ..pagination import ChapterPagination, EventPagination
+from ..periods import period_index
+from ..rows import CHAPTER_SCALARS, ChapterPage, ChapterRows, EventRows
+from ..search import search_events
+from ..serializers import (
+    ActivePeriodsSerializer,
+    ChapterSerializer,
+    EventSerializer,
+    TimelineWindowSerializer,
+    is_summary,
+    requested_fields,
+    wants_stubs,
+)
+from ..timeline import build_timeline, event_fields_for
+from .bulk_views import BulkMixin
+from .replica_views import ReplicaReadsMixin
 
 User = get_user_model()
 
-class ChapterViewSet(viewsets.ModelViewSet):
+
+def chapter_queryset(user, summary=False):
+    """The user's chapters with every relation ChapterSerializer reads prefetched"""
+    # Complete orderings, so ties come out the same as from the list fast path
+    events = Event.objects.order_by('date', 'order', 'id')
+    queryset = Chapter.objects.filter(user=user).select_related(
+        'parent_branch', 'source_entry', 'source_chapter'
+    )
+    if not summary:
+        events = events.select_related('body')
+    return queryset.prefetch_related(
+        Prefetch('entries', queryset=events),
+        Prefetch('branch_entries', queryset=events),
+        Prefetch('periods', queryset=Chapter.objects.order_by('order', 'start_date', 'id')),
+        Prefetch('periods__entries', queryset=events),
+        Prefetch('periods__branch_entries', queryset=events),
+    )
+
+
+def event_queryset(user, request):
+    queryset = Event.objects.filter(user=user).select_related('chapter', 'branch')
+    fields = requested_fields(request)
+    if not (is_summary(request) or (fields and 'content' not in fields)):
+        queryset = queryset.select_related('body')
+    return queryset
+
+
+def chapter_rows(user, fields=None):
+    """values() rows for ChapterRows(fields), with the pagination columns"""
+    columns = dict.fromkeys([*ChapterRows(fields).values(), *ChapterPagination.ordering])
+    return Chapter.objects.filter(user=user).values(*columns)
+
+
+def event_rows(user, event_fields=None):
+    """values() rows for EventRows(event_fields), with the pagination columns"""
+    events = EventRows(event_fields)
+    columns = dict.fromkeys([*events.values(), *EventPagination.ordering])
+    return events.annotate(Event.objects.filter(user=user)).values(*columns)
+
+
+class ChapterViewSet(ReplicaReadsMixin, BulkMixin, viewsets.ModelViewSet):
     serializer_class = ChapterSerializer
     permission_classes = [permissions.IsAuthenticated]  # Changed from AllowAny
+    pagination_class = ChapterPagination
+    bulk_prefetch = ('entries', 'branch_entries', 'periods__entries', 'periods__branch_entries')
+    replica_actions = (*ReplicaReadsMixin.replica_actions, 'subtree', 'ancestors', 'expand', 'active', 'overlaps')
 
     def get_queryset(self):
+        if self.action in ('destroy', 'subtree'):
+            # Only the id is needed, see perform_destroy
+            return Chapter.objects.filter(user=self.request.user)
         # Remove the get_or_create, use the actual authenticated user
-        return Chapter.objects.filter(user=self.request.user).select_related(
-            'parent_branch', 'source_entry', 'source_chapter'
-        ).prefetch_related('entries', 'periods', 'branch_entries')
+        return chapter_queryset(self.request.user, summary=is_summary(self.request))
+
+    @timeline_conditional
+    def list(self, request, *args, **kwargs):
+        # Reads go through the row serializers, writes through ChapterSerializer
+        fields = requested_fields(request) or None
+        page = self.paginate_queryset(chapter_rows(request.user, fields))
+        return self.get_paginated_response(ChapterPage(
+            page, fields=fields, event_fields=event_fields_for(summary=is_summary(request))
+        ).build())
 
     def perform_create(self, serializer):
         # Remove the get_or_create, use the actual authenticated user
         serializer.save(user=self.request.user)
 
     def perform_destroy(self, instance):
-        if instance.type == 'branch':
-            instance.periods.all().delete()
-        instance.delete()
+        # Hides the chapter and its periods; the rows are purged in the background
+        soft_delete_chapters([instance.pk])
+
+    def bulk_destroy(self, instances):
+        soft_delete_chapters([instance.pk for instance in instances])
 
     @action(detail=False, methods=['get'])
+    @timeline_conditional
     def timeline_data(self, request):
-        # Remove the get_or_create, use the actual authenticated user
-        main_periods = Chapter.objects.filter(
-            user=request.user,  # Changed
-            type='main_period',
-            parent_branch__isnull=True
-        ).prefetch_related('entries').order_by('order', 'start_date')
-        
-        branches = Chapter.objects.filter(
-            user=request.user,  # Changed
-            type='branch',
-            parent_branch__isnull=True
-        ).prefetch_related(
-            'periods__entries',
-            'branch_entries'
-        ).order_by('order', 'start_date')
-        
-        return Response({
-            'main_timeline': ChapterSerializer(main_periods, many=True).data,
-            'branches': ChapterSerializer(branches, many=True).data,
-        })
+        window = TimelineWindowSerializer(data=request.query_params)
+        window.is_valid(raise_exception=True)
+        summary = is_summary(request)
+        fields = requested_fields(request)
+        stubs = wants_stubs(request)
+        if window.validated_data or fields:
+            # Windowed and field-selected reads are built directly, not cached
+            return Response(build_timeline(
+                request.user,
+                event_fields=event_fields_for(summary=summary, fields=fields),
+                stubs=stubs,
+                **window.validated_data,
+            ))
+        return Response(get_timeline_snapshot(
+            request.user, summary=summary, version=request_version(request), stubs=stubs
+        ))
 
+    @action(detail=False, methods=['get'], permission_classes=[permissions.IsAdminUser])
+    def cache_stats(self, request):
+        return Response(snapshot_stats())
 
-class EventViewSet(viewsets.ModelViewSet):
+    @action(detail=False, methods=['get'])
+    def active(self, request):
+        """
+        The main and branch periods covering ?date=, latest start first;
+        ?branch= keeps that branch's periods only
+        """
+        query = ActivePeriodsSerializer(data=request.query_params)
+        query.is_valid(raise_exception=True)
+        scope = {'branch': query.validated_data['branch']} if 'branch' in query.validated_data else {}
+        ids = [period.id for period in period_index(request.user.pk).active(query.validated_data['date'], **scope)]
+        serializer = ChapterRows(CHAPTER_SCALARS)
+        rows = {row['id']: row for row in Chapter.objects.filter(user=request.user, pk__in=ids).values(*serializer.values())}
+        # In index order; a period deleted since the index was built is left out
+        return Response([serializer.to_representation(rows[pk]) for pk in ids if pk in rows])
+
+    @action(detail=False, methods=['get'])
+    def overlaps(self, request):
+        """
+        Periods of the same timeline (the main one, or a branch) that share
+        days, with the first and last of them (last null: both are ongoing)
+        """
+        return Response([
+            {'chapters': [a.id, b.id], 'first': first, 'last': last}
+            for a, b, first, last in period_index(request.user.pk).overlaps()
+        ])
+
+    @action(detail=True, methods=['get', 'delete'])
+    def subtree(self, request, pk=None):
+        """
+        GET: the chapter and everything below it (periods, branches spawned
+        from it or its entries, recursively) as a flat list, each chapter with
+        its depth below this one. DELETE: delete all of it, entries included.
+        """
+        if request.method == 'DELETE':
+            soft_delete_subtree(self.get_object().pk)
+            return Response(status=status.HTTP_204_NO_CONTENT)
+        serializer = ChapterRows(CHAPTER_SCALARS)
+        rows = list(subtree(pk).filter(user=request.user).values(*serializer.values(), 'depth'))
+        if not rows or rows[0]['depth'] != 0:
+            raise NotFound()
+        return Response([{**serializer.to_representation(row), 'depth': row['depth']} for row in rows])
+
+    @action(detail=True, methods=['get'])
+    def ancestors(self, request, pk=None):
+        """Breadcrumbs: the chapters above this one, root first, then itself"""
+        rows = list(ancestry(pk).filter(user=request.user).values('id', 'title', 'type', 'depth'))
+        if not rows or rows[-1]['depth'] != 0:
+            raise NotFound()
+        return Response(rows)
+
+    @action(detail=True, methods=['get'], pagination_class=EventPagination)
+    @timeline_conditional
+    def expand(self, request, pk=None):
+        """
+        What a collapsed chapter's stub in timeline_data?stubs=1 leaves out. `periods`:
+        a branch's periods, as stubs would show them (fields and aggregates,
+        no entries). `results`: the entries of the chapter, and of a branch's
+        open periods, keyset-paged in (date, order, id) order.
+        """
+        chapter = get_object_or_404(Chapter.objects.filter(user=request.user).values('id', 'type'), pk=pk)
+        periods = []
+        holders = Q(chapter_id=chapter['id']) | Q(branch_id=chapter['id'])
+        if chapter['type'] == 'branch':
+            serializer = ChapterRows(CHAPTER_SCALARS)
+            periods = [
+                serializer.to_representation(row)
+                for row in Chapter.objects.filter(parent_branch_id=chapter['id'])
+                .order_by('order', 'start_date', 'id')
+                .values(*serializer.values())
+            ]
+            holders |= Q(chapter_id__in=[row['id'] for row in periods if not row['collapsed']])
+
+        fields = event_fields_for(summary=is_summary(request), fields=requested_fields(request))
+        page = self.paginate_queryset(event_rows(request.user, fields).filter(holders))
+        serializer = EventRows(fields)
+        response = self.get_paginated_response([serializer.to_representation(row) for row in page])
+        response.data['periods'] = periods
+        return response
+
+
+class EventViewSet(ReplicaReadsMixin, BulkMixin, viewsets.ModelViewSet):
     serializer_class = EventSerializer
     permission_classes = [permissions.IsAuthenticated]  # Changed from AllowAny
+    pagination_class = EventPagination
+    bulk_prefetch = ('body',)
 
     def get_queryset(self):
+        if self.action == 'destroy':
+            return Event.objects.filter(user=self.request.user)
         # Remove the get_or_create, use the actual authenticated user
-        return Event.objects.filter(user=self.request.user).select_related('chapter', 'branch')
+        return event_queryset(self.request.user, self.request)
+
+    @timeline_conditional
+    def list(self, request, *args, **kwargs):
+        # Reads go through the row serializers, writes through EventSerializer
+        fields = event_fields_for(summary=is_summary(request), fields=requested_fields(request))
+        page = self.paginate_queryset(event_rows(request.user, fields))
+        serializer = EventRows(fields)
+        return self.get_paginated_response([serializer.to_representation(row) for row in page])
 
     def perform_create(self, serializer):
         # Remove the get_or_create, use the actual authenticated user
         serializer.save(user=self.request.user)
 
     def perform_destroy(self, instance):
-        instance.spawned_branches.all().delete()
-        instance.delete()
\ No newline at end of file
+        # Hides the event and the branches spawned from it, purged in the background
+        soft_delete_events([instance.pk])
+
+    def bulk_destroy(self, instances):
+        soft_delete_events([instance.pk for instance in instances])
+
+    # The stdlib encoder, so rank floats keep their usual form (see ORJSONRenderer)
+    @action(detail=False, methods=['get'], renderer_classes=[JSONRenderer, BrowsableAPIRenderer])
+    def search(self, request):
+        """Ranked full-text search: ?q=words&page=2&page_size=20"""
+        query = request.query_params.get('q', '')
+        try:
+            page = max(1, int(request.query_params.get('page', 1)))
+            size = max(1, min(int(request.query_params.get('page_size', 20)), 100))
+        except ValueError:
+            return Response({'error': 'page and page_size must be numbers'}, status=status.HTTP_400_BAD_REQUEST)
+
+        # One extra row tells us whether there is a next page
+        results = search_events(request.user, query, limit=size + 1, offset=(page - 1) * size)
+        url = request.build_absolute_uri()
+        next_link = replace_query_param(url, 'page', page + 1) if len(results) > size else None
+        if page == 1:
+            previous_link = None
+        elif page == 2:
+            previous_link = remove_query_param(url, 'page')
+        else:
+            previous_link = replace_query_param(url, 'page', page - 1)
+        return Response({
+            'next': next_link,
+            'previous': previous_link,
+            'results': results[:size],
+        })
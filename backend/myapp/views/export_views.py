@@ -0,0 +1,36 @@
+# export_views.py
+from django.http import StreamingHttpResponse
+from django.utils import timezone
+from rest_framework.decorators import api_view, permission_classes, renderer_classes
+from rest_framework.permissions import IsAuthenticated
+from rest_framework.renderers import JSONRenderer
+
+from ..export import export_stream
+from ..renderers import NDJSONRenderer
+from ..routers import replica_for, stream_reads_from
+
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+@renderer_classes([NDJSONRenderer, JSONRenderer])
+def export_journal(request):
+    """
+    Stream the user's whole journal. NDJSON by default, ?format=json for a
+    single JSON document, ?gzip=1 for a gzipped download.
+    """
+    fmt = request.accepted_renderer.format
+    compress = request.query_params.get('gzip') in ('1', 'true')
+
+    filename = f'tree-export-{timezone.now():%Y%m%d}.{fmt}'
+    content_type = request.accepted_renderer.media_type
+    if compress:
+        filename += '.gz'
+        content_type = 'application/gzip'
+
+    # Read from the replica (if any) as the body streams, after this returns
+    response = StreamingHttpResponse(
+        stream_reads_from(export_stream(request.user, fmt=fmt, compress=compress), replica_for(request.user)),
+        content_type=content_type,
+    )
+    response['Content-Disposition'] = f'attachment; filename="{filename}"'
+    return response
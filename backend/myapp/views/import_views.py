@@ -0,0 +1,24 @@
+# import_views.py
+from rest_framework import status
+from rest_framework.decorators import api_view, parser_classes, permission_classes
+from rest_framework.parsers import JSONParser
+from rest_framework.permissions import IsAuthenticated
+from rest_framework.response import Response
+
+from ..importer import ImportFormatError, TimelineImporter
+from ..parsers import NDJSONParser
+
+
+@api_view(['POST'])
+@permission_classes([IsAuthenticated])
+@parser_classes([JSONParser, NDJSONParser])
+def import_timeline(request):
+    """
+    Import a nested {"mainTimeline", "branches"} timeline or an export
+    (NDJSON or JSON) into the user's journal. Safe to retry.
+    """
+    try:
+        stats = TimelineImporter(request.user).load(request.data).run()
+    except ImportFormatError as exc:
+        return Response({'error': str(exc)}, status=status.HTTP_400_BAD_REQUEST)
+    return Response(stats, status=status.HTTP_201_CREATED)
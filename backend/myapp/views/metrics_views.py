@@ -0,0 +1,23 @@
+# metrics_views.py
+from django.http import HttpResponse
+from rest_framework.decorators import api_view, permission_classes
+from rest_framework.permissions import IsAdminUser
+
+from ..cache import snapshot_stats
+from ..metrics import request_metrics
+
+
+@api_view(['GET'])
+@permission_classes([IsAdminUser])
+def metrics(request):
+    """Request histograms and timeline cache counters in Prometheus text format"""
+    cache = snapshot_stats()
+    extra = [
+        ('tree_timeline_cache_hits_total', 'counter', 'Timeline snapshot cache hits.', cache['hits']),
+        ('tree_timeline_cache_misses_total', 'counter', 'Timeline snapshot cache misses.', cache['misses']),
+        ('tree_timeline_cache_invalidations_total', 'counter', 'Timeline snapshot invalidations.', cache['invalidations']),
+    ]
+    return HttpResponse(
+        request_metrics.render(extra),
+        content_type='text/plain; version=0.0.4; charset=utf-8',
+    )
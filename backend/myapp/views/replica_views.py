@@ -0,0 +1,30 @@
+# replica_views.py
+from rest_framework.permissions import SAFE_METHODS
+
+from ..routers import replica_for, reset_reads, route_reads
+
+
+class ReplicaReadsMixin:
+    """
+    Serves a viewset's `replica_actions` from the read replica when there is
+    one (see myapp.routers). The choice is made once the request is
+    authenticated, so a user who just wrote stays on the primary.
+    """
+    replica_actions = ('list', 'timeline_data', 'search')
+
+    _replica_token = None
+
+    def dispatch(self, request, *args, **kwargs):
+        # Reset however the request ends, including with an exception DRF
+        # does not handle, so the thread's next request starts on the primary
+        try:
+            return super().dispatch(request, *args, **kwargs)
+        finally:
+            if self._replica_token is not None:
+                reset_reads(self._replica_token)
+                self._replica_token = None
+
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        if request.method in SAFE_METHODS and self.action in self.replica_actions:
+            self._replica_token = route_reads(replica_for(request.user))
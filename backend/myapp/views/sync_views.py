@@ -0,0 +1,35 @@
+# sync_views.py
+from rest_framework import status
+from rest_framework.decorators import api_view, permission_classes
+from rest_framework.permissions import IsAuthenticated
+from rest_framework.response import Response
+
+from ..serializers import is_summary
+from ..sync import DEFAULT_LIMIT, MAX_LIMIT, CursorError, changes_since, parse_cursor
+from ..timeline import event_fields_for
+
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def changes(request):
+    """
+    Delta sync: ?since=<cursor>&limit=500, plus ?view=summary to leave out
+    event content. Returns the rows changed and ids deleted since the cursor,
+    and the cursor to send next time. A cursor the server cannot serve gets
+    410, and the client should sync again from since=0.
+    """
+    try:
+        since = parse_cursor(request.query_params.get('since'))
+        limit = max(1, min(int(request.query_params.get('limit', DEFAULT_LIMIT)), MAX_LIMIT))
+    except ValueError as exc:
+        message = str(exc) if isinstance(exc, CursorError) else 'limit must be a number'
+        return Response({'error': message}, status=status.HTTP_400_BAD_REQUEST)
+
+    try:
+        data = changes_since(
+            request.user, since, limit,
+            event_fields=event_fields_for(summary=is_summary(request)),
+        )
+    except CursorError as exc:
+        return Response({'error': str(exc)}, status=status.HTTP_410_GONE)
+    return Response(data)
@@ -0,0 +1,186 @@
+# authentication.py
+import copy
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.dummy import DummyCache
+from django.core.cache.backends.locmem import LocMemCache
+from django.utils.translation import gettext_lazy as _
+from rest_framework import exceptions
+from rest_framework.authentication import TokenAuthentication, get_authorization_header
+
+# In-process entries per worker, and how long (seconds) each may be served
+# without looking further. Other workers only notice a logout or deactivation
+# when their entry expires, so keep the TTL short.
+LOCAL_SIZE = getattr(settings, 'AUTH_TOKEN_CACHE_SIZE', 1024)
+LOCAL_TTL = getattr(settings, 'AUTH_TOKEN_CACHE_TTL', 30)
+# Seconds an entry lives in the Django cache. Only a cache all workers share
+# can be told about a logout everywhere, so on a per-process backend (locmem)
+# that level is skipped and LOCAL_TTL bounds how long a revoked token works.
+SHARED_TIMEOUT = getattr(settings, 'AUTH_TOKEN_CACHE_TIMEOUT', 300)
+
+
+class LRUCache:
+    """Bounded, thread-safe LRU with a per-entry TTL"""
+
+    def __init__(self, size, ttl):
+        self.size = size
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._data = OrderedDict()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return None
+            value, expires = entry
+            if expires < time.monotonic():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        if self.size <= 0 or self.ttl <= 0:
+            return
+        with self._lock:
+            self._data[key] = (value, time.monotonic() + self.ttl)
+            self._data.move_to_end(key)
+            while len(self._data) > self.size:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def delete_where(self, predicate):
+        with self._lock:
+            for key in [key for key, (value, _) in self._data.items() if predicate(value)]:
+                del self._data[key]
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+
+local_tokens = LRUCache(LOCAL_SIZE, LOCAL_TTL)
+
+
+def _detached(user):
+    # A copy without cached relations (e.g. user.auth_token), so cached and
+    # per-request instances never share state
+    user = copy.copy(user)
+    user._state.fields_cache = {}
+    return user
+
+
+def _shared_key(key):
+    # Never put raw tokens into cache keys (file names for the file cache)
+    return 'auth:token:' + hashlib.sha256(key.encode()).hexdigest()
+
+
+def shared_cache():
+    """The Django cache for the second level; None when it is off or per-process"""
+    backend = caches['default']
+    if SHARED_TIMEOUT <= 0 or isinstance(backend, (LocMemCache, DummyCache)):
+        return None
+    return backend
+
+
+def forget_token(key):
+    """Drop a token from both cache levels, e.g. after it was deleted"""
+    local_tokens.delete(key)
+    shared = shared_cache()
+    if shared is not None:
+        shared.delete(_shared_key(key))
+
+
+def forget_user(user_id, keys=()):
+    """Drop every cached token of a user, e.g. after the user changed"""
+    local_tokens.delete_where(lambda user: user.pk == user_id)
+    shared = shared_cache()
+    if shared is not None:
+        shared.delete_many([_shared_key(key) for key in keys])
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    """
+    Drop-in TokenAuthentication that remembers token -> user, so a request
+    with a known token costs no query.
+
+    Lookups go to a per-process LRU first, then the Django cache when it is
+    shared between workers, then the database. Deleting a token (logout) or
+    saving its user (e.g. deactivation) clears the shared level and this
+    worker's LRU through signals (see users.signals); other workers' LRU
+    entries expire within LOCAL_TTL. Bulk QuerySet.update() on users bypasses
+    the signals.
+    """
+
+    def authenticate_credentials(self, key):
+        user = local_tokens.get(key)
+        if user is None:
+            shared = shared_cache()
+            user = shared.get(_shared_key(key)) if shared is not None else None
+            if user is None:
+                user, token = super().authenticate_credentials(key)
+                cached = self._remember(key, user)
+                if shared is not None:
+                    shared.set(_shared_key(key), cached, SHARED_TIMEOUT)
+                return user, token
+            local_tokens.set(key, user)
+        return self._from_cache(key, user)
+
+    async def aauthenticate(self, request):
+        """
+        authenticate() for async views: (user, token), or None when the
+        request carries no token
+        """
+        auth = get_authorization_header(request).split()
+        if not auth or auth[0].lower() != self.keyword.lower().encode():
+            return None
+        if len(auth) != 2:
+            raise exceptions.AuthenticationFailed(_('Invalid token header.'))
+        try:
+            key = auth[1].decode()
+        except UnicodeError:
+            raise exceptions.AuthenticationFailed(_('Invalid token header.'))
+        return await self.aauthenticate_credentials(key)
+
+    async def aauthenticate_credentials(self, key):
+        user = local_tokens.get(key)
+        if user is None:
+            shared = shared_cache()
+            user = await shared.aget(_shared_key(key)) if shared is not None else None
+            if user is None:
+                model = self.get_model()
+                try:
+                    token = await model.objects.select_related('user').aget(key=key)
+                except model.DoesNotExist:
+                    raise exceptions.AuthenticationFailed(_('Invalid token.'))
+                if not token.user.is_active:
+                    raise exceptions.AuthenticationFailed(_('User inactive or deleted.'))
+                cached = self._remember(key, token.user)
+                if shared is not None:
+                    await shared.aset(_shared_key(key), cached, SHARED_TIMEOUT)
+                return token.user, token
+            local_tokens.set(key, user)
+        return self._from_cache(key, user)
+
+    def _remember(self, key, user):
+        cached = _detached(user)
+        local_tokens.set(key, cached)
+        return cached
+
+    def _from_cache(self, key, user):
+        if not user.is_active:
+            raise exceptions.AuthenticationFailed(_('User inactive or deleted.'))
+        user = _detached(user)
+        return user, self.get_model()(key=key, user=user)
@@ -0,0 +1,71 @@
+# hashing.py
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeout
+
+from django.conf import settings
+from django.contrib.auth.hashers import PBKDF2PasswordHasher
+from django.utils.translation import gettext_lazy as _
+from rest_framework import status
+from rest_framework.exceptions import APIException
+
+# Hashes run at once per process. PBKDF2 takes a core for about half a second
+# and releases the GIL, so this caps how much CPU sign-ins can take from reads.
+HASH_WORKERS = getattr(settings, 'PASSWORD_HASH_WORKERS', max(1, (os.cpu_count() or 2) // 2))
+# Hashes that may wait for a worker; any beyond get a 503 at once. Waiting
+# requests hold their server thread, so keep this small.
+HASH_QUEUE = getattr(settings, 'PASSWORD_HASH_QUEUE', HASH_WORKERS)
+# Seconds a request waits for its hash before giving up with a 503
+HASH_TIMEOUT = getattr(settings, 'PASSWORD_HASH_TIMEOUT', 5)
+
+
+class HashingBusy(APIException):
+    status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+    default_detail = _('Too many sign-ins at once, try again shortly.')
+    default_code = 'hashing_busy'
+    # Sent as Retry-After by DRF's exception handler
+    wait = 1
+
+
+class BoundedExecutor:
+    """
+    Thread pool that runs at most `workers` calls at once, lets `queue` more
+    wait, and turns the rest away with HashingBusy rather than queueing them
+    without bound. A call that has waited `timeout` seconds gets HashingBusy
+    too; it still runs, and holds its place until it has.
+    """
+
+    def __init__(self, workers, queue, timeout=None):
+        self.timeout = timeout
+        self._slots = threading.BoundedSemaphore(workers + queue)
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='hash')
+
+    def run(self, fn, *args):
+        if not self._slots.acquire(blocking=False):
+            raise HashingBusy()
+        try:
+            future = self._pool.submit(fn, *args)
+        except BaseException:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda _: self._slots.release())
+        try:
+            return future.result(timeout=self.timeout)
+        except FutureTimeout:
+            raise HashingBusy()
+
+
+executor = BoundedExecutor(HASH_WORKERS, HASH_QUEUE, HASH_TIMEOUT)
+
+
+class BoundedPBKDF2PasswordHasher(PBKDF2PasswordHasher):
+    """
+    PBKDF2PasswordHasher that hashes on `executor`. Every hash goes through
+    it: setting a password, checking one at login, and the dummy hash Django
+    runs for unknown emails. The algorithm name is the stock one, so existing
+    hashes keep verifying; list this hasher instead of PBKDF2PasswordHasher.
+    """
+
+    def encode(self, password, salt, iterations=None):
+        return executor.run(super().encode, password, salt, iterations)
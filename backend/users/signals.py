@@ -0,0 +1,27 @@
+# signals.py
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from rest_framework.authtoken.models import Token
+
+from .authentication import forget_token, forget_user
+from .models import CustomUser
+
+# Each cache is cleared now and again on commit, in case a concurrent request
+# cached the pre-commit row in between
+
+
+@receiver(post_delete, sender=Token)
+def token_deleted(sender, instance, **kwargs):
+    key = instance.key
+    forget_token(key)
+    transaction.on_commit(lambda: forget_token(key))
+
+
+@receiver(post_save, sender=CustomUser)
+def user_changed(sender, instance, **kwargs):
+    # Cached users must not outlive a deactivation or permission change
+    user_id = instance.pk
+    keys = list(Token.objects.filter(user_id=user_id).values_list('key', flat=True))
+    forget_user(user_id, keys)
+    transaction.on_commit(lambda: forget_user(user_id, keys))
@@ -1,3 +1,131 @@
-from django.test import TestCase
+import tempfile
+import threading
 
-# Create your tests here.
+from django.core.cache import caches
+from django.test import TestCase, override_settings
+from rest_framework.authtoken.models import Token
+
+from . import hashing
+from .authentication import _shared_key, local_tokens, shared_cache
+from .hashing import BoundedExecutor, HashingBusy
+from .models import CustomUser
+
+FAST_HASHERS = ['django.contrib.auth.hashers.MD5PasswordHasher']
+
+
+@override_settings(PASSWORD_HASHERS=FAST_HASHERS)
+class AuthThrottleTests(TestCase):
+    def setUp(self):
+        caches['throttle'].clear()
+        CustomUser.objects.create_user(email='reader@example.com', password='pw')
+
+    def login(self, email, password='wrong', ip='10.0.0.1'):
+        return self.client.post(
+            '/api/users/login/', {'email': email, 'password': password}, REMOTE_ADDR=ip
+        )
+
+    def test_per_email(self):
+        # 5/min per address, whichever IP the attempts come from
+        for i in range(5):
+            self.assertEqual(self.login('Reader@example.com', ip=f'10.0.0.{i}').status_code, 401)
+        response = self.login('reader@example.com', password='pw', ip='10.0.1.1')
+        self.assertEqual(response.status_code, 429)
+        self.assertIn('Retry-After', response)
+        self.assertEqual(self.login('other@example.com', ip='10.0.1.1').status_code, 401)
+
+    def test_per_ip(self):
+        # 20/min per IP, login and register together
+        for i in range(20):
+            path = '/api/users/register/' if i % 2 else '/api/users/login/'
+            self.client.post(path, {'email': f'user{i}@example.com', 'password': 'pw'}, REMOTE_ADDR='10.0.0.1')
+        self.assertEqual(self.login('reader@example.com', password='pw').status_code, 429)
+        self.assertEqual(self.login('reader@example.com', password='pw', ip='10.0.0.2').status_code, 200)
+
+
+class BoundedHashingTests(TestCase):
+    def setUp(self):
+        caches['throttle'].clear()
+        self.user = CustomUser.objects.create_user(email='reader@example.com', password='pw')
+        self.default = hashing.executor
+        self.addCleanup(setattr, hashing, 'executor', self.default)
+
+    def test_executor_bounds_concurrency(self):
+        executor = BoundedExecutor(workers=1, queue=0)
+        started, release = threading.Event(), threading.Event()
+
+        def hold():
+            started.set()
+            release.wait()
+
+        blocker = threading.Thread(target=executor.run, args=(hold,))
+        blocker.start()
+        started.wait()
+        with self.assertRaises(HashingBusy):
+            executor.run(len, 'x')
+        release.set()
+        blocker.join()
+        self.assertEqual(executor.run(len, 'x'), 1)
+
+        with self.assertRaises(HashingBusy):
+            BoundedExecutor(workers=1, queue=0, timeout=0.01).run(threading.Event().wait, 0.5)
+
+    def test_busy_sign_in_gets_503(self):
+        hashing.executor = BoundedExecutor(workers=1, queue=0)
+        release = threading.Event()
+        started = threading.Event()
+        blocker = threading.Thread(
+            target=hashing.executor.run, args=(lambda: (started.set(), release.wait()),)
+        )
+        blocker.start()
+        started.wait()
+        try:
+            for path in ('/api/users/login/', '/api/users/register/'):
+                response = self.client.post(path, {'email': 'new@example.com', 'password': 'pw'})
+                self.assertEqual(response.status_code, 503)
+                self.assertEqual(response['Retry-After'], '1')
+        finally:
+            release.set()
+            blocker.join()
+        self.assertFalse(CustomUser.objects.filter(email='new@example.com').exists())
+
+        response = self.client.post('/api/users/login/', {'email': 'reader@example.com', 'password': 'pw'})
+        self.assertEqual(response.status_code, 200)
+
+
+class CachedTokenAuthenticationTests(TestCase):
+    def setUp(self):
+        local_tokens.clear()
+        self.addCleanup(local_tokens.clear)
+        self.user = CustomUser.objects.create_user(email='reader@example.com', password='pw')
+        self.token = Token.objects.create(user=self.user)
+
+    def get(self):
+        return self.client.get('/api/events/', HTTP_AUTHORIZATION=f'Token {self.token.key}')
+
+    def test_deleted_token_is_refused(self):
+        self.assertEqual(self.get().status_code, 200)
+        self.token.delete()
+        self.assertEqual(self.get().status_code, 401)
+
+    def test_deactivated_user_is_refused(self):
+        self.assertEqual(self.get().status_code, 200)
+        self.user.is_active = False
+        self.user.save()
+        self.assertEqual(self.get().status_code, 401)
+
+    def test_shared_level_needs_a_shared_cache(self):
+        # A locmem cache is per worker, where a logout elsewhere never reaches
+        self.assertIsNone(shared_cache())
+        self.assertEqual(self.get().status_code, 200)
+        self.assertIsNone(caches['default'].get(_shared_key(self.token.key)))
+
+        with tempfile.TemporaryDirectory() as location, override_settings(CACHES={
+            'default': {'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache', 'LOCATION': location},
+        }):
+            local_tokens.clear()
+            self.assertEqual(self.get().status_code, 200)
+            self.assertIsNotNone(shared_cache().get(_shared_key(self.token.key)))
+            # Another worker, without an entry of its own, sees the logout
+            self.token.delete()
+            local_tokens.clear()
+            self.assertEqual(self.get().status_code, 401)
@@ -0,0 +1,31 @@
+# throttling.py
+import hashlib
+
+from django.core.cache import caches
+from rest_framework.throttling import SimpleRateThrottle
+
+# A cache of its own (see CACHES): local to the process, so counting costs
+# no I/O and a flood cannot evict timeline snapshots
+throttle_cache = caches['throttle']
+
+
+class AuthIPThrottle(SimpleRateThrottle):
+    """Login and register attempts per client IP (see NUM_PROXIES)"""
+    scope = 'auth_ip'
+    cache = throttle_cache
+
+    def get_cache_key(self, request, view):
+        return self.cache_format % {'scope': self.scope, 'ident': self.get_ident(request)}
+
+
+class AuthEmailThrottle(SimpleRateThrottle):
+    """Login and register attempts per email address, whichever IP they come from"""
+    scope = 'auth_email'
+    cache = throttle_cache
+
+    def get_cache_key(self, request, view):
+        email = request.data.get('email') if hasattr(request.data, 'get') else None
+        if not isinstance(email, str) or not email.strip():
+            return None
+        ident = hashlib.sha256(email.strip().lower().encode()).hexdigest()
+        return self.cache_format % {'scope': self.scope, 'ident': ident}